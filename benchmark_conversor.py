@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: serialização JSON de um catálogo grande (json padrão × serializar_json,
+genérico e com produtos=True), com o custo da procura por floats à parte.
+
+Uso: python benchmark_conversor.py [quantidade_produtos]   (padrão: 100000)
+"""
+
+import json
+import os
+import sys
+import time
+
+# Adicionar o diretório ao path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from conversor_catalogo_siscomex import (
+    ConversorCatalogoSiscomex, serializar_json, orjson, _contem_float, _produtos_contem_float,
+)
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+JSON_ORIGINAL = os.path.join(DIRETORIO, "CATALOGO_PRODUTOS_25940099_20260220031001.json")
+
+
+def montar_catalogo(quantidade: int) -> list:
+    """Replica os produtos do JSON de exemplo até `quantidade` itens (formato completo)."""
+    with open(JSON_ORIGINAL, 'r', encoding='utf-8') as f:
+        base = json.load(f)
+    produtos = []
+    for i in range(quantidade):
+        produto = dict(base[i % len(base)])
+        produto["codigo"] = i + 1
+        produtos.append(produto)
+    return ConversorCatalogoSiscomex().gerar_json_completo(produtos)
+
+
+def medir(funcao, dados, repeticoes: int = 3) -> float:
+    """Menor tempo (s) entre as repetições."""
+    melhor = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(dados)
+        duracao = time.perf_counter() - inicio
+        melhor = duracao if melhor is None else min(melhor, duracao)
+    return melhor
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"Montando catálogo com {quantidade} produtos...")
+    dados = montar_catalogo(quantidade)
+
+    t_json = medir(lambda d: json.dumps(d, ensure_ascii=False, indent=2), dados)
+    t_ser = medir(serializar_json, dados)
+    t_prod = medir(lambda d: serializar_json(d, produtos=True), dados)
+    t_float = medir(_contem_float, dados)
+    t_float_prod = medir(_produtos_contem_float, dados)
+    tamanho_mb = len(serializar_json(dados).encode('utf-8')) / (1024 * 1024)
+
+    print(f"\nBackend de serializar_json: {'orjson' if orjson is not None else 'json (padrão)'}")
+    print(f"Tamanho do JSON: {tamanho_mb:.1f} MB")
+    print(f"  json.dumps(indent=2): {t_json:.3f} s")
+    print(f"  serializar_json:      {t_ser:.3f} s  ({t_json / t_ser:.1f}x)")
+    print(f"  ... produtos=True:    {t_prod:.3f} s  ({t_json / t_prod:.1f}x)")
+    print("Procura por floats (decide se o orjson pode ser usado):")
+    print(f"  payload inteiro:      {t_float:.3f} s")
+    print(f"  campos de produto:    {t_float_prod:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -23,12 +23,20 @@ Formatos de saída:
 Genérico: funciona para qualquer empresa (CNPJ configurável).
 """
 
+import bisect
+import contextlib
+import hashlib
+import io
 import json
+import math
 import os
+import random
 import sys
 import re
+import time
 import zipfile
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time as dt_time
 
 try:
     import openpyxl
@@ -41,6 +49,11 @@ except ImportError:
     print("=" * 70)
     sys.exit(1)
 
+try:
+    import orjson  # Opcional: serialização JSON mais rápida
+except ImportError:
+    orjson = None
+
 
 # ============================================================================
 # CONSTANTES E VALIDAÇÕES DA API CATP
@@ -66,6 +79,10 @@ MAX_CODIGO_INTERNO = 60
 MAX_VALOR_ATRIBUTO = 3000
 MAX_CPF_CNPJ_RAIZ = 14  # CNPJ raiz = 8, CPF = 11, mas campo aceita até 14
 
+# Verificação rápida por amostragem (linhas sorteadas e orçamento de tempo)
+AMOSTRA_TAMANHO_PADRAO = 400
+AMOSTRA_ORCAMENTO_S = 1.0
+
 # Campos read-only (gerados pelo servidor, NÃO enviar no POST)
 CAMPOS_READ_ONLY = ["seq", "versao"]
 
@@ -78,6 +95,20 @@ CAMPOS_OBRIGATORIOS_POST = ["descricao", "denominacao", "ncm", "cpfCnpjRaiz", "m
 # Campos obrigatórios para atualização (PUT)
 CAMPOS_OBRIGATORIOS_PUT = ["codigo", "descricao", "denominacao", "ncm", "cpfCnpjRaiz", "modalidade"]
 
+# Modos de saída JSON e sufixo usado no nome dos arquivos gerados
+MODOS_SAIDA = ["post", "put", "api_post", "api_put", "completo"]
+SUFIXOS_MODO = {
+    "post": "_POST",
+    "put": "_PUT",
+    "api_post": "_API_POST",
+    "api_put": "_API_PUT",
+    "completo": "_COMPLETO",
+}
+
+# Formatos de arquivo de saída e extensão correspondente
+FORMATOS_SAIDA = ["pretty", "compact", "ndjson"]
+EXTENSOES_FORMATO = {"pretty": ".json", "compact": ".json", "ndjson": ".ndjson"}
+
 # Colunas principais da planilha (ordem fixa)
 COLUNAS_PRINCIPAIS = [
     "codigo",           # Código do produto (int, gerado pelo servidor no POST, obrigatório no PUT)
@@ -90,6 +121,66 @@ COLUNAS_PRINCIPAIS = [
     "codigosInterno",    # Códigos internos separados por ; (opcional)
 ]
 
+# Mapeamentos alternativos de cabeçalhos comuns → campo principal
+MAPA_COLUNAS_ALTERNATIVAS = {
+    "CODIGO": "codigo",
+    "COD": "codigo",
+    "CÓDIGO": "codigo",
+    "DENOMINACAO": "denominacao",
+    "DENOMINAÇÃO": "denominacao",
+    "NOME": "denominacao",
+    "NOME_PRODUTO": "denominacao",
+    "NOME DO PRODUTO": "denominacao",
+    "TITULO": "denominacao",
+    "TÍTULO": "denominacao",
+    "PRODUTO": "denominacao",
+    "NOME PRODUTO": "denominacao",
+    "NOME COMERCIAL": "denominacao",
+    "DESCRICAO": "descricao",
+    "DESCRIÇÃO": "descricao",
+    "DESCRICAO_PRODUTO": "descricao",
+    "DESCRIÇÃO DO PRODUTO": "descricao",
+    "DESCRICAO DETALHADA": "descricao",
+    "CNPJ": "cpfCnpjRaiz",
+    "CNPJ_RAIZ": "cpfCnpjRaiz",
+    "CPF_CNPJ": "cpfCnpjRaiz",
+    "CPFCNPJRAIZ": "cpfCnpjRaiz",
+    "CPF/CNPJ RAIZ": "cpfCnpjRaiz",
+    "CNPJ RAIZ": "cpfCnpjRaiz",
+    "SITUACAO": "situacao",
+    "SITUAÇÃO": "situacao",
+    "STATUS": "situacao",
+    "ATIVO": "situacao",
+    "MODALIDADE": "modalidade",
+    "TIPO": "modalidade",
+    "TIPO OPERACAO": "modalidade",
+    "TIPO OPERAÇÃO": "modalidade",
+    "NCM": "ncm",
+    "CODIGO_NCM": "ncm",
+    "COD_NCM": "ncm",
+    "NCM/SH": "ncm",
+    "CLASSIFICACAO FISCAL": "ncm",
+    "CLASSIFICAÇÃO FISCAL": "ncm",
+    "CÓDIGOS INTERNOS": "codigosInterno",
+    "CODIGOS_INTERNO": "codigosInterno",
+    "CODIGOSINTERNO": "codigosInterno",
+    "CÓDIGOS INTERNO": "codigosInterno",
+    "CODIGO_INTERNO": "codigosInterno",
+    "COD_INTERNO": "codigosInterno",
+    "CODIGOS INTERNOS": "codigosInterno",
+    "CODIGO DE BARRAS": "codigosInterno",
+    "CÓDIGO DE BARRAS": "codigosInterno",
+    "COD BARRAS": "codigosInterno",
+    "EAN": "codigosInterno",
+    "GTIN": "codigosInterno",
+    "COD DE FABRICA": "codigosInterno",
+    "CÓD DE FÁBRICA": "codigosInterno",
+    "CODIGO DE FABRICA": "codigosInterno",
+    "REFERÊNCIA DO FORNECEDOR": "codigosInterno",
+    "REFERENCIA DO FORNECEDOR": "codigosInterno",
+    "REF FORNECEDOR": "codigosInterno",
+}
+
 # Mapeamento de atributos conhecidos para NCMs comuns (para labels amigáveis)
 ATRIBUTOS_LABELS = {
     "ATT_14540": "Condição do Produto",
@@ -106,6 +197,908 @@ ATRIBUTOS_LABELS = {
 }
 
 
+# ============================================================================
+# SERIALIZAÇÃO JSON (orjson opcional, saída idêntica à do json padrão)
+# ============================================================================
+
+def _valor_json_padrao(valor):
+    """Tipos fora do JSON aceitos na saída: datas e horas viram texto ISO 8601."""
+    if isinstance(valor, (date, dt_time)):
+        return valor.isoformat()
+    raise TypeError(f"Objeto do tipo {type(valor).__name__} não é serializável em JSON")
+
+
+def _contem_float(dados) -> bool:
+    """True se há algum float em `dados` (listas/dicts aninhados)."""
+    pendentes = [dados]
+    while pendentes:
+        valor = pendentes.pop()
+        tipo = type(valor)
+        if tipo is dict:
+            pendentes.extend(valor.values())
+        elif tipo is list or tipo is tuple:
+            pendentes.extend(valor)
+        elif tipo is float:
+            return True
+    return False
+
+
+def _produtos_contem_float(dados) -> bool:
+    """
+    _contem_float para a saída de gerar_json_* (lista de produtos ou um
+    produto): só os campos de primeiro nível podem ser números (seq, codigo,
+    ...). Atributos e códigos internos são sempre texto (lidos da planilha
+    como str, e assim no esquema do portal) e não são percorridos.
+    """
+    itens = dados if type(dados) is list else [dados]
+    for item in itens:
+        if type(item) is dict:
+            if float in map(type, item.values()):
+                return True
+        elif _contem_float(item):
+            return True
+    return False
+
+
+def _serializar_bytes(dados, indent=2, produtos: bool = False) -> bytes:
+    """
+    Serializa `dados` em JSON UTF-8 (sem escapar não-ASCII). indent=2 equivale
+    a json.dumps(dados, ensure_ascii=False, indent=2); indent=0 é compacto, sem
+    espaços (separators=(',', ':')). Datas e horas saem como texto ISO 8601;
+    NaN e Infinity não são JSON válido e levantam ValueError.
+
+    Usa o orjson (se instalado) quando ele produz exatamente os mesmos bytes:
+    indent 2 ou compacto e nenhum float nos dados (o orjson formata floats de
+    outro jeito e grava NaN como null). Qualquer outro caso, ou erro do orjson,
+    cai no json padrão. Com `produtos` (saída de gerar_json_*) a procura por
+    floats olha só os campos de primeiro nível de cada produto, em vez de
+    percorrer o payload inteiro.
+    """
+    contem_float = _produtos_contem_float if produtos else _contem_float
+    if orjson is not None and indent in (0, 2) and not contem_float(dados):
+        opcoes = orjson.OPT_PASSTHROUGH_DATETIME | (orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            return orjson.dumps(dados, default=_valor_json_padrao, option=opcoes)
+        except TypeError:
+            pass  # Tipo não suportado ou texto inválido: usar o json padrão
+    if indent == 0:
+        return json.dumps(dados, ensure_ascii=False, separators=(',', ':'), allow_nan=False,
+                          default=_valor_json_padrao).encode('utf-8')
+    return json.dumps(dados, ensure_ascii=False, indent=indent, allow_nan=False,
+                      default=_valor_json_padrao).encode('utf-8')
+
+
+def serializar_json(dados, indent: int = 2, produtos: bool = False) -> str:
+    """Serializa `dados` como texto JSON (ver _serializar_bytes)."""
+    return _serializar_bytes(dados, indent, produtos).decode('utf-8')
+
+
+def gravar_json(dados, caminho: str, indent: int = 2, produtos: bool = False):
+    """Grava `dados` em `caminho` (UTF-8), com a mesma saída de serializar_json."""
+    with open(caminho, 'wb') as f:
+        f.write(_serializar_bytes(dados, indent, produtos))
+
+
+def escrever_saida(dados: list, destino, formato: str = "pretty"):
+    """
+    Escreve a lista de produtos `dados` (saída de gerar_json_*) no arquivo
+    binário `destino` no formato pedido:
+    - pretty:  JSON indentado (indent=2)
+    - compact: JSON sem espaços
+    - ndjson:  um produto compacto por linha, gravado item a item
+    """
+    if formato == "ndjson":
+        for item in dados:
+            destino.write(_serializar_bytes(item, 0, produtos=True))
+            destino.write(b"\n")
+    elif formato == "compact":
+        destino.write(_serializar_bytes(dados, 0, produtos=True))
+    else:
+        destino.write(_serializar_bytes(dados, 2, produtos=True))
+
+
+def gravar_saida(dados: list, caminho: str, formato: str = "pretty"):
+    """Grava `dados` em `caminho` no formato pedido (ver escrever_saida)."""
+    with open(caminho, 'wb') as f:
+        escrever_saida(dados, f, formato)
+
+
+# Molduras de cada formato: (abertura, separador entre itens, fechamento)
+_MOLDURAS_FORMATO = {
+    "pretty": (b"[\n", b",\n", b"\n]"),
+    "compact": (b"[", b",", b"]"),
+    "ndjson": (b"", b"", b""),
+}
+
+
+def _serializar_item(item, formato: str) -> bytes:
+    """
+    Bytes de um item exatamente como aparecem dentro da lista no formato pedido
+    (no pretty, com a indentação extra de um elemento de lista).
+    """
+    if formato == "ndjson":
+        return _serializar_bytes(item, 0, produtos=True) + b"\n"
+    if formato == "compact":
+        return _serializar_bytes(item, 0, produtos=True)
+    return b"  " + _serializar_bytes(item, 2, produtos=True).replace(b"\n", b"\n  ")
+
+
+def dividir_em_lotes(itens: list, formato: str = "pretty", max_produtos: int = None,
+                     max_bytes: int = None):
+    """
+    Divide a saída de um modo em lotes de no máximo `max_produtos` itens e/ou
+    `max_bytes` bytes (tamanho exato do arquivo do lote no formato pedido).
+
+    Gera os bytes de cada lote, já com a moldura do formato. Nos modos com
+    'seq' (post, put, completo), a numeração recomeça em 1 em cada lote, como
+    o portal exige em cada upload. Um item maior que `max_bytes` sozinho sai
+    num lote só dele.
+    """
+    abertura, separador, fechamento = _MOLDURAS_FORMATO[formato]
+    moldura = len(abertura) + len(fechamento)
+    pedacos = []
+    tamanho = moldura
+    for item in itens:
+        seq = len(pedacos) + 1
+        pedaco = _serializar_item(dict(item, seq=seq) if "seq" in item else item, formato)
+        acrescimo = len(pedaco) + (len(separador) if pedacos else 0)
+        cheio = max_produtos is not None and len(pedacos) >= max_produtos
+        estoura = max_bytes is not None and tamanho + acrescimo > max_bytes
+        if pedacos and (cheio or estoura):
+            yield abertura + separador.join(pedacos) + fechamento
+            pedacos = []
+            tamanho = moldura
+            if "seq" in item:
+                pedaco = _serializar_item(dict(item, seq=1), formato)
+            acrescimo = len(pedaco)
+        pedacos.append(pedaco)
+        tamanho += acrescimo
+    if pedacos:
+        yield abertura + separador.join(pedacos) + fechamento
+    elif not itens:
+        yield b"" if formato == "ndjson" else b"[]"
+
+
+def gravar_lotes_zip(saidas: dict, caminho_zip: str, formato: str = "pretty",
+                     max_produtos: int = None, max_bytes: int = None) -> list:
+    """
+    Grava as saídas ({modo: itens}) divididas em lotes num .zip, um arquivo por
+    lote (CATALOGO_POST_001.json, ...). Cada lote é escrito direto na entrada
+    do zip, sem montar o arquivo inteiro em memória.
+
+    Returns:
+        Nomes das entradas gravadas, na ordem
+    """
+    extensao = EXTENSOES_FORMATO[formato]
+    entradas = []
+    with zipfile.ZipFile(caminho_zip, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for modo, itens in saidas.items():
+            lotes = dividir_em_lotes(itens, formato, max_produtos, max_bytes)
+            for numero, conteudo in enumerate(lotes, 1):
+                nome = f"CATALOGO{SUFIXOS_MODO[modo]}_{numero:03d}{extensao}"
+                with zf.open(nome, 'w') as destino:
+                    destino.write(conteudo)
+                entradas.append(nome)
+    return entradas
+
+
+# ============================================================================
+# VALIDAÇÃO DE VALORES (funções puras, usadas pela memoização por conversão)
+# ============================================================================
+
+# Campos principais normalizados/validados com memoização por valor bruto
+CAMPOS_MEMOIZADOS = ("ncm", "cpfCnpjRaiz", "modalidade", "situacao")
+# Limite de valores distintos memorizados por campo em cada conversão
+CACHE_NORMALIZACAO_MAX = 4096
+
+
+def _normalizar_situacao(situacao: str) -> str:
+    """Normaliza o valor de situação para maiúsculas conforme API."""
+    if not situacao:
+        return "ATIVADO"
+    return SITUACAO_NORMALIZAR.get(situacao.strip().lower(), situacao.upper())
+
+
+def _erro_ncm(ncm) -> str:
+    """Retorna a mensagem de erro do NCM (sem prefixo de linha) ou None."""
+    ncm_limpo = str(ncm).strip().replace(".", "").replace("-", "").replace(" ", "")
+    if not ncm_limpo.isdigit():
+        return f"NCM '{ncm}' contém caracteres não numéricos."
+    if len(ncm_limpo) != 8:
+        return f"NCM '{ncm}' deve ter exatamente 8 dígitos (tem {len(ncm_limpo)})."
+    return None
+
+
+def _erro_modalidade(modalidade: str) -> str:
+    """Retorna a mensagem de erro da modalidade ou None."""
+    if modalidade.upper() not in MODALIDADES_VALIDAS:
+        return (
+            f"Modalidade '{modalidade}' inválida. "
+            f"Valores aceitos: {', '.join(MODALIDADES_VALIDAS)}"
+        )
+    return None
+
+
+def _erro_situacao(situacao: str) -> str:
+    """Retorna a mensagem de erro da situação ou None."""
+    situacao_norm = _normalizar_situacao(situacao) if situacao else "ATIVADO"
+    if situacao_norm not in SITUACOES_VALIDAS:
+        return (
+            f"Situação '{situacao}' inválida. "
+            f"Valores aceitos: {', '.join(SITUACOES_VALIDAS)}"
+        )
+    return None
+
+
+def _erro_cpf_cnpj_raiz(valor) -> str:
+    """Retorna a mensagem de erro do CPF/CNPJ raiz ou None."""
+    valor_limpo = str(valor).strip().replace(".", "").replace("-", "").replace("/", "")
+    if not valor_limpo.isdigit():
+        return f"cpfCnpjRaiz '{valor}' deve conter apenas dígitos."
+    if len(valor_limpo) > MAX_CPF_CNPJ_RAIZ:
+        return f"cpfCnpjRaiz '{valor}' excede {MAX_CPF_CNPJ_RAIZ} caracteres."
+    return None
+
+
+# Verificação de cada campo memoizado (valor normalizado → mensagem de erro ou None)
+VERIFICADORES_CAMPO = {
+    "ncm": _erro_ncm,
+    "cpfCnpjRaiz": _erro_cpf_cnpj_raiz,
+    "modalidade": _erro_modalidade,
+    "situacao": _erro_situacao,
+}
+
+
+# ============================================================================
+# ESQUEMAS DE SAÍDA JSON (projeções declarativas por modo)
+# ============================================================================
+
+# Presença do campo na saída
+SEMPRE = "sempre"                  # Sempre presente (usa o padrão se ausente)
+SE_PREENCHIDO = "se_preenchido"    # Só incluído se o valor (transformado) não for vazio
+
+
+def _t_situacao(valor, seq):
+    return _normalizar_situacao(valor)
+
+
+def _t_codigo_put(valor, seq):
+    return int(valor) if isinstance(valor, (int, float)) else valor
+
+
+def _t_codigo_completo(valor, seq):
+    # Sem código válido na planilha: usa o seq (como o portal exporta)
+    if isinstance(valor, str) and valor.strip() == "":
+        return seq
+    try:
+        return int(valor)
+    except (ValueError, TypeError):
+        return seq
+
+
+def _t_texto(valor, seq):
+    return str(valor).strip()
+
+
+# Campos comuns do final de todos os esquemas (atributos e códigos internos)
+_CAMPOS_ATRIBUTOS = [
+    ("atributos", "atributos", [], None, SEMPRE),
+    ("atributosMultivalorados", "atributosMultivalorados", [], None, SEMPRE),
+    ("atributosCompostos", "atributosCompostos", [], None, SEMPRE),
+    ("atributosCompostosMultivalorados", "atributosCompostosMultivalorados", [], None, SEMPRE),
+    ("codigoOperadorEstrangeiro", "codigoOperadorEstrangeiro", None, None, SE_PREENCHIDO),
+    ("codigosInterno", "codigosInterno", [], None, SEMPRE),
+]
+
+# Cada campo: (chave_saida, campo_origem, padrao, transformacao, presenca).
+# campo_origem None = número sequencial (seq). A ordem da lista é a ordem no JSON.
+ESQUEMAS_SAIDA = {
+    # ProdutoIntegracaoDTO (upload em lote no portal), sem codigo/versao
+    "post": [
+        ("seq", None, None, None, SEMPRE),
+        ("descricao", "descricao", "", None, SEMPRE),
+        ("denominacao", "denominacao", "", None, SEMPRE),
+        ("cpfCnpjRaiz", "cpfCnpjRaiz", "", None, SEMPRE),
+        ("situacao", "situacao", "ATIVADO", _t_situacao, SEMPRE),
+        ("modalidade", "modalidade", "", None, SEMPRE),
+        ("ncm", "ncm", "", None, SEMPRE),
+    ] + _CAMPOS_ATRIBUTOS,
+    # ProdutoIntegracaoDTO com codigo (atualização em lote)
+    "put": [
+        ("seq", None, None, None, SEMPRE),
+        ("codigo", "codigo", None, _t_codigo_put, SEMPRE),
+        ("descricao", "descricao", "", None, SEMPRE),
+        ("denominacao", "denominacao", "", None, SEMPRE),
+        ("cpfCnpjRaiz", "cpfCnpjRaiz", "", None, SEMPRE),
+        ("situacao", "situacao", "ATIVADO", _t_situacao, SEMPRE),
+        ("modalidade", "modalidade", "", None, SEMPRE),
+        ("ncm", "ncm", "", None, SEMPRE),
+    ] + _CAMPOS_ATRIBUTOS,
+    # ProdutoIntegracaoRequestDTO (cpfCnpjRaiz/codigo/versao vão na URL)
+    "api_post": [
+        ("descricao", "descricao", "", None, SEMPRE),
+        ("denominacao", "denominacao", "", None, SEMPRE),
+        ("modalidade", "modalidade", "", None, SEMPRE),
+        ("ncm", "ncm", "", None, SEMPRE),
+    ] + _CAMPOS_ATRIBUTOS,
+    # Exportação completa (ordem idêntica ao portal)
+    "completo": [
+        ("seq", None, None, None, SEMPRE),
+        ("codigo", "codigo", None, _t_codigo_completo, SEMPRE),
+        ("descricao", "descricao", "", None, SEMPRE),
+        ("denominacao", "denominacao", "", None, SEMPRE),
+        ("cpfCnpjRaiz", "cpfCnpjRaiz", "", None, SEMPRE),
+        ("situacao", "situacao", "ATIVADO", _t_situacao, SEMPRE),
+        ("modalidade", "modalidade", "", None, SEMPRE),
+        ("ncm", "ncm", "", None, SEMPRE),
+        ("versao", "versao", None, _t_texto, SE_PREENCHIDO),
+    ] + _CAMPOS_ATRIBUTOS,
+}
+# api_put usa o mesmo corpo do api_post
+ESQUEMAS_SAIDA["api_put"] = ESQUEMAS_SAIDA["api_post"]
+
+
+def _compilar_projecao(modo: str, campos: list):
+    """
+    Gera uma função especializada `projetar(produto, seq) -> dict` para o
+    esquema, com uma atribuição por campo (sem laços nem consultas à tabela
+    em tempo de execução).
+    """
+    nome_funcao = f"_projetar_{modo}"
+    linhas = [f"def {nome_funcao}(produto, seq):", "    get = produto.get", "    item = {}"]
+    ambiente = {}
+    for chave, origem, padrao, transformacao, presenca in campos:
+        alvo = f"item[{chave!r}]"
+        nome_t = f"_t_{len(ambiente)}"
+        if transformacao is not None:
+            ambiente[nome_t] = transformacao
+
+        if origem is None:
+            linhas.append(f"    {alvo} = seq")
+        elif presenca == SEMPRE:
+            expr = f"get({origem!r}, {padrao!r})"
+            if transformacao is not None:
+                expr = f"{nome_t}({expr}, seq)"
+            linhas.append(f"    {alvo} = {expr}")
+        else:
+            linhas.append(f"    v = get({origem!r})")
+            if transformacao is not None:
+                linhas.append(f"    if v:")
+                linhas.append(f"        v = {nome_t}(v, seq)")
+            linhas.append(f"    if v:")
+            linhas.append(f"        {alvo} = v")
+    linhas.append("    return item")
+
+    exec(compile("\n".join(linhas), f"<projecao {modo}>", "exec"), ambiente)
+    return ambiente[nome_funcao]
+
+
+# Funções de projeção compiladas uma única vez (na importação do módulo)
+PROJECOES = {modo: _compilar_projecao(modo, campos) for modo, campos in ESQUEMAS_SAIDA.items()}
+
+
+# ============================================================================
+# AMOSTRAGEM PARA VERIFICAÇÃO RÁPIDA
+# ============================================================================
+
+def _sortear_linhas_estratificadas(total_linhas: int, tamanho: int, semente: int = None) -> set:
+    """
+    Sorteia números de linha (a partir da 2) espalhados pela planilha:
+    as primeiras e as últimas linhas (10% da amostra cada) e uma linha
+    aleatória em cada faixa de igual tamanho no meio.
+    """
+    if total_linhas <= tamanho:
+        return set(range(2, total_linhas + 2))
+
+    rnd = random.Random(semente)
+    borda = max(1, tamanho // 10)
+    sorteadas = set(range(2, 2 + borda))
+    sorteadas.update(range(total_linhas + 2 - borda, total_linhas + 2))
+
+    faixas = tamanho - 2 * borda
+    inicio_meio = 2 + borda
+    largura = (total_linhas - 2 * borda) / max(faixas, 1)
+    for i in range(faixas):
+        de = inicio_meio + int(i * largura)
+        ate = max(de, inicio_meio + int((i + 1) * largura) - 1)
+        sorteadas.add(rnd.randint(de, ate))
+    return sorteadas
+
+
+def _percorrer_sorteadas(ws, sorteadas: set, limite_tempo: float, resumo: dict):
+    """
+    (linha, valores) das linhas `sorteadas`, lendo a aba até a última delas.
+    Atualiza resumo['linhas_percorridas'] e para ao passar de `limite_tempo`
+    (resumo['interrompido_por_tempo']).
+    """
+    ultima_sorteada = max(sorteadas) if sorteadas else 0
+    for row, valores in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
+        resumo['linhas_percorridas'] += 1
+        if row > ultima_sorteada:
+            break
+        if resumo['linhas_percorridas'] % 256 == 0 and time.perf_counter() > limite_tempo:
+            resumo['interrompido_por_tempo'] = True
+            break
+        if row in sorteadas:
+            yield row, valores
+
+
+def _amostra_reservatorio(ws, num_colunas: int, tamanho: int, semente: int,
+                          limite_tempo: float, resumo: dict) -> list:
+    """
+    Amostra uniforme de `tamanho` linhas não vazias (algoritmo R), para abas de
+    total desconhecido. Percorre a aba inteira (ou até `limite_tempo`) e grava
+    em resumo['total_linhas_estimado'] as linhas não vazias vistas.
+    """
+    rnd = random.Random(semente)
+    reservatorio = []
+    vistas = 0
+    for row, valores in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
+        resumo['linhas_percorridas'] += 1
+        if resumo['linhas_percorridas'] % 256 == 0 and time.perf_counter() > limite_tempo:
+            resumo['interrompido_por_tempo'] = True
+            break
+        if all(v is None or str(v).strip() == "" for v in valores[:num_colunas]):
+            continue
+        vistas += 1
+        if len(reservatorio) < tamanho:
+            reservatorio.append((row, valores))
+        else:
+            j = rnd.randrange(vistas)
+            if j < tamanho:
+                reservatorio[j] = (row, valores)
+    resumo['total_linhas_estimado'] = vistas
+    return sorted(reservatorio, key=lambda item: item[0])
+
+
+MENSAGEM_AMOSTRA_VAZIA = ("Amostra vazia: nenhuma linha de dados foi verificada; "
+                          "valide a planilha completa (sem a verificação rápida).")
+
+
+def _intervalo_wilson(erros: int, n: int, z: float = 1.96) -> tuple:
+    """Intervalo de confiança de Wilson (95%) para uma proporção."""
+    if n == 0:
+        return 0.0, 1.0
+    p = erros / n
+    denominador = 1 + z * z / n
+    centro = (p + z * z / (2 * n)) / denominador
+    margem = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominador
+    return max(0.0, centro - margem), min(1.0, centro + margem)
+
+
+# ============================================================================
+# VALORES DE ATRIBUTOS
+# ============================================================================
+
+SEPARADOR_VALORES = re.compile(r'[;,|\n]+')
+
+
+def _remover_decimal_zero(valor_str: str) -> str:
+    """Remove o .0 que o Excel acrescenta a números inteiros ("82.0" → "82")."""
+    if valor_str.endswith(".0"):
+        try:
+            float(valor_str)
+            return valor_str[:-2]
+        except ValueError:
+            pass
+    return valor_str
+
+
+def _normalizar_valor_atributo(codigo_att: str, valor_celula) -> str:
+    """Normaliza o valor de um atributo simples como ele vai para o JSON."""
+    valor_str = str(valor_celula).strip()
+    # Tratar booleanos
+    if isinstance(valor_celula, bool):
+        valor_str = "true" if valor_celula else "false"
+    elif valor_str.upper() in ["TRUE", "VERDADEIRO", "SIM"]:
+        valor_str = "true"
+    elif valor_str.upper() in ["FALSE", "FALSO", "NÃO", "NAO"]:
+        valor_str = "false"
+    valor_str = _remover_decimal_zero(valor_str)
+
+    # Zero-padding para atributos com código de domínio de 2 dígitos
+    # ATT_14540 (Estágio de Fabricação): "1" → "01"
+    if codigo_att == 'ATT_14540' and valor_str.isdigit() and len(valor_str) == 1:
+        valor_str = valor_str.zfill(2)
+    return valor_str
+
+
+def _separar_valores_multi(valor_celula) -> list:
+    """Separa os valores de um atributo multivalorado (; , | ou nova linha)."""
+    return [_remover_decimal_zero(v.strip())
+            for v in SEPARADOR_VALORES.split(str(valor_celula).strip()) if v.strip()]
+
+
+def _celula_vazia(valor_celula) -> bool:
+    """Célula sem valor (None ou só espaços)."""
+    return valor_celula is None or str(valor_celula).strip() == ""
+
+
+# ============================================================================
+# INJEÇÃO DE ATRIBUTOS PADRÃO (valores do site / CLI para células vazias)
+# ============================================================================
+
+# Opção de valor padrão (formulário: <opção>_padrao; CLI: --<opção>) → atributo
+ATRIBUTOS_PADRAO = {
+    'pais_origem': 'ATT_14545',
+    'validade': 'ATT_14546',
+    'controlado': 'ATT_14547',
+    'perigoso': 'ATT_14554',
+    'fabricante': 'ATT_14555',
+}
+ATRIBUTOS_PADRAO_MULTI = {'embalagem': 'ATT_14556'}
+ATRIBUTOS_PADRAO_INICIO = ('ATT_14545',)  # Entram antes dos atributos da planilha
+OPCOES_PADRAO = tuple(ATRIBUTOS_PADRAO) + tuple(ATRIBUTOS_PADRAO_MULTI) + ('operador_estrangeiro',)
+
+
+class PlanoInjecao:
+    """
+    Valores padrão de atributos compilados uma única vez e aplicados na
+    passada das linhas aos produtos que não trazem o atributo preenchido
+    (célula vazia ou coluna inexistente). ATT_14545 vai para o início dos
+    atributos simples e os demais para o fim, na ordem de ATRIBUTOS_PADRAO;
+    'operador_estrangeiro' preenche codigoOperadorEstrangeiro.
+    """
+
+    def __init__(self, padroes: dict = None):
+        """padroes: {opção: valor} (ver OPCOES_PADRAO); valores vazios são ignorados."""
+        self.padroes = {
+            opcao: str(valor).strip() for opcao, valor in (padroes or {}).items()
+            if valor is not None and str(valor).strip()
+        }
+        desconhecidas = [opcao for opcao in self.padroes if opcao not in OPCOES_PADRAO]
+        if desconhecidas:
+            raise ValueError(f"Opção de valor padrão desconhecida: {', '.join(desconhecidas)}. "
+                             f"Use: {', '.join(OPCOES_PADRAO)}")
+        self.simples = tuple((codigo, self.padroes[opcao])
+                             for opcao, codigo in ATRIBUTOS_PADRAO.items() if opcao in self.padroes)
+        self.multi = tuple((codigo, tuple(_separar_valores_multi(self.padroes[opcao])))
+                           for opcao, codigo in ATRIBUTOS_PADRAO_MULTI.items() if opcao in self.padroes)
+        self.operador_estrangeiro = self.padroes.get('operador_estrangeiro', '')
+        # Atributos sempre presentes após a injeção (contam como preenchidos na validação por NCM)
+        self.codigos = frozenset(codigo for codigo, _ in self.simples + self.multi)
+
+    def __bool__(self) -> bool:
+        return bool(self.padroes)
+
+    def compilar(self, cols_att_simples: dict, cols_att_multi: dict) -> tuple:
+        """
+        Resolve o plano para as colunas de uma aba: (inicio, fim, multi), cada
+        um com (índice da coluna ou None, atributo, valor). Sem coluna na aba,
+        o valor é sempre injetado; com coluna, só quando a célula estiver vazia.
+        """
+        idx_simples = {codigo: idx for idx, codigo in cols_att_simples.items()}
+        idx_multi = {codigo: idx for idx, codigo in cols_att_multi.items()}
+        inicio = tuple((idx_simples.get(c), c, v) for c, v in self.simples if c in ATRIBUTOS_PADRAO_INICIO)
+        fim = tuple((idx_simples.get(c), c, v) for c, v in self.simples if c not in ATRIBUTOS_PADRAO_INICIO)
+        multi = tuple((idx_multi.get(c), c, v) for c, v in self.multi)
+        return inicio, fim, multi
+
+    def aplicar(self, produto: dict, valores, compilado: tuple):
+        """Injeta os valores padrão no produto de uma linha (plano de compilar())."""
+        inicio, fim, multi = compilado
+        if inicio:
+            injetados = [{"atributo": c, "valor": v} for idx, c, v in inicio
+                         if idx is None or _celula_vazia(valores[idx])]
+            if injetados:
+                produto["atributos"] = injetados + produto["atributos"]
+        for idx, c, v in fim:
+            if idx is None or _celula_vazia(valores[idx]):
+                produto["atributos"].append({"atributo": c, "valor": v})
+        for idx, c, v in multi:
+            if idx is None or _celula_vazia(valores[idx]):
+                produto["atributosMultivalorados"].append({"atributo": c, "valores": list(v)})
+        if self.operador_estrangeiro and not produto.get('codigoOperadorEstrangeiro'):
+            produto['codigoOperadorEstrangeiro'] = self.operador_estrangeiro
+
+
+# ============================================================================
+# CATÁLOGO OFICIAL DE ATRIBUTOS POR NCM
+# ============================================================================
+
+def carregar_catalogo_ncm(caminho: str) -> dict:
+    """
+    Lê o JSON oficial de atributos por NCM do Siscomex (listaNcm/listaAtributos).
+
+    Os domínios de detalhesAtributos são compilados uma única vez em frozensets
+    por atributo (o mesmo objeto é compartilhado por todos os NCMs), para que
+    cada valor preenchido seja verificado em O(1) na passada das linhas.
+
+    Returns:
+        { ncm: { codigo_att: {obrigatorio, multivalorado, modalidade, dominio} } }
+        (dominio é None quando o atributo não tem lista de valores)
+    """
+    with open(caminho, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    dominios = compilar_dominios(data.get('detalhesAtributos', []))
+    catalogo = {}
+    for ncm_entry in data.get('listaNcm', []):
+        ncm_code = ncm_entry['codigoNcm'].replace('.', '')
+        attrs = {}
+        for att in ncm_entry.get('listaAtributos', []):
+            attrs[att['codigo']] = {
+                'obrigatorio': att.get('obrigatorio', False),
+                'multivalorado': att.get('multivalorado', False),
+                'modalidade': att.get('modalidade', ''),
+                'dominio': dominios.get(att['codigo']),
+            }
+        catalogo[ncm_code] = attrs
+    return catalogo
+
+
+def compilar_dominios(detalhes_atributos: list) -> dict:
+    """
+    Compila os domínios oficiais (detalhesAtributos[].dominio[].codigo) em
+    { codigo_att: frozenset(codigos) }. Atributos sem domínio ficam de fora.
+    """
+    dominios = {}
+    for detalhe in detalhes_atributos or []:
+        codigos = frozenset(
+            str(item['codigo']).strip() for item in detalhe.get('dominio') or []
+            if item.get('codigo') is not None
+        )
+        if codigos:
+            dominios[detalhe['codigo']] = codigos
+    return dominios
+
+
+def atributos_modelo_ncm(ncms: list, atributos_por_ncm: dict) -> dict:
+    """
+    Colunas de atributos da planilha modelo para um conjunto de NCMs: a união
+    dos atributos válidos para eles no catálogo oficial.
+
+    Um atributo multivalorado em algum dos NCMs vira coluna _MULTI; é
+    obrigatório se for obrigatório em algum dos NCMs.
+
+    Returns:
+        {simples: [...], multi: [...], obrigatorios: [...], desconhecidos: [ncm, ...]}
+        (códigos ordenados numericamente)
+    """
+    atributos = {}
+    desconhecidos = []
+    for ncm in ncms:
+        validos = atributos_por_ncm.get(ncm)
+        if validos is None:
+            desconhecidos.append(ncm)
+            continue
+        for codigo, info in validos.items():
+            atual = atributos.setdefault(codigo, {'multivalorado': False, 'obrigatorio': False})
+            atual['multivalorado'] = atual['multivalorado'] or bool(info.get('multivalorado'))
+            atual['obrigatorio'] = atual['obrigatorio'] or bool(info.get('obrigatorio'))
+
+    def ordem(codigo):
+        numero = re.sub(r"\D", "", codigo)
+        return (int(numero) if numero else 0, codigo)
+
+    codigos = sorted(atributos, key=ordem)
+    return {
+        'simples': [c for c in codigos if not atributos[c]['multivalorado']],
+        'multi': [c for c in codigos if atributos[c]['multivalorado']],
+        'obrigatorios': [c for c in codigos if atributos[c]['obrigatorio']],
+        'desconhecidos': desconhecidos,
+    }
+
+
+class IndiceNcm:
+    """
+    Índice dos NCMs do catálogo: pertinência em O(1) (conjunto) e busca por
+    prefixo em O(log n + k) (lista ordenada + bisect), para autocompletar.
+    """
+
+    def __init__(self, ncms):
+        self._ordenados = sorted(set(ncms))
+        self._conjunto = frozenset(self._ordenados)
+
+    def __contains__(self, ncm) -> bool:
+        return ncm in self._conjunto
+
+    def __len__(self) -> int:
+        return len(self._ordenados)
+
+    def _faixa(self, prefixo: str) -> tuple:
+        """Posições [inicio, fim) dos NCMs que começam com `prefixo`."""
+        inicio = bisect.bisect_left(self._ordenados, prefixo)
+        # "\uffff" é maior que qualquer dígito: fim da faixa do prefixo
+        fim = bisect.bisect_left(self._ordenados, prefixo + "\uffff", inicio)
+        return inicio, fim
+
+    def buscar_prefixo(self, prefixo: str, limite: int = 20) -> list:
+        """Até `limite` NCMs que começam com `prefixo`, em ordem crescente."""
+        inicio, fim = self._faixa(prefixo)
+        return self._ordenados[inicio:min(fim, inicio + limite)]
+
+    def contar_prefixo(self, prefixo: str) -> int:
+        """Quantos NCMs começam com `prefixo`."""
+        inicio, fim = self._faixa(prefixo)
+        return fim - inicio
+
+
+# ============================================================================
+# CACHE DA PLANILHA MODELO
+# ============================================================================
+
+# Versão do layout da planilha modelo: alterar ao mudar gerar_planilha_modelo,
+# para invalidar os caches e ETags já distribuídos
+VERSAO_PLANILHA_MODELO = "2.0-1"
+
+# Quantidade máxima de variações (atributos extras) mantidas em memória
+MODELO_CACHE_MAX = 64
+
+_CACHE_MODELOS = {}  # { chave: bytes do .xlsx }
+
+
+def chave_planilha_modelo(atributos_extras: list = None, atributos_multi: list = None,
+                          obrigatorios=None) -> str:
+    """
+    Chave estável da planilha modelo para (atributos, versão), usada também
+    como ETag. Não depende dos bytes: o .xlsx traz data de criação, então
+    cada geração difere, mas o conteúdo útil é o mesmo.
+    """
+    partes = [
+        VERSAO_PLANILHA_MODELO,
+        "*" if atributos_extras is None else ",".join(atributos_extras),
+        "*" if atributos_multi is None else ",".join(atributos_multi),
+        ",".join(sorted(obrigatorios or ())),
+    ]
+    return hashlib.sha256("|".join(partes).encode('utf-8')).hexdigest()[:32]
+
+
+def planilha_modelo_bytes(atributos_extras: list = None, atributos_multi: list = None,
+                          obrigatorios=None) -> tuple:
+    """
+    Bytes da planilha modelo, gerada uma única vez por (atributos, versão)
+    e mantida em memória (até MODELO_CACHE_MAX variações).
+
+    Returns:
+        (conteudo, chave) — a chave serve de ETag
+    """
+    chave = chave_planilha_modelo(atributos_extras, atributos_multi, obrigatorios)
+    conteudo = _CACHE_MODELOS.get(chave)
+    if conteudo is None:
+        destino = io.BytesIO()
+        ConversorCatalogoSiscomex().gerar_planilha_modelo(
+            destino, atributos_extras, atributos_multi, obrigatorios
+        )
+        conteudo = destino.getvalue()
+        while len(_CACHE_MODELOS) >= MODELO_CACHE_MAX:
+            _CACHE_MODELOS.pop(next(iter(_CACHE_MODELOS)), None)
+        _CACHE_MODELOS[chave] = conteudo
+    return conteudo, chave
+
+
+# ============================================================================
+# ESTIMATIVA DE CUSTO (DIMENSÃO DAS ABAS, SEM CARREGAR A PLANILHA)
+# ============================================================================
+
+# Leitura + validação + JSON, medido numa planilha de 3.000 linhas × 19 colunas
+SEGUNDOS_POR_CELULA = 30e-6
+# Abas sem <dimension> (alguns geradores omitem): células estimadas pelo tamanho do XML
+BYTES_XML_POR_CELULA = 40
+COLUNAS_PADRAO_ESTIMATIVA = 20
+
+_NS_PLANILHA = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_RELACOES = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_RE_DIMENSAO = re.compile(rb'<(?:\w+:)?dimension\s+ref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"')
+
+
+def _indice_coluna(letras: str) -> int:
+    """'A' → 1, 'S' → 19, 'AA' → 27."""
+    indice = 0
+    for letra in letras:
+        indice = indice * 26 + ord(letra) - 64
+    return indice
+
+
+def dimensoes_planilha(caminho_excel: str) -> list:
+    """
+    Dimensões de cada aba lidas direto do .xlsx (zip): o <dimension ref="A1:S3010">
+    do início do XML da aba. Não descompacta a aba inteira nem as strings
+    compartilhadas, então custa alguns ms mesmo em planilhas enormes.
+
+    Returns:
+        [{aba, linhas, colunas, ativa, estimado}] na ordem das abas (linhas inclui
+        o cabeçalho; estimado=True quando a aba não declara a dimensão)
+    """
+    from xml.etree import ElementTree
+
+    with zipfile.ZipFile(caminho_excel) as zf:
+        workbook = ElementTree.fromstring(zf.read("xl/workbook.xml"))
+        relacoes = ElementTree.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+        alvos = {rel.get("Id"): rel.get("Target") for rel in relacoes}
+        visao = workbook.find(f"{_NS_PLANILHA}bookViews/{_NS_PLANILHA}workbookView")
+        ativa = int(visao.get("activeTab", 0)) if visao is not None else 0
+
+        dimensoes = []
+        for posicao, aba in enumerate(workbook.iter(f"{_NS_PLANILHA}sheet")):
+            alvo = alvos.get(aba.get(f"{_NS_RELACOES}id"), "")
+            caminho_xml = alvo.lstrip("/") if alvo.startswith("/") else "xl/" + alvo
+            with zf.open(caminho_xml) as f:
+                inicio = f.read(64 * 1024)
+            encontrado = _RE_DIMENSAO.search(inicio)
+            if encontrado and encontrado.group(3):
+                linhas = int(encontrado.group(4)) - int(encontrado.group(2)) + 1
+                colunas = _indice_coluna(encontrado.group(3).decode()) - _indice_coluna(encontrado.group(1).decode()) + 1
+                estimado = False
+            else:
+                colunas = COLUNAS_PADRAO_ESTIMATIVA
+                linhas = max(1, zf.getinfo(caminho_xml).file_size // (BYTES_XML_POR_CELULA * colunas))
+                estimado = True
+            dimensoes.append({'aba': aba.get("name"), 'linhas': linhas, 'colunas': colunas,
+                              'ativa': posicao == ativa, 'estimado': estimado})
+    return dimensoes
+
+
+def estimar_custo_planilha(caminho_excel: str, abas=None) -> dict:
+    """
+    Custo estimado da conversão pelas dimensões das abas lidas (aba ativa,
+    "todas" ou lista de nomes, como em ler_planilha).
+
+    Returns:
+        {linhas (de dados), colunas, celulas, segundos}
+    """
+    dimensoes = dimensoes_planilha(caminho_excel)
+    if abas == "todas":
+        escolhidas = dimensoes
+    elif abas:
+        escolhidas = [d for d in dimensoes if d['aba'] in abas]
+    else:
+        escolhidas = [d for d in dimensoes if d['ativa']] or dimensoes[:1]
+    linhas = sum(max(d['linhas'] - 1, 0) for d in escolhidas)
+    celulas = sum(max(d['linhas'] - 1, 0) * d['colunas'] for d in escolhidas)
+    return {
+        'linhas': linhas,
+        'colunas': max((d['colunas'] for d in escolhidas), default=0),
+        'celulas': celulas,
+        'segundos': round(celulas * SEGUNDOS_POR_CELULA, 2),
+    }
+
+
+# ============================================================================
+# CANCELAMENTO COOPERATIVO
+# ============================================================================
+
+CANCELAMENTO_INTERVALO_LINHAS = 500  # Linhas entre verificações do token
+
+
+class ConversaoCancelada(Exception):
+    """Leitura interrompida por um TokenCancelamento (motivo em .motivo)."""
+
+    def __init__(self, motivo: str = "cancelado"):
+        super().__init__(f"Conversão interrompida ({motivo})")
+        self.motivo = motivo
+
+
+class TokenCancelamento:
+    """
+    Sinal de cancelamento verificado pelo conversor a cada
+    CANCELAMENTO_INTERVALO_LINHAS linhas.
+
+    Args:
+        sinal: Chamado a cada verificação com o nº de linhas lidas; retorna um
+            motivo (str) para cancelar ou None. Serve para sinais externos
+            (cliente desconectado, pedido de cancelamento de outro worker) e
+            para registrar progresso.
+        prazo_s: Orçamento de tempo a partir da criação do token (motivo 'prazo')
+    """
+
+    def __init__(self, sinal=None, prazo_s: float = None):
+        self.sinal = sinal
+        self.limite = time.monotonic() + prazo_s if prazo_s else None
+        self.motivo = None
+
+    def cancelar(self, motivo: str = "cancelado"):
+        self.motivo = self.motivo or motivo
+
+    def verificar(self, linhas: int = 0):
+        """Lança ConversaoCancelada se o token foi (ou deve ser) cancelado."""
+        if self.motivo is None and self.limite is not None and time.monotonic() > self.limite:
+            self.motivo = "prazo"
+        if self.motivo is None and self.sinal is not None:
+            self.motivo = self.sinal(linhas)
+        if self.motivo:
+            raise ConversaoCancelada(self.motivo)
+
+
 # ============================================================================
 # CLASSE PRINCIPAL DE CONVERSÃO
 # ============================================================================
@@ -113,11 +1106,15 @@ ATRIBUTOS_LABELS = {
 class ConversorCatalogoSiscomex:
     """Converte planilha Excel para JSON no padrão CATP API Siscomex."""
 
-    def __init__(self, auto_truncar=False):
+    def __init__(self, auto_truncar=False, injecao: PlanoInjecao = None,
+                 cancelamento: TokenCancelamento = None):
         self.erros = []
         self.avisos = []
         self.produtos = []
         self.auto_truncar = auto_truncar  # Truncar campos que excedem o limite
+        self.injecao = injecao or None    # Atributos padrão para células vazias
+        self.cancelamento = cancelamento  # Verificado a cada CANCELAMENTO_INTERVALO_LINHAS
+        self._reiniciar_cache()
 
     # ========================================================================
     # VALIDAÇÃO DE CAMPOS
@@ -125,50 +1122,28 @@ class ConversorCatalogoSiscomex:
 
     def validar_ncm(self, ncm: str, linha: int) -> bool:
         """Valida formato do NCM (8 dígitos numéricos)."""
-        ncm_limpo = str(ncm).strip().replace(".", "").replace("-", "").replace(" ", "")
-        if not ncm_limpo.isdigit():
-            self.erros.append(f"Linha {linha}: NCM '{ncm}' contém caracteres não numéricos.")
-            return False
-        if len(ncm_limpo) != 8:
-            self.erros.append(f"Linha {linha}: NCM '{ncm}' deve ter exatamente 8 dígitos (tem {len(ncm_limpo)}).")
-            return False
-        return True
+        return self._registrar_erro(_erro_ncm(ncm), linha)
 
     def validar_modalidade(self, modalidade: str, linha: int) -> bool:
         """Valida modalidade (IMPORTACAO ou EXPORTACAO)."""
-        if modalidade.upper() not in MODALIDADES_VALIDAS:
-            self.erros.append(
-                f"Linha {linha}: Modalidade '{modalidade}' inválida. "
-                f"Valores aceitos: {', '.join(MODALIDADES_VALIDAS)}"
-            )
-            return False
-        return True
+        return self._registrar_erro(_erro_modalidade(modalidade), linha)
 
     def normalizar_situacao(self, situacao: str) -> str:
         """Normaliza o valor de situação para maiúsculas conforme API."""
-        if not situacao:
-            return "ATIVADO"
-        return SITUACAO_NORMALIZAR.get(situacao.strip().lower(), situacao.upper())
+        return _normalizar_situacao(situacao)
 
     def validar_situacao(self, situacao: str, linha: int) -> bool:
         """Valida situação do produto."""
-        situacao_norm = self.normalizar_situacao(situacao) if situacao else "ATIVADO"
-        if situacao_norm not in SITUACOES_VALIDAS:
-            self.erros.append(
-                f"Linha {linha}: Situação '{situacao}' inválida. "
-                f"Valores aceitos: {', '.join(SITUACOES_VALIDAS)}"
-            )
-            return False
-        return True
+        return self._registrar_erro(_erro_situacao(situacao), linha)
 
     def validar_cpf_cnpj_raiz(self, valor: str, linha: int) -> bool:
         """Valida CPF/CNPJ raiz (somente dígitos)."""
-        valor_limpo = str(valor).strip().replace(".", "").replace("-", "").replace("/", "")
-        if not valor_limpo.isdigit():
-            self.erros.append(f"Linha {linha}: cpfCnpjRaiz '{valor}' deve conter apenas dígitos.")
-            return False
-        if len(valor_limpo) > MAX_CPF_CNPJ_RAIZ:
-            self.erros.append(f"Linha {linha}: cpfCnpjRaiz '{valor}' excede {MAX_CPF_CNPJ_RAIZ} caracteres.")
+        return self._registrar_erro(_erro_cpf_cnpj_raiz(valor), linha)
+
+    def _registrar_erro(self, mensagem: str, linha: int) -> bool:
+        """Registra a mensagem de erro (se houver) prefixada com a linha."""
+        if mensagem:
+            self.erros.append(f"Linha {linha}: {mensagem}")
             return False
         return True
 
@@ -193,49 +1168,43 @@ class ConversorCatalogoSiscomex:
     # LEITURA E PROCESSAMENTO DA PLANILHA
     # ========================================================================
 
-    def ler_planilha(self, caminho_excel: str, defaults: dict = None) -> list:
-        """Lê a planilha Excel e retorna lista de produtos.
-        
-        Args:
-            caminho_excel: Caminho do arquivo .xlsx
-            defaults: Dict com valores padrão para campos ausentes na planilha
-                      Ex: {'cpfCnpjRaiz': '12345678', 'modalidade': 'IMPORTACAO'}
-        """
-        defaults = defaults or {}
+    def _abrir_planilha(self, caminho_excel: str, read_only: bool = False):
+        """Abre a planilha Excel e registra erro amigável se não for possível."""
         if not os.path.exists(caminho_excel):
             self.erros.append(f"Arquivo não encontrado: {caminho_excel}")
-            return []
-
-        print(f"\n📂 Lendo planilha: {caminho_excel}")
+            return None
 
         try:
-            wb = openpyxl.load_workbook(caminho_excel, data_only=True)
+            return openpyxl.load_workbook(caminho_excel, read_only=read_only, data_only=True)
         except zipfile.BadZipFile:
             self.erros.append(
                 "O arquivo não é um .xlsx válido. Provavelmente está no formato "
                 "antigo .xls renomeado para .xlsx. Abra o arquivo no Excel e "
                 "salve como 'Pasta de Trabalho do Excel (.xlsx)' usando Salvar Como."
             )
-            return []
+            return None
         except Exception as e:
             self.erros.append(f"Erro ao abrir planilha: {str(e)}")
-            return []
-
-        ws = wb.active
+            return None
 
-        # Ler cabeçalhos da primeira linha
+    def _ler_cabecalhos(self, ws) -> list:
+        """Lê os cabeçalhos da primeira linha (COL_n para células vazias)."""
+        primeira = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
         cabecalhos = []
-        for col in range(1, ws.max_column + 1):
-            valor = ws.cell(row=1, column=col).value
+        for col, valor in enumerate(primeira, 1):
             if valor is not None:
                 cabecalhos.append(str(valor).strip())
             else:
                 cabecalhos.append(f"COL_{col}")
+        return cabecalhos
 
-        print(f"📋 Colunas encontradas: {len(cabecalhos)}")
-        print(f"   {', '.join(cabecalhos[:10])}{'...' if len(cabecalhos) > 10 else ''}")
+    def _mapear_colunas(self, cabecalhos: list) -> tuple:
+        """
+        Identifica campos principais e colunas de atributos pelos cabeçalhos.
 
-        # Identificar colunas de atributos (começa com ATT_)
+        Returns:
+            (colunas_principais, colunas_atributos_simples, colunas_atributos_multi)
+        """
         colunas_atributos_simples = {}       # {indice: codigo_atributo}
         colunas_atributos_multi = {}          # {indice: codigo_atributo}
         colunas_principais = {}               # {nome_campo: indice}
@@ -259,85 +1228,17 @@ class ConversorCatalogoSiscomex:
                         break
                 else:
                     # Tentar mapeamentos alternativos comuns
-                    mapa_alternativos = {
-                        "CODIGO": "codigo",
-                        "COD": "codigo",
-                        "CÓDIGO": "codigo",
-                        "DENOMINACAO": "denominacao",
-                        "DENOMINAÇÃO": "denominacao",
-                        "NOME": "denominacao",
-                        "NOME_PRODUTO": "denominacao",
-                        "NOME DO PRODUTO": "denominacao",
-                        "TITULO": "denominacao",
-                        "TÍTULO": "denominacao",
-                        "PRODUTO": "denominacao",
-                        "NOME PRODUTO": "denominacao",
-                        "NOME COMERCIAL": "denominacao",
-                        "DESCRICAO": "descricao",
-                        "DESCRIÇÃO": "descricao",
-                        "DESCRICAO_PRODUTO": "descricao",
-                        "DESCRIÇÃO DO PRODUTO": "descricao",
-                        "DESCRICAO DETALHADA": "descricao",
-                        "CNPJ": "cpfCnpjRaiz",
-                        "CNPJ_RAIZ": "cpfCnpjRaiz",
-                        "CPF_CNPJ": "cpfCnpjRaiz",
-                        "CPFCNPJRAIZ": "cpfCnpjRaiz",
-                        "CPF/CNPJ RAIZ": "cpfCnpjRaiz",
-                        "CNPJ RAIZ": "cpfCnpjRaiz",
-                        "SITUACAO": "situacao",
-                        "SITUAÇÃO": "situacao",
-                        "STATUS": "situacao",
-                        "ATIVO": "situacao",
-                        "MODALIDADE": "modalidade",
-                        "TIPO": "modalidade",
-                        "TIPO OPERACAO": "modalidade",
-                        "TIPO OPERAÇÃO": "modalidade",
-                        "NCM": "ncm",
-                        "CODIGO_NCM": "ncm",
-                        "COD_NCM": "ncm",
-                        "NCM/SH": "ncm",
-                        "CLASSIFICACAO FISCAL": "ncm",
-                        "CLASSIFICAÇÃO FISCAL": "ncm",
-                        "CÓDIGOS INTERNOS": "codigosInterno",
-                        "CODIGOS_INTERNO": "codigosInterno",
-                        "CODIGOSINTERNO": "codigosInterno",
-                        "CÓDIGOS INTERNO": "codigosInterno",
-                        "CODIGO_INTERNO": "codigosInterno",
-                        "COD_INTERNO": "codigosInterno",
-                        "CODIGOS INTERNOS": "codigosInterno",
-                        "CODIGO DE BARRAS": "codigosInterno",
-                        "CÓDIGO DE BARRAS": "codigosInterno",
-                        "COD BARRAS": "codigosInterno",
-                        "EAN": "codigosInterno",
-                        "GTIN": "codigosInterno",
-                        "COD DE FABRICA": "codigosInterno",
-                        "CÓD DE FÁBRICA": "codigosInterno",
-                        "CODIGO DE FABRICA": "codigosInterno",
-                        "REFERÊNCIA DO FORNECEDOR": "codigosInterno",
-                        "REFERENCIA DO FORNECEDOR": "codigosInterno",
-                        "REF FORNECEDOR": "codigosInterno",
-                    }
                     cab_normalizado = cab_upper.replace(" ", "").replace("_", "").replace("-", "")
-                    for chave, campo in mapa_alternativos.items():
+                    for chave, campo in MAPA_COLUNAS_ALTERNATIVAS.items():
                         chave_norm = chave.replace(" ", "").replace("_", "").replace("-", "")
                         if cab_normalizado == chave_norm:
                             colunas_principais[campo] = idx
                             break
 
-        print(f"\n🔍 Mapeamento de colunas:")
-        print(f"   Campos principais: {len(colunas_principais)}")
-        for campo, idx in sorted(colunas_principais.items(), key=lambda x: x[1]):
-            print(f"     Col {idx+1} ({cabecalhos[idx]}) → {campo}")
-        print(f"   Atributos simples: {len(colunas_atributos_simples)}")
-        for idx, att in sorted(colunas_atributos_simples.items()):
-            label = ATRIBUTOS_LABELS.get(att, att)
-            print(f"     Col {idx+1} ({cabecalhos[idx]}) → {att} ({label})")
-        print(f"   Atributos multivalorados: {len(colunas_atributos_multi)}")
-        for idx, att in sorted(colunas_atributos_multi.items()):
-            label = ATRIBUTOS_LABELS.get(att, att)
-            print(f"     Col {idx+1} ({cabecalhos[idx]}) → {att} ({label})")
+        return colunas_principais, colunas_atributos_simples, colunas_atributos_multi
 
-        # Verificar campos obrigatórios (aceitar defaults para os que faltam)
+    def _verificar_colunas_obrigatorias(self, colunas_principais: dict, defaults: dict) -> bool:
+        """Verifica se os campos obrigatórios existem na planilha ou nos defaults."""
         campos_faltando = []
         campos_usando_default = []
         for campo in CAMPOS_OBRIGATORIOS_POST:
@@ -367,98 +1268,544 @@ class ConversorCatalogoSiscomex:
                 f"Colunas obrigatórias não encontradas: {', '.join(dicas)}. "
                 f"Verifique os cabeçalhos ou preencha os valores padrão no site."
             )
-            return []
+            return False
+        return True
 
-        # Processar cada linha de dados (a partir da linha 2)
-        produtos = []
-        for row in range(2, ws.max_row + 1):
+    def _linhas_dados(self, ws, total_colunas: int):
+        """
+        Itera as linhas de dados (a partir da linha 2) como tuplas de valores,
+        ignorando linhas vazias. Gera (numero_linha, valores).
+        """
+        for row, valores in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
+            if len(valores) < total_colunas:
+                valores = tuple(valores) + (None,) * (total_colunas - len(valores))
             # Verificar se a linha está vazia (checar pelo menos algum campo preenchido)
-            linha_vazia = True
-            for col_idx in range(len(cabecalhos)):
-                val = ws.cell(row=row, column=col_idx + 1).value
+            for val in valores[:total_colunas]:
                 if val is not None and str(val).strip() != "":
-                    linha_vazia = False
                     break
-            if linha_vazia:
+            else:
                 continue
+            yield row, valores
 
+    def ler_planilha(self, caminho_excel: str, defaults: dict = None,
+                     abas=None, processos: int = None,
+                     atributos_por_ncm: dict = None) -> list:
+        """Lê a planilha Excel e retorna lista de produtos.
+        
+        Args:
+            caminho_excel: Caminho do arquivo .xlsx
+            defaults: Dict com valores padrão para campos ausentes na planilha
+                      Ex: {'cpfCnpjRaiz': '12345678', 'modalidade': 'IMPORTACAO'}
+            abas: None lê só a aba ativa; "todas" ou uma lista de nomes lê
+                  essas abas (em paralelo, ver ler_abas)
+            processos: Número máximo de processos ao ler várias abas
+            atributos_por_ncm: Catálogo oficial (ver carregar_catalogo_ncm); se
+                  informado, avisa atributos inválidos/faltantes para o NCM
+
+        Raises:
+            ConversaoCancelada: self.cancelamento acionado durante a leitura
+        """
+        if abas is not None:
+            return self.ler_abas(caminho_excel, defaults, abas, processos, atributos_por_ncm)
+
+        defaults = defaults or {}
+        if not os.path.exists(caminho_excel):
+            self.erros.append(f"Arquivo não encontrado: {caminho_excel}")
+            return []
+
+        print(f"\n📂 Lendo planilha: {caminho_excel}")
+
+        self._reiniciar_cache()
+        wb = self._abrir_planilha(caminho_excel)
+        if wb is None:
+            return []
+
+        try:
+            return self._ler_aba(wb.active, defaults, atributos_por_ncm)
+        finally:
+            wb.close()
+
+    def _ler_aba(self, ws, defaults: dict, atributos_por_ncm: dict = None,
+                 opcional: bool = False) -> list:
+        """
+        Lê os produtos de uma aba (cabeçalhos na linha 1, dados a partir da 2).
+        Com `opcional` (abas="todas"), uma aba sem nenhuma coluna obrigatória de
+        produto (instruções, tabelas de apoio) é ignorada com um aviso, em vez
+        de gerar erro de colunas obrigatórias.
+        """
+        # Ler cabeçalhos da primeira linha
+        cabecalhos = self._ler_cabecalhos(ws)
+
+        print(f"📋 Colunas encontradas: {len(cabecalhos)}")
+        print(f"   {', '.join(cabecalhos[:10])}{'...' if len(cabecalhos) > 10 else ''}")
+
+        # Identificar colunas de atributos (começa com ATT_)
+        colunas_principais, colunas_atributos_simples, colunas_atributos_multi = \
+            self._mapear_colunas(cabecalhos)
+
+        print(f"\n🔍 Mapeamento de colunas:")
+        print(f"   Campos principais: {len(colunas_principais)}")
+        for campo, idx in sorted(colunas_principais.items(), key=lambda x: x[1]):
+            print(f"     Col {idx+1} ({cabecalhos[idx]}) → {campo}")
+        print(f"   Atributos simples: {len(colunas_atributos_simples)}")
+        for idx, att in sorted(colunas_atributos_simples.items()):
+            label = ATRIBUTOS_LABELS.get(att, att)
+            print(f"     Col {idx+1} ({cabecalhos[idx]}) → {att} ({label})")
+        print(f"   Atributos multivalorados: {len(colunas_atributos_multi)}")
+        for idx, att in sorted(colunas_atributos_multi.items()):
+            label = ATRIBUTOS_LABELS.get(att, att)
+            print(f"     Col {idx+1} ({cabecalhos[idx]}) → {att} ({label})")
+
+        if opcional and not any(campo in colunas_principais for campo in CAMPOS_OBRIGATORIOS_POST):
+            self.avisos.append("Aba sem colunas de produto (denominacao, ncm, ...); ignorada.")
+            return []
+
+        # Verificar campos obrigatórios (aceitar defaults para os que faltam)
+        if not self._verificar_colunas_obrigatorias(colunas_principais, defaults):
+            return []
+
+        # Plano de injeção de atributos padrão, resolvido uma vez para as colunas da aba
+        plano = None
+        if self.injecao:
+            plano = self.injecao.compilar(colunas_atributos_simples, colunas_atributos_multi)
+
+        # Processar cada linha de dados (a partir da linha 2)
+        produtos = []
+        cancelamento = self.cancelamento
+        for lidas, (row, valores) in enumerate(self._linhas_dados(ws, len(cabecalhos)), 1):
+            if cancelamento and lidas % CANCELAMENTO_INTERVALO_LINHAS == 0:
+                cancelamento.verificar(lidas)
             produto = self._processar_linha(
-                ws, row, cabecalhos,
+                valores, row,
                 colunas_principais,
                 colunas_atributos_simples,
                 colunas_atributos_multi,
-                defaults
+                defaults,
+                plano
             )
             if produto:
                 produtos.append(produto)
+                if atributos_por_ncm:
+                    self._validar_atributos_ncm(
+                        valores, row, produto, colunas_atributos_simples,
+                        colunas_atributos_multi, atributos_por_ncm
+                    )
 
         print(f"\n✅ {len(produtos)} produtos lidos com sucesso.")
+        return produtos
+
+    # ========================================================================
+    # LEITURA DE VÁRIAS ABAS (UMA POR PROCESSO)
+    # ========================================================================
+
+    def listar_abas(self, caminho_excel: str) -> list:
+        """Nomes das abas da planilha, na ordem do arquivo ([] se não abrir)."""
+        wb = self._abrir_planilha(caminho_excel, read_only=True)
+        if wb is None:
+            return []
+        nomes = list(wb.sheetnames)
         wb.close()
+        return nomes
+
+    def ler_abas(self, caminho_excel: str, defaults: dict = None, abas="todas",
+                 processos: int = None, atributos_por_ncm: dict = None) -> list:
+        """
+        Lê várias abas da planilha, cada uma num processo, e junta os produtos
+        na ordem das abas (o 'seq' gerado depois é global, de 1 a N).
+
+        Erros e avisos de cada aba são prefixados com o nome dela, ex.:
+        "[Eletrônicos] Linha 5: NCM '123' inválido...".
+
+        Args:
+            abas: "todas" (abas sem colunas de produto são ignoradas com aviso)
+                  ou lista de nomes de abas (todas precisam ser de produtos)
+            processos: Máximo de processos (padrão: uma por aba, até os.cpu_count())
+        """
+        defaults = defaults or {}
+        if not os.path.exists(caminho_excel):
+            self.erros.append(f"Arquivo não encontrado: {caminho_excel}")
+            return []
+
+        disponiveis = self.listar_abas(caminho_excel)
+        if not disponiveis:
+            return []
+        # Abas pedidas pelo nome precisam ser de produtos; em "todas", as demais são puladas
+        opcional = abas == "todas"
+        if opcional:
+            abas = disponiveis
+        faltando = [aba for aba in abas if aba not in disponiveis]
+        if faltando:
+            self.erros.append(
+                f"Aba(s) não encontrada(s): {', '.join(faltando)}. "
+                f"Abas disponíveis: {', '.join(disponiveis)}"
+            )
+            return []
+
+        print(f"\n📂 Lendo {len(abas)} aba(s) de: {caminho_excel}")
+
+        processos = max(1, min(processos or os.cpu_count() or 1, len(abas)))
+        tarefas = [(caminho_excel, aba, defaults, self.auto_truncar, atributos_por_ncm, self.injecao, opcional)
+                   for aba in abas]
+        if processos == 1:
+            resultados = [_ler_aba_isolada(*tarefa, cancelamento=self.cancelamento) for tarefa in tarefas]
+        else:
+            # O token não atravessa processos: verificado antes e depois do pool
+            if self.cancelamento:
+                self.cancelamento.verificar()
+            with ProcessPoolExecutor(max_workers=processos) as executor:
+                resultados = list(executor.map(_ler_aba_isolada, *zip(*tarefas)))
+            if self.cancelamento:
+                self.cancelamento.verificar()
+
+        produtos = []
+        for aba, (produtos_aba, erros, avisos) in zip(abas, resultados):
+            produtos.extend(produtos_aba)
+            self.erros.extend(f"[{aba}] {erro}" for erro in erros)
+            self.avisos.extend(f"[{aba}] {aviso}" for aviso in avisos)
+
+        print(f"\n✅ {len(produtos)} produtos lidos de {len(abas)} aba(s).")
         return produtos
 
-    def _processar_linha(self, ws, row, cabecalhos, cols_principais, cols_att_simples, cols_att_multi, defaults=None) -> dict:
-        """Processa uma linha da planilha e retorna um dicionário de produto."""
+    # ========================================================================
+    # VALIDAÇÃO RÁPIDA (SEM GERAR PRODUTOS)
+    # ========================================================================
+
+    def validar_planilha(self, caminho_excel: str, defaults: dict = None,
+                         max_erros: int = None, atributos_por_ncm: dict = None) -> dict:
+        """
+        Valida a planilha sem montar os produtos (sem atributos nem códigos internos).
+
+        Lê as linhas em streaming (modo read_only) e aplica apenas as checagens:
+        campos obrigatórios, NCM, modalidade, situação, CNPJ, tamanhos e, se
+        `atributos_por_ncm` for informado, a validade dos atributos para o NCM.
+        Erros e avisos são acumulados em self.erros / self.avisos.
+
+        Args:
+            caminho_excel: Caminho do arquivo .xlsx
+            defaults: Valores padrão para campos ausentes (mesmo formato de ler_planilha)
+            max_erros: Interrompe a leitura ao atingir este número de erros (None = sem limite)
+            atributos_por_ncm: { ncm: { codigo_att: {obrigatorio, multivalorado, ...} } }
+
+        Returns:
+            Dict com total_linhas, linhas_validas, interrompido e tempo_ms
+        """
+        inicio = time.perf_counter()
         defaults = defaults or {}
-        produto = {}
-        linha_valida = True
+        resumo = {
+            'total_linhas': 0,
+            'linhas_validas': 0,
+            'interrompido': False,
+            'tempo_ms': 0.0,
+        }
 
-        # 1. Campos principais
-        for campo, idx in cols_principais.items():
-            valor_celula = ws.cell(row=row, column=idx + 1).value
+        self._reiniciar_cache()
+        wb = self._abrir_planilha(caminho_excel, read_only=True)
+        if wb is None:
+            resumo['tempo_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+            return resumo
 
-            if valor_celula is None:
-                valor = ""
+        try:
+            ws = wb.active
+            cabecalhos = self._ler_cabecalhos(ws)
+            cols_principais, cols_att_simples, cols_att_multi = self._mapear_colunas(cabecalhos)
+
+            if self._verificar_colunas_obrigatorias(cols_principais, defaults):
+                cancelamento = self.cancelamento
+                for row, valores in self._linhas_dados(ws, len(cabecalhos)):
+                    resumo['total_linhas'] += 1
+                    if cancelamento and resumo['total_linhas'] % CANCELAMENTO_INTERVALO_LINHAS == 0:
+                        cancelamento.verificar(resumo['total_linhas'])
+                    produto, vereditos = self._montar_campos_principais(
+                        valores, row, cols_principais, defaults
+                    )
+                    if self._validar_campos(produto, row, vereditos):
+                        resumo['linhas_validas'] += 1
+                        if atributos_por_ncm:
+                            self._validar_atributos_ncm(
+                                valores, row, produto, cols_att_simples,
+                                cols_att_multi, atributos_por_ncm
+                            )
+                    if max_erros and len(self.erros) >= max_erros:
+                        resumo['interrompido'] = True
+                        break
+        finally:
+            wb.close()
+
+        resumo['tempo_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+        return resumo
+
+    def verificar_amostra(self, caminho_excel: str, defaults: dict = None,
+                          tamanho_amostra: int = AMOSTRA_TAMANHO_PADRAO,
+                          orcamento_s: float = AMOSTRA_ORCAMENTO_S,
+                          atributos_por_ncm: dict = None, semente: int = None) -> dict:
+        """
+        Verificação rápida por amostragem, antes da conversão completa.
+
+        Sorteia linhas estratificadas (primeiras, últimas e uma aleatória por
+        faixa intermediária), valida apenas essas e estima a taxa de erro da
+        planilha. Em abas sem <dimension> (total de linhas desconhecido no
+        modo read-only) a amostra é uniforme, tirada numa passada completa.
+        A leitura para ao esgotar `orcamento_s` segundos; nesse caso a
+        estimativa usa as linhas já validadas (ver 'interrompido_por_tempo').
+        Sem nenhuma linha validada o resultado é inconclusivo: taxa None e
+        intervalo [0, 1].
+
+        Returns:
+            Dict com amostra, linhas_com_erro, taxa_erro_estimada, intervalo_95,
+            total_linhas_estimado, linhas_percorridas, inconclusivo,
+            interrompido_por_tempo e tempo_ms
+        """
+        inicio = time.perf_counter()
+        defaults = defaults or {}
+        resumo = {
+            'amostra': 0,
+            'linhas_com_erro': 0,
+            'taxa_erro_estimada': 0.0,
+            'intervalo_95': [0.0, 0.0],
+            'total_linhas_estimado': 0,
+            'linhas_percorridas': 0,
+            'inconclusivo': False,
+            'interrompido_por_tempo': False,
+            'tempo_ms': 0.0,
+        }
+
+        self._reiniciar_cache()
+        wb = self._abrir_planilha(caminho_excel, read_only=True)
+        if wb is None:
+            resumo['taxa_erro_estimada'] = 1.0
+            resumo['intervalo_95'] = [1.0, 1.0]
+            resumo['tempo_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+            return resumo
+
+        try:
+            ws = wb.active
+            cabecalhos = self._ler_cabecalhos(ws)
+            cols_principais, cols_att_simples, cols_att_multi = self._mapear_colunas(cabecalhos)
+
+            if not self._verificar_colunas_obrigatorias(cols_principais, defaults):
+                # Problema estrutural: todas as linhas falhariam
+                resumo['taxa_erro_estimada'] = 1.0
+                resumo['intervalo_95'] = [1.0, 1.0]
             else:
-                valor = str(valor_celula).strip()
-
-            # Limpeza e normalização
-            if campo == "ncm":
-                valor = valor.replace(".", "").replace("-", "").replace(" ", "")
-                # Se veio como número float (ex: 90211010.0), remover .0
-                if valor.endswith(".0"):
-                    valor = valor[:-2]
-                # Preencher zeros à esquerda se necessário
-                valor = valor.zfill(8)
-
-            elif campo == "cpfCnpjRaiz":
-                valor = valor.replace(".", "").replace("-", "").replace("/", "").replace(" ", "")
-                if valor.endswith(".0"):
-                    valor = valor[:-2]
-
-            elif campo == "modalidade":
-                valor = valor.upper().strip()
-                # Normalizar variações
-                if valor in ["IMP", "IMPORT", "IMPORTAÇÃO", "IMPORTAÇAO"]:
-                    valor = "IMPORTACAO"
-                elif valor in ["EXP", "EXPORT", "EXPORTAÇÃO", "EXPORTAÇAO"]:
-                    valor = "EXPORTACAO"
-
-            elif campo == "situacao":
-                if valor == "":
-                    valor = "ATIVADO"  # Padrão (maiúscula conforme API)
-                # Normalizar para MAIÚSCULAS conforme Swagger
-                valor_lower = valor.lower()
-                if valor_lower in ["ativo", "ativado", "sim", "s", "1", "true", "yes"]:
-                    valor = "ATIVADO"
-                elif valor_lower in ["inativo", "desativado", "não", "nao", "n", "0", "false", "no"]:
-                    valor = "DESATIVADO"
-                elif valor_lower == "rascunho":
-                    valor = "RASCUNHO"
+                limite_tempo = inicio + orcamento_s
+                if ws.max_row is not None:
+                    total = max(ws.max_row - 1, 0)
+                    resumo['total_linhas_estimado'] = total
+                    sorteadas = _sortear_linhas_estratificadas(total, tamanho_amostra, semente)
+                    candidatas = _percorrer_sorteadas(ws, sorteadas, limite_tempo, resumo)
+                else:
+                    # Aba sem <dimension>: o read-only não sabe o total de linhas;
+                    # amostra uniforme (reservatório) numa passada completa
+                    candidatas = _amostra_reservatorio(ws, len(cabecalhos), tamanho_amostra,
+                                                       semente, limite_tempo, resumo)
+
+                for row, valores in candidatas:
+                    if len(valores) < len(cabecalhos):
+                        valores = tuple(valores) + (None,) * (len(cabecalhos) - len(valores))
+                    if all(v is None or str(v).strip() == "" for v in valores[:len(cabecalhos)]):
+                        continue
+
+                    erros_antes = len(self.erros)
+                    produto, vereditos = self._montar_campos_principais(
+                        valores, row, cols_principais, defaults
+                    )
+                    if self._validar_campos(produto, row, vereditos) and atributos_por_ncm:
+                        self._validar_atributos_ncm(
+                            valores, row, produto, cols_att_simples,
+                            cols_att_multi, atributos_por_ncm
+                        )
+                    resumo['amostra'] += 1
+                    if len(self.erros) > erros_antes:
+                        resumo['linhas_com_erro'] += 1
+
+                if resumo['amostra']:
+                    taxa = resumo['linhas_com_erro'] / resumo['amostra']
+                    resumo['taxa_erro_estimada'] = round(taxa, 4)
                 else:
-                    valor = valor.upper()  # Qualquer outro valor, forçar uppercase
+                    # Nenhuma linha verificada: não há o que estimar
+                    resumo['inconclusivo'] = True
+                    resumo['taxa_erro_estimada'] = None
+                resumo['intervalo_95'] = [
+                    round(v, 4) for v in _intervalo_wilson(resumo['linhas_com_erro'], resumo['amostra'])
+                ]
+        finally:
+            wb.close()
+
+        resumo['tempo_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+        return resumo
+
+    def _validar_atributos_ncm(self, valores, row, produto, cols_att_simples,
+                               cols_att_multi, atributos_por_ncm):
+        """Verifica atributos preenchidos na linha contra a lista oficial do NCM e seus domínios."""
+        ncm = produto.get('ncm', '')
+        validos = atributos_por_ncm.get(ncm)
+        if validos is None:
+            # NCM fora da tabela vigente: avisar uma vez por NCM (atributos não verificados)
+            if ncm and ncm not in self._ncms_fora_catalogo:
+                self._ncms_fora_catalogo.add(ncm)
+                self.avisos.append(
+                    f"Linha {row}: NCM {ncm} não consta na tabela de atributos por NCM "
+                    f"carregada; atributos deste NCM não foram verificados"
+                )
+            return
+        if not validos:
+            return
+
+        nome = produto.get('denominacao', f'Linha {row}')[:50]
+        preenchidos = set(self.injecao.codigos) if self.injecao else set()
+        removidos = []
+        for idx, cod in cols_att_simples.items():
+            valor = valores[idx]
+            if valor is None or str(valor).strip() == "":
+                continue
+            preenchidos.add(cod)
+            if cod not in validos:
+                removidos.append(cod)
+                continue
+            dominio = validos[cod].get('dominio')
+            if dominio:
+                valor_att = _normalizar_valor_atributo(cod, valor)
+                if valor_att not in dominio:
+                    self._erro_dominio(row, nome, cod, ncm, [valor_att])
+        for idx, cod in cols_att_multi.items():
+            valor = valores[idx]
+            if valor is None or str(valor).strip() == "":
+                continue
+            preenchidos.add(cod)
+            if cod not in validos:
+                removidos.append(cod)
+                continue
+            if not validos[cod].get('multivalorado'):
+                self.avisos.append(
+                    f"Linha {row} ('{nome}'): {cod} não é multivalorado para NCM {ncm}, "
+                    f"apenas o primeiro valor será usado"
+                )
+            dominio = validos[cod].get('dominio')
+            if dominio:
+                fora = [v for v in _separar_valores_multi(valor) if v not in dominio]
+                if fora:
+                    self._erro_dominio(row, nome, cod, ncm, fora)
+
+        if removidos:
+            self.avisos.append(
+                f"Linha {row} ('{nome}'): atributos não válidos para NCM {ncm}: {', '.join(removidos)}"
+            )
 
-            elif campo == "codigo":
-                if valor and valor != "":
-                    try:
-                        valor = int(float(valor))
-                    except (ValueError, TypeError):
-                        pass
+        faltando = [cod for cod, info in validos.items()
+                    if info.get('obrigatorio') and cod not in preenchidos]
+        if faltando:
+            self.avisos.append(
+                f"Linha {row} ('{nome}'): FALTA atributo obrigatório para NCM {ncm}: {', '.join(faltando)}"
+            )
 
-            elif campo == "codigosInterno":
-                # Não processar aqui, será tratado separadamente
-                pass
+    def _erro_dominio(self, row, nome, cod, ncm, valores_fora):
+        """Registra valores de atributo fora do domínio oficial."""
+        label = ATRIBUTOS_LABELS.get(cod, cod)
+        lista = ', '.join(f"'{v[:30]}'" for v in valores_fora[:5])
+        if len(valores_fora) > 5:
+            lista += f" (+{len(valores_fora) - 5})"
+        self.erros.append(
+            f"Linha {row} ('{nome}'): valor fora do domínio oficial de {cod} ({label}) "
+            f"para NCM {ncm}: {lista}"
+        )
 
-            produto[campo] = valor
+    # ========================================================================
+    # PROCESSAMENTO DE LINHAS
+    # ========================================================================
+
+    def _normalizar_campo(self, campo: str, valor_celula):
+        """Limpa e normaliza o valor de um campo principal lido da planilha."""
+        if valor_celula is None:
+            valor = ""
+        else:
+            valor = str(valor_celula).strip()
+
+        # Limpeza e normalização
+        if campo == "ncm":
+            valor = valor.replace(".", "").replace("-", "").replace(" ", "")
+            # Se veio como número float (ex: 90211010.0), remover .0
+            if valor.endswith(".0"):
+                valor = valor[:-2]
+            # Preencher zeros à esquerda se necessário
+            valor = valor.zfill(8)
+
+        elif campo == "cpfCnpjRaiz":
+            valor = valor.replace(".", "").replace("-", "").replace("/", "").replace(" ", "")
+            if valor.endswith(".0"):
+                valor = valor[:-2]
+
+        elif campo == "modalidade":
+            valor = valor.upper().strip()
+            # Normalizar variações
+            if valor in ["IMP", "IMPORT", "IMPORTAÇÃO", "IMPORTAÇAO"]:
+                valor = "IMPORTACAO"
+            elif valor in ["EXP", "EXPORT", "EXPORTAÇÃO", "EXPORTAÇAO"]:
+                valor = "EXPORTACAO"
+
+        elif campo == "situacao":
+            if valor == "":
+                valor = "ATIVADO"  # Padrão (maiúscula conforme API)
+            # Normalizar para MAIÚSCULAS conforme Swagger
+            valor_lower = valor.lower()
+            if valor_lower in ["ativo", "ativado", "sim", "s", "1", "true", "yes"]:
+                valor = "ATIVADO"
+            elif valor_lower in ["inativo", "desativado", "não", "nao", "n", "0", "false", "no"]:
+                valor = "DESATIVADO"
+            elif valor_lower == "rascunho":
+                valor = "RASCUNHO"
+            else:
+                valor = valor.upper()  # Qualquer outro valor, forçar uppercase
+
+        elif campo == "codigo":
+            if valor and valor != "":
+                try:
+                    valor = int(float(valor))
+                except (ValueError, TypeError):
+                    pass
+
+        elif campo == "codigosInterno":
+            # Não processar aqui, será tratado separadamente
+            pass
+
+        return valor
+
+    def _reiniciar_cache(self):
+        """Zera a memoização de normalização (uma por conversão)."""
+        self._cache_normalizacao = {campo: {} for campo in CAMPOS_MEMOIZADOS}
+        self._ncms_fora_catalogo = set()
+
+    def _normalizar_validar(self, campo: str, valor_celula) -> tuple:
+        """
+        Normaliza um campo memoizado e devolve (valor, erro_ou_None).
+        Valores repetidos na planilha custam apenas uma consulta ao dicionário.
+        """
+        cache = self._cache_normalizacao[campo]
+        chave = (valor_celula.__class__, valor_celula)
+        resultado = cache.get(chave)
+        if resultado is None:
+            valor = self._normalizar_campo(campo, valor_celula)
+            resultado = (valor, VERIFICADORES_CAMPO[campo](valor) if valor else None)
+            if len(cache) < CACHE_NORMALIZACAO_MAX:
+                cache[chave] = resultado
+        return resultado
+
+    def _montar_campos_principais(self, valores, row, cols_principais, defaults) -> tuple:
+        """
+        Monta o dicionário com os campos principais de uma linha (com defaults).
+
+        Returns:
+            (produto, vereditos) — vereditos: {campo: mensagem_de_erro_ou_None}
+            para os campos memoizados lidos da planilha
+        """
+        produto = {}
+        vereditos = {}
+
+        # 1. Campos principais
+        for campo, idx in cols_principais.items():
+            if campo in self._cache_normalizacao:
+                produto[campo], vereditos[campo] = self._normalizar_validar(campo, valores[idx])
+            else:
+                produto[campo] = self._normalizar_campo(campo, valores[idx])
 
         # 1b. Aplicar defaults para campos que não estão na planilha
         for campo_default, valor_default in defaults.items():
@@ -473,22 +1820,32 @@ class ConversorCatalogoSiscomex:
                 f"{MAX_DENOMINACAO} caracteres da 'descricao'."
             )
 
+        return produto, vereditos
+
+    def _validar_campos(self, produto: dict, row: int, vereditos: dict = None) -> bool:
+        """
+        Valida (e trunca, se configurado) os campos principais de uma linha.
+        `vereditos` traz o resultado já memoizado da validação de NCM, CNPJ,
+        modalidade e situação; campos vindos de defaults são verificados aqui.
+        """
+        vereditos = vereditos or {}
+        linha_valida = True
+
         # 2. Validações
         for campo in CAMPOS_OBRIGATORIOS_POST:
             if not self.validar_campo_obrigatorio(produto.get(campo), campo, row):
                 linha_valida = False
 
-        if produto.get("ncm") and not self.validar_ncm(produto["ncm"], row):
-            linha_valida = False
-
-        if produto.get("modalidade") and not self.validar_modalidade(produto["modalidade"], row):
-            linha_valida = False
-
-        if produto.get("situacao") and not self.validar_situacao(produto["situacao"], row):
-            linha_valida = False
-
-        if produto.get("cpfCnpjRaiz") and not self.validar_cpf_cnpj_raiz(produto["cpfCnpjRaiz"], row):
-            linha_valida = False
+        for campo in ("ncm", "modalidade", "situacao", "cpfCnpjRaiz"):
+            valor = produto.get(campo)
+            if not valor:
+                continue
+            if campo in vereditos:
+                erro = vereditos[campo]
+            else:
+                erro = VERIFICADORES_CAMPO[campo](valor)
+            if not self._registrar_erro(erro, row):
+                linha_valida = False
 
         # Truncamento automático ou validação de tamanho
         if produto.get("denominacao") and len(str(produto["denominacao"])) > MAX_DENOMINACAO:
@@ -519,7 +1876,18 @@ class ConversorCatalogoSiscomex:
                 )
                 linha_valida = False
 
-        if not linha_valida:
+        return linha_valida
+
+    def _processar_linha(self, valores, row, cols_principais, cols_att_simples, cols_att_multi,
+                         defaults=None, plano=None) -> dict:
+        """
+        Processa os valores de uma linha da planilha e retorna um dicionário de produto.
+        `plano`: self.injecao compilado para as colunas da aba (PlanoInjecao.compilar).
+        """
+        defaults = defaults or {}
+        produto, vereditos = self._montar_campos_principais(valores, row, cols_principais, defaults)
+
+        if not self._validar_campos(produto, row, vereditos):
             return None
 
         # 3. Processar códigos internos (separados por ; ou ,)
@@ -541,29 +1909,9 @@ class ConversorCatalogoSiscomex:
         # 4. Processar atributos simples
         atributos = []
         for idx, codigo_att in cols_att_simples.items():
-            valor_celula = ws.cell(row=row, column=idx + 1).value
+            valor_celula = valores[idx]
             if valor_celula is not None and str(valor_celula).strip() != "":
-                valor_str = str(valor_celula).strip()
-                # Tratar booleanos
-                if isinstance(valor_celula, bool):
-                    valor_str = "true" if valor_celula else "false"
-                elif valor_str.upper() in ["TRUE", "VERDADEIRO", "SIM"]:
-                    valor_str = "true"
-                elif valor_str.upper() in ["FALSE", "FALSO", "NÃO", "NAO"]:
-                    valor_str = "false"
-                # Remover .0 de números inteiros
-                if valor_str.endswith(".0"):
-                    try:
-                        float(valor_str)
-                        valor_str = valor_str[:-2]
-                    except ValueError:
-                        pass
-
-                # Zero-padding para atributos com código de domínio de 2 dígitos
-                # ATT_14540 (Estágio de Fabricação): "1" → "01"
-                if codigo_att == 'ATT_14540' and valor_str.isdigit() and len(valor_str) == 1:
-                    valor_str = valor_str.zfill(2)
-
+                valor_str = _normalizar_valor_atributo(codigo_att, valor_celula)
                 atributos.append({
                     "atributo": codigo_att,
                     "valor": valor_str
@@ -574,23 +1922,9 @@ class ConversorCatalogoSiscomex:
         # 5. Processar atributos multivalorados
         atributos_multi = []
         for idx, codigo_att in cols_att_multi.items():
-            valor_celula = ws.cell(row=row, column=idx + 1).value
+            valor_celula = valores[idx]
             if valor_celula is not None and str(valor_celula).strip() != "":
-                valor_str = str(valor_celula).strip()
-                # Valores separados por ; ou ,
-                separador = re.compile(r'[;,|\n]+')
-                valores = [v.strip() for v in separador.split(valor_str) if v.strip()]
-                # Remover .0 de cada valor
-                valores_limpos = []
-                for v in valores:
-                    if v.endswith(".0"):
-                        try:
-                            float(v)
-                            v = v[:-2]
-                        except ValueError:
-                            pass
-                    valores_limpos.append(v)
-
+                valores_limpos = _separar_valores_multi(valor_celula)
                 if valores_limpos:
                     atributos_multi.append({
                         "atributo": codigo_att,
@@ -603,57 +1937,44 @@ class ConversorCatalogoSiscomex:
         produto["atributosCompostos"] = []
         produto["atributosCompostosMultivalorados"] = []
 
+        # 7. Atributos padrão onde a célula está vazia ou a coluna não existe
+        if plano:
+            self.injecao.aplicar(produto, valores, plano)
+
         return produto
 
     # ========================================================================
     # GERAÇÃO DE JSON
     # ========================================================================
 
+    def gerar_json(self, modo: str, produtos: list) -> list:
+        """Gera o JSON do modo informado (um dos MODOS_SAIDA)."""
+        return getattr(self, f"gerar_json_{modo}")(produtos)
+
+    def _projetar(self, modo: str, produtos: list) -> list:
+        """Aplica a projeção compilada do modo a todos os produtos (seq a partir de 1)."""
+        projetar = PROJECOES[modo]
+        return [projetar(produto, seq) for seq, produto in enumerate(produtos, 1)]
+
     def gerar_json_post(self, produtos: list) -> list:
         """
         Gera JSON para POST (inclusão de novos produtos via upload no portal).
         Usa o schema ProdutoIntegracaoDTO que requer 'seq'.
         Remove campos read-only: versao, codigo.
         NÃO inclui versao nem codigo para que o portal crie novos produtos.
-        Ordem dos campos segue o padrão do portal.
+        Ordem dos campos segue o padrão do portal (ver ESQUEMAS_SAIDA['post']).
         """
-        resultado = []
-        for seq, produto in enumerate(produtos, 1):
-            item = {}
-            # Ordem: seq, descricao, denominacao, cpfCnpjRaiz, situacao,
-            #         modalidade, ncm, atributos..., codigosInterno
-            item["seq"] = seq
-            item["descricao"] = produto.get("descricao", "")
-            item["denominacao"] = produto.get("denominacao", "")
-            item["cpfCnpjRaiz"] = produto.get("cpfCnpjRaiz", "")
-            situacao = produto.get("situacao", "ATIVADO")
-            item["situacao"] = self.normalizar_situacao(situacao)
-            item["modalidade"] = produto.get("modalidade", "")
-            item["ncm"] = produto.get("ncm", "")
-
-            # Atributos
-            item["atributos"] = produto.get("atributos", [])
-            item["atributosMultivalorados"] = produto.get("atributosMultivalorados", [])
-            item["atributosCompostos"] = produto.get("atributosCompostos", [])
-            item["atributosCompostosMultivalorados"] = produto.get("atributosCompostosMultivalorados", [])
-
-            # Código operador estrangeiro
-            if produto.get('codigoOperadorEstrangeiro'):
-                item['codigoOperadorEstrangeiro'] = produto['codigoOperadorEstrangeiro']
-
-            # Códigos internos
-            item["codigosInterno"] = produto.get("codigosInterno", [])
-
-            resultado.append(item)
-
-        return resultado
+        return self._projetar("post", produtos)
 
     def gerar_json_put(self, produtos: list) -> list:
         """
         Gera JSON para PUT (atualização/nova versão de produtos existentes).
         Inclui 'seq' e 'codigo' no body. Remove versao (nova versão é criada pelo servidor).
         Usa ProdutoIntegracaoDTO para upload em lote pelo portal.
+        Produtos sem 'codigo' saem no formato POST, mantendo a numeração de 'seq'.
         """
+        projetar_put = PROJECOES["put"]
+        projetar_post = PROJECOES["post"]
         resultado = []
         for seq, produto in enumerate(produtos, 1):
             codigo = produto.get("codigo")
@@ -662,35 +1983,9 @@ class ConversorCatalogoSiscomex:
                     f"Produto '{produto.get('denominacao', '?')}': sem 'codigo', "
                     f"não pode ser usado em PUT (atualização). Será gerado como POST."
                 )
-                # Gerar como POST
-                item_post = self.gerar_json_post([produto])
-                if item_post:
-                    resultado.extend(item_post)
-                continue
-
-            item = {}
-            item["seq"] = seq
-            item["codigo"] = int(codigo) if isinstance(codigo, (int, float)) else codigo
-            item["descricao"] = produto.get("descricao", "")
-            item["denominacao"] = produto.get("denominacao", "")
-            item["cpfCnpjRaiz"] = produto.get("cpfCnpjRaiz", "")
-            situacao = produto.get("situacao", "ATIVADO")
-            item["situacao"] = self.normalizar_situacao(situacao)
-            item["modalidade"] = produto.get("modalidade", "")
-            item["ncm"] = produto.get("ncm", "")
-
-            item["atributos"] = produto.get("atributos", [])
-            item["atributosMultivalorados"] = produto.get("atributosMultivalorados", [])
-            item["atributosCompostos"] = produto.get("atributosCompostos", [])
-            item["atributosCompostosMultivalorados"] = produto.get("atributosCompostosMultivalorados", [])
-
-            # Código operador estrangeiro
-            if produto.get('codigoOperadorEstrangeiro'):
-                item['codigoOperadorEstrangeiro'] = produto['codigoOperadorEstrangeiro']
-
-            item["codigosInterno"] = produto.get("codigosInterno", [])
-
-            resultado.append(item)
+                resultado.append(projetar_post(produto, seq))
+            else:
+                resultado.append(projetar_put(produto, seq))
 
         return resultado
 
@@ -700,30 +1995,7 @@ class ConversorCatalogoSiscomex:
         Usa o schema ProdutoIntegracaoRequestDTO.
         NÃO inclui: seq, cpfCnpjRaiz, situacao, codigo, versao (cpfCnpjRaiz vai na URL).
         """
-        resultado = []
-        for produto in produtos:
-            item = {}
-            item["descricao"] = produto.get("descricao", "")
-            item["denominacao"] = produto.get("denominacao", "")
-            item["modalidade"] = produto.get("modalidade", "")
-            item["ncm"] = produto.get("ncm", "")
-
-            # Atributos
-            item["atributos"] = produto.get("atributos", [])
-            item["atributosMultivalorados"] = produto.get("atributosMultivalorados", [])
-            item["atributosCompostos"] = produto.get("atributosCompostos", [])
-            item["atributosCompostosMultivalorados"] = produto.get("atributosCompostosMultivalorados", [])
-
-            # Código operador estrangeiro
-            if produto.get('codigoOperadorEstrangeiro'):
-                item['codigoOperadorEstrangeiro'] = produto['codigoOperadorEstrangeiro']
-
-            # Códigos internos
-            item["codigosInterno"] = produto.get("codigosInterno", [])
-
-            resultado.append(item)
-
-        return resultado
+        return self._projetar("api_post", produtos)
 
     def gerar_json_api_put(self, produtos: list) -> list:
         """
@@ -734,7 +2006,6 @@ class ConversorCatalogoSiscomex:
         NÃO inclui: seq, cpfCnpjRaiz, situacao, codigo, versao no body
         (codigo e versao vão na URL).
         """
-        resultado = []
         for produto in produtos:
             codigo = produto.get("codigo")
             if not codigo or str(codigo).strip() == "":
@@ -744,88 +2015,33 @@ class ConversorCatalogoSiscomex:
                     f"use PUT /ext/produto/{{cpfCnpjRaiz}}/{{codigo}} com o código na URL."
                 )
 
-            item = {}
-            item["descricao"] = produto.get("descricao", "")
-            item["denominacao"] = produto.get("denominacao", "")
-            item["modalidade"] = produto.get("modalidade", "")
-            item["ncm"] = produto.get("ncm", "")
-
-            item["atributos"] = produto.get("atributos", [])
-            item["atributosMultivalorados"] = produto.get("atributosMultivalorados", [])
-            item["atributosCompostos"] = produto.get("atributosCompostos", [])
-            item["atributosCompostosMultivalorados"] = produto.get("atributosCompostosMultivalorados", [])
-
-            # Código operador estrangeiro
-            if produto.get('codigoOperadorEstrangeiro'):
-                item['codigoOperadorEstrangeiro'] = produto['codigoOperadorEstrangeiro']
-
-            item["codigosInterno"] = produto.get("codigosInterno", [])
-
-            resultado.append(item)
-
-        return resultado
+        return self._projetar("api_put", produtos)
 
     def gerar_json_completo(self, produtos: list) -> list:
         """
         Gera JSON no formato completo de exportação (como o portal exporta),
         incluindo seq, codigo, versao. Ordem dos campos idêntica ao portal.
+        Sem 'codigo' válido, usa o próprio seq; 'versao' só sai se veio do original.
         """
-        resultado = []
-        for seq, produto in enumerate(produtos, 1):
-            item = {}
-            # Ordem exata do portal: seq, codigo, descricao, denominacao, 
-            # cpfCnpjRaiz, situacao, modalidade, ncm, versao, atributos,
-            # atributosMultivalorados, atributosCompostos, 
-            # atributosCompostosMultivalorados, codigosInterno
-            item["seq"] = seq
-
-            codigo = produto.get("codigo", seq)
-            if isinstance(codigo, str) and codigo.strip() == "":
-                codigo = seq
-            try:
-                codigo = int(codigo)
-            except (ValueError, TypeError):
-                codigo = seq
-            item["codigo"] = codigo
-
-            item["descricao"] = produto.get("descricao", "")
-            item["denominacao"] = produto.get("denominacao", "")
-            item["cpfCnpjRaiz"] = produto.get("cpfCnpjRaiz", "")
-            situacao = produto.get("situacao", "ATIVADO")
-            item["situacao"] = self.normalizar_situacao(situacao)
-            item["modalidade"] = produto.get("modalidade", "")
-            item["ncm"] = produto.get("ncm", "")
-            # versao: só incluir se veio da planilha/JSON original (campo do servidor)
-            versao = produto.get("versao")
-            if versao and str(versao).strip():
-                item["versao"] = str(versao).strip()
-            item["atributos"] = produto.get("atributos", [])
-            item["atributosMultivalorados"] = produto.get("atributosMultivalorados", [])
-            item["atributosCompostos"] = produto.get("atributosCompostos", [])
-            item["atributosCompostosMultivalorados"] = produto.get("atributosCompostosMultivalorados", [])
-
-            # Código operador estrangeiro
-            if produto.get('codigoOperadorEstrangeiro'):
-                item['codigoOperadorEstrangeiro'] = produto['codigoOperadorEstrangeiro']
-
-            item["codigosInterno"] = produto.get("codigosInterno", [])
-
-            resultado.append(item)
-
-        return resultado
+        return self._projetar("completo", produtos)
 
     # ========================================================================
     # GERAÇÃO DE PLANILHA MODELO
     # ========================================================================
 
-    def gerar_planilha_modelo(self, caminho_saida: str, atributos_extras: list = None):
+    def gerar_planilha_modelo(self, caminho_saida, atributos_extras: list = None,
+                              atributos_multi: list = None, obrigatorios=None):
         """
         Gera planilha modelo (.xlsx) com as colunas corretas e instruções.
         
         Args:
-            caminho_saida: Caminho do arquivo .xlsx de saída
+            caminho_saida: Caminho do arquivo .xlsx de saída (ou arquivo binário aberto)
             atributos_extras: Lista de códigos ATT_ adicionais para incluir
+            atributos_multi: Atributos multivalorados (colunas ATT_xxx_MULTI);
+                             padrão: só ATT_14556 (Tipo de Embalagem)
+            obrigatorios: Códigos ATT_ obrigatórios, destacados no cabeçalho
         """
+        obrigatorios = set(obrigatorios or ())
         wb = openpyxl.Workbook()
 
         # ---- Aba principal: PRODUTOS ----
@@ -870,8 +2086,9 @@ class ConversorCatalogoSiscomex:
             label = ATRIBUTOS_LABELS.get(att, "")
             cabecalhos.append(f"{att}" if not label else f"{att}")
 
-        # Adicionar coluna de atributo multivalorado
-        cabecalhos.append("ATT_14556_MULTI")
+        # Adicionar colunas de atributos multivalorados
+        for att in (["ATT_14556"] if atributos_multi is None else atributos_multi):
+            cabecalhos.append(f"{att}_MULTI")
 
         # Escrever cabeçalhos
         for col_idx, cab in enumerate(cabecalhos, 1):
@@ -879,7 +2096,10 @@ class ConversorCatalogoSiscomex:
             cell.border = border
             cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
 
-            if cab.startswith("ATT_") and "_MULTI" in cab:
+            if cab.startswith("ATT_") and re.match(r"(ATT_\d+)", cab).group(1) in obrigatorios:
+                cell.fill = obrig_fill
+                cell.font = Font(color="000000", bold=True, size=10)
+            elif cab.startswith("ATT_") and "_MULTI" in cab:
                 cell.fill = att_multi_fill
                 cell.font = att_font
             elif cab.startswith("ATT_"):
@@ -907,6 +2127,8 @@ class ConversorCatalogoSiscomex:
             elif cab.startswith("ATT_"):
                 codigo_att = re.match(r"(ATT_\d+)", cab).group(1)
                 desc = ATRIBUTOS_LABELS.get(codigo_att, "Atributo")
+                if codigo_att in obrigatorios:
+                    desc += "\n(OBRIGATÓRIO)"
                 if "_MULTI" in cab:
                     desc += "\n(valores separados por ;)"
             else:
@@ -1065,7 +2287,8 @@ class ConversorCatalogoSiscomex:
         ws_paises.column_dimensions['B'].width = 30
 
         wb.save(caminho_saida)
-        print(f"\n📝 Planilha modelo salva em: {caminho_saida}")
+        if isinstance(caminho_saida, str):
+            print(f"\n📝 Planilha modelo salva em: {caminho_saida}")
 
     # ========================================================================
     # IMPORTAR JSON EXISTENTE PARA PLANILHA
@@ -1185,24 +2408,51 @@ class ConversorCatalogoSiscomex:
     # ========================================================================
 
     def converter(self, caminho_excel: str, caminho_json_saida: str = None,
-                  modo: str = "post", indent: int = 2) -> str:
+                  modo: str = "post", indent: int = 2,
+                  verificacao_rapida: bool = False, modos: list = None,
+                  formato: str = None, lote_max_produtos: int = None,
+                  lote_max_mb: float = None, abas=None, processos: int = None) -> str:
         """
         Método principal: converte planilha Excel em JSON.
         
         Args:
             caminho_excel: Caminho do arquivo .xlsx de entrada
             caminho_json_saida: Caminho do arquivo .json de saída (auto-gerado se None)
-            modo: 'post' (criar), 'put' (atualizar) ou 'completo' (formato exportação)
+            modo: 'post', 'put', 'api_post', 'api_put', 'completo' ou 'multi'
+                  ('multi' gera vários formatos de uma só leitura, num .zip)
             indent: Indentação do JSON (2 para legível, None para compacto)
+            verificacao_rapida: Valida antes uma amostra das linhas e aborta sem
+                ler a planilha inteira se a amostra já tiver erros
+            modos: Formatos gerados no modo 'multi' (padrão: todos de MODOS_SAIDA)
+            formato: 'pretty', 'compact' ou 'ndjson' (um produto por linha);
+                     se None, usa json com o `indent` informado
+            lote_max_produtos: Divide a saída em lotes de até N produtos
+            lote_max_mb: Divide a saída em lotes de até N MB
+                (com lotes, a saída é um .zip com um arquivo por lote e 'seq'
+                recomeçando em 1 em cada lote)
+            abas: "todas" ou lista de abas a ler, em paralelo (padrão: aba ativa)
+            processos: Máximo de processos na leitura de várias abas
         
         Returns:
-            Caminho do arquivo JSON gerado
+            Caminho do arquivo JSON gerado (ou do .zip no modo 'multi' / em lotes)
         """
         self.erros = []
         self.avisos = []
 
+        if verificacao_rapida:
+            resumo = self.verificar_amostra(caminho_excel)
+            if self.erros:
+                print(f"\n❌ Verificação rápida: {resumo['linhas_com_erro']} de "
+                      f"{resumo['amostra']} linhas da amostra com erro "
+                      f"(taxa estimada {resumo['taxa_erro_estimada']:.1%}):")
+                for erro in self.erros:
+                    print(f"   ⛔ {erro}")
+                print("\n⚠️  Corrija os erros acima e tente novamente.")
+                return None
+            self.avisos = []
+
         # Ler planilha
-        produtos = self.ler_planilha(caminho_excel)
+        produtos = self.ler_planilha(caminho_excel, abas=abas, processos=processos)
 
         # Verificar erros
         if self.erros:
@@ -1224,25 +2474,23 @@ class ConversorCatalogoSiscomex:
 
         # Gerar JSON conforme modo
         modo = modo.lower()
-        if modo == "post":
-            json_data = self.gerar_json_post(produtos)
-            sufixo = "_POST"
-        elif modo == "put":
-            json_data = self.gerar_json_put(produtos)
-            sufixo = "_PUT"
-        elif modo == "api_post":
-            json_data = self.gerar_json_api_post(produtos)
-            sufixo = "_API_POST"
-        elif modo == "api_put":
-            json_data = self.gerar_json_api_put(produtos)
-            sufixo = "_API_PUT"
-        elif modo == "completo":
-            json_data = self.gerar_json_completo(produtos)
-            sufixo = "_COMPLETO"
+        if modo == "multi":
+            modos = [m.lower() for m in (modos or MODOS_SAIDA)]
         else:
-            print(f"\n❌ Modo '{modo}' inválido. Use: post, put, api_post, api_put ou completo")
+            modos = [modo]
+        invalidos = [m for m in modos if m not in MODOS_SAIDA]
+        if invalidos or not modos:
+            print(f"\n❌ Modo '{', '.join(invalidos) or modo}' inválido. "
+                  f"Use: post, put, api_post, api_put, completo ou multi")
+            return None
+
+        if formato is not None and formato not in FORMATOS_SAIDA:
+            print(f"\n❌ Formato '{formato}' inválido. Use: {', '.join(FORMATOS_SAIDA)}")
             return None
 
+        # Uma única leitura alimenta todos os formatos pedidos
+        saidas = {m: self.gerar_json(m, produtos) for m in modos}
+
         # Verificar avisos pós-geração
         if self.avisos:
             for aviso in self.avisos:
@@ -1250,27 +2498,708 @@ class ConversorCatalogoSiscomex:
                     print(f"   ⚡ {aviso}")
 
         # Determinar caminho de saída
+        em_lotes = bool(lote_max_produtos or lote_max_mb)
+        sufixo = "_MULTI" if modo == "multi" else SUFIXOS_MODO[modo]
+        extensao_json = EXTENSOES_FORMATO.get(formato, ".json")
+        extensao = ".zip" if modo == "multi" or em_lotes else extensao_json
         if caminho_json_saida is None:
             base = os.path.splitext(caminho_excel)[0]
             timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            caminho_json_saida = f"{base}{sufixo}_{timestamp}.json"
-
-        # Salvar JSON
-        with open(caminho_json_saida, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, ensure_ascii=False, indent=indent)
+            caminho_json_saida = f"{base}{sufixo}_{timestamp}{extensao}"
+
+        # Salvar JSON (no modo multi, um .json por formato dentro de um .zip;
+        # em lotes, um arquivo por lote de cada formato dentro do .zip)
+        if em_lotes:
+            entradas = gravar_lotes_zip(
+                saidas, caminho_json_saida, formato or ("pretty" if indent else "compact"),
+                max_produtos=lote_max_produtos or None,
+                max_bytes=int(lote_max_mb * 1024 * 1024) if lote_max_mb else None,
+            )
+        elif modo == "multi":
+            with zipfile.ZipFile(caminho_json_saida, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for m, json_data in saidas.items():
+                    with zf.open(f"CATALOGO{SUFIXOS_MODO[m]}{extensao_json}", 'w') as destino:
+                        if formato is None:
+                            destino.write(_serializar_bytes(json_data, indent, produtos=True))
+                        else:
+                            escrever_saida(json_data, destino, formato)
+        elif formato is None:
+            gravar_json(saidas[modo], caminho_json_saida, indent, produtos=True)
+        else:
+            gravar_saida(saidas[modo], caminho_json_saida, formato)
 
         tamanho_kb = os.path.getsize(caminho_json_saida) / 1024
         print(f"\n{'='*70}")
         print(f"✅ JSON GERADO COM SUCESSO!")
         print(f"   📄 Arquivo: {caminho_json_saida}")
-        print(f"   📦 Produtos: {len(json_data)}")
+        print(f"   📦 Produtos: {len(produtos)}")
         print(f"   📏 Tamanho: {tamanho_kb:.1f} KB")
-        print(f"   🔧 Modo: {modo.upper()}")
+        print(f"   🔧 Modo: {', '.join(m.upper() for m in modos)}")
+        if formato is not None:
+            print(f"   🗂️  Formato: {formato}")
+        if em_lotes:
+            print(f"   🧩 Lotes: {len(entradas)}")
         print(f"{'='*70}")
 
         return caminho_json_saida
 
 
+# ============================================================================
+# OPERADORES ESTRANGEIROS (CADASTRO E VÍNCULO COM PRODUTOS)
+# ============================================================================
+
+# Cabeçalhos aceitos na planilha de vínculo produto ↔ operador
+ALIASES_VINCULO_CODIGO = ['codigo', 'código', 'code', 'produto', 'cod', 'codigo produto', 'código produto',
+                          'codigo_produto', 'codigoproduto', 'codigo do produto', 'código do produto']
+ALIASES_VINCULO_OPERADOR = ['codigooperadorestrangeiro', 'operador', 'codigo operador', 'código operador',
+                            'operador estrangeiro', 'codigo_operador', 'cod operador', 'cod_operador']
+ALIASES_VINCULO_PAIS = ['codigopais', 'codigo pais', 'código país', 'pais', 'país', 'country', 'codigo_pais']
+
+# Cabeçalhos aceitos na planilha de operadores estrangeiros (campo JSON → aliases)
+MAPA_COLUNAS_OPERADOR = {
+    'nome': ['nome', 'name', 'razao social', 'razão social', 'empresa', 'company'],
+    'logradouro': ['logradouro', 'endereco', 'endereço', 'address', 'rua', 'street'],
+    'numero': ['numero', 'número', 'nro', 'num', 'number', 'no'],
+    'complemento': ['complemento', 'complement', 'comp', 'apto', 'sala'],
+    'codigoPais': ['codigopais', 'codigo pais', 'código país', 'pais', 'país', 'country', 'country code'],
+    'nomeCidade': ['cidade', 'city', 'nomecidade', 'nome cidade', 'municipio', 'município'],
+    'estado': ['estado', 'state', 'uf', 'provincia', 'província', 'province'],
+    'codigoPostal': ['cep', 'codigopostal', 'codigo postal', 'código postal', 'zip', 'zipcode', 'zip code',
+                     'postal code', 'postal'],
+    'telefone': ['telefone', 'phone', 'tel', 'fone', 'telephone'],
+    'email': ['email', 'e-mail', 'mail'],
+    'cpfCnpjRaiz': ['cnpj', 'cpfcnpjraiz', 'cpf cnpj raiz', 'cnpj raiz', 'cpf/cnpj'],
+}
+
+
+def _valor_celula_texto(row, idx) -> str:
+    """Texto da célula `idx` da linha (sem o '.0' de números inteiros lidos como float)."""
+    if idx is not None and idx < len(row) and row[idx] is not None:
+        val = str(row[idx]).strip()
+        if val.endswith('.0'):
+            try:
+                float(val)
+                val = val[:-2]
+            except ValueError:
+                pass
+        return val
+    return ''
+
+
+def _linhas_planilha_simples(caminho_excel: str):
+    """Abre a aba ativa em read_only e retorna (wb, cabecalhos em minúsculas, linhas de dados)."""
+    wb = openpyxl.load_workbook(caminho_excel, read_only=True, data_only=True)
+    ws = wb.active
+    cabecalhos = [str(cell.value).strip().lower() if cell.value else '' for cell in ws[1]]
+    linhas = (
+        (row_num, row)
+        for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2)
+        if row and not all(v is None or str(v).strip() == '' for v in row)
+    )
+    return wb, cabecalhos, linhas
+
+
+def ler_vinculos_operador(caminho_excel: str, cnpj_raiz: str = '', codigo_pais: str = '') -> tuple:
+    """
+    Lê a planilha de vínculo produto ↔ operador estrangeiro (colunas codigo,
+    operador e, opcionalmente, país; o país da planilha tem prioridade sobre
+    `codigo_pais`).
+
+    Returns:
+        (vinculos, avisos)
+
+    Raises:
+        ValueError: se faltar a coluna de código do produto ou de operador
+    """
+    cnpj_raiz = cnpj_raiz.strip().replace('.', '').replace('-', '').replace('/', '')
+    wb, cabecalhos, linhas = _linhas_planilha_simples(caminho_excel)
+    try:
+        idx_codigo = idx_operador = idx_pais = None
+        for i, cab in enumerate(cabecalhos):
+            cab_limpo = cab.replace('_', ' ')
+            if idx_codigo is None and cab_limpo in ALIASES_VINCULO_CODIGO:
+                idx_codigo = i
+            if idx_operador is None and cab_limpo in ALIASES_VINCULO_OPERADOR:
+                idx_operador = i
+            if idx_pais is None and cab_limpo in ALIASES_VINCULO_PAIS:
+                idx_pais = i
+
+        if idx_codigo is None:
+            raise ValueError('Coluna "codigo" (código do produto) não encontrada na planilha. '
+                             'Use nomes como: codigo, código, code, produto')
+        if idx_operador is None:
+            raise ValueError('Coluna "codigoOperadorEstrangeiro" não encontrada. '
+                             'Use nomes como: operador, codigo operador, codigoOperadorEstrangeiro')
+
+        vinculos = []
+        avisos = []
+        for row_num, row in linhas:
+            codigo = _valor_celula_texto(row, idx_codigo)
+            operador = _valor_celula_texto(row, idx_operador)
+            pais_excel = _valor_celula_texto(row, idx_pais)
+
+            if not codigo:
+                avisos.append(f'Linha {row_num}: código do produto vazio, ignorada.')
+                continue
+            if not operador:
+                avisos.append(f'Linha {row_num}: código do operador vazio, ignorada.')
+                continue
+
+            # País: prioridade Excel > parâmetro
+            pais = pais_excel if pais_excel else codigo_pais.strip()
+            if not pais:
+                avisos.append(f'Linha {row_num}: código do país vazio, ignorada.')
+                continue
+
+            try:
+                codigo_int = int(codigo)
+            except ValueError:
+                avisos.append(f'Linha {row_num}: código "{codigo}" não é numérico, ignorada.')
+                continue
+
+            vinculo = {
+                'seq': len(vinculos) + 1,
+                'codigoProduto': codigo_int,
+                'codigoPais': pais,
+                'codigoOperadorEstrangeiro': operador,
+                'conhecido': True,
+                'vincular': True
+            }
+            if cnpj_raiz:
+                vinculo['cpfCnpjRaiz'] = cnpj_raiz
+
+            vinculos.append(vinculo)
+    finally:
+        wb.close()
+
+    return vinculos, avisos
+
+
+def ler_operadores_estrangeiros(caminho_excel: str, cnpj_raiz: str = '') -> tuple:
+    """
+    Lê a planilha de operadores estrangeiros (nome obrigatório; endereço,
+    país, cidade, etc. opcionais). `cnpj_raiz` é usado quando a planilha
+    não tiver a coluna de CNPJ.
+
+    Returns:
+        (operadores, avisos)
+    """
+    cnpj_raiz = cnpj_raiz.strip()
+    wb, cabecalhos, linhas = _linhas_planilha_simples(caminho_excel)
+    try:
+        mapa = {}  # campo_json -> indice_coluna
+        for campo, aliases in MAPA_COLUNAS_OPERADOR.items():
+            for idx, cab in enumerate(cabecalhos):
+                if cab in aliases or cab.replace('_', ' ') in aliases:
+                    mapa[campo] = idx
+                    break
+
+        operadores = []
+        avisos = []
+        for row_num, row in linhas:
+            def get_val(campo):
+                return _valor_celula_texto(row, mapa.get(campo))
+
+            nome = get_val('nome')
+            if not nome:
+                avisos.append(f'Linha {row_num}: sem nome, ignorada.')
+                continue
+
+            operador = {}
+
+            # cpfCnpjRaiz: da planilha ou do parâmetro
+            cpf_cnpj = get_val('cpfCnpjRaiz') or cnpj_raiz
+            if cpf_cnpj:
+                cpf_cnpj = cpf_cnpj.replace('.', '').replace('-', '').replace('/', '').replace(' ', '')
+                operador['cpfCnpjRaiz'] = cpf_cnpj
+
+            operador['nome'] = nome
+
+            # Endereço
+            endereco = {}
+            for campo in ('logradouro', 'numero', 'complemento'):
+                valor = get_val(campo)
+                if valor:
+                    endereco[campo] = valor
+            if endereco:
+                operador['endereco'] = endereco
+
+            # País, cidade, estado, CEP, telefone e e-mail (só se preenchidos)
+            for campo in ('codigoPais', 'nomeCidade', 'estado', 'codigoPostal', 'telefone', 'email'):
+                valor = get_val(campo)
+                if valor:
+                    operador[campo] = valor
+
+            operadores.append(operador)
+    finally:
+        wb.close()
+
+    return operadores, avisos
+
+
+# ============================================================================
+# LEITURA DE ABA EM PROCESSO SEPARADO
+# ============================================================================
+
+def _ler_aba_isolada(caminho_excel: str, aba: str, defaults: dict, auto_truncar: bool,
+                     atributos_por_ncm: dict = None, injecao: PlanoInjecao = None,
+                     opcional: bool = False, cancelamento: TokenCancelamento = None) -> tuple:
+    """
+    Lê uma aba com um conversor próprio (função de módulo, para rodar num
+    processo do ProcessPoolExecutor). Retorna (produtos, erros, avisos).
+    """
+    conversor = ConversorCatalogoSiscomex(auto_truncar=auto_truncar, injecao=injecao,
+                                          cancelamento=cancelamento)
+    wb = conversor._abrir_planilha(caminho_excel, read_only=True)
+    if wb is None:
+        return [], conversor.erros, conversor.avisos
+    print(f"\n📄 Aba: {aba}")
+    try:
+        produtos = conversor._ler_aba(wb[aba], defaults, atributos_por_ncm, opcional)
+    finally:
+        wb.close()
+    return produtos, conversor.erros, conversor.avisos
+
+
+# ============================================================================
+# CONVERSÃO EM LOTE (VÁRIAS PLANILHAS EM PARALELO)
+# ============================================================================
+
+EXTENSOES_PLANILHA = (".xlsx",)
+TRABALHADORES_LOTE_PADRAO = 4
+
+# Catálogo de atributos por NCM do processo trabalhador (carregado uma vez
+# pelo initializer do pool e reaproveitado em todos os arquivos)
+_CATALOGO_TRABALHADOR = None
+
+
+def _iniciar_trabalhador_lote(atributos_por_ncm: dict):
+    """Initializer do pool: guarda o catálogo de NCM no processo trabalhador."""
+    global _CATALOGO_TRABALHADOR
+    _CATALOGO_TRABALHADOR = atributos_por_ncm
+
+
+def caminho_livre(caminho: str, reservados=()) -> str:
+    """`caminho`, ou <base>_2.<ext>, <base>_3.<ext>... se já existir ou estiver reservado."""
+    base, ext = os.path.splitext(caminho)
+    livre = caminho
+    n = 1
+    while os.path.exists(livre) or livre in reservados:
+        n += 1
+        livre = f"{base}_{n}{ext}"
+    return livre
+
+
+class LimiteZipExcedido(Exception):
+    """Zip com planilhas demais ou grandes demais depois de descompactadas."""
+
+
+def extrair_planilhas_zip(caminho_zip: str, pasta_destino: str, max_bytes: int = None,
+                          max_arquivos: int = None) -> list:
+    """
+    Extrai as planilhas .xlsx de um .zip para `pasta_destino` (só o nome do
+    arquivo, sem subpastas do zip; ignora __MACOSX e arquivos ocultos).
+
+    `max_bytes` limita o total descompactado e `max_arquivos` o número de
+    planilhas (proteção contra zip bomb): o tamanho declarado de cada entrada
+    é conferido antes de abri-la e os bytes realmente gravados durante a
+    extração. Acima de um limite levanta LimiteZipExcedido (as planilhas já
+    extraídas ficam em `pasta_destino`).
+
+    Returns:
+        Caminhos das planilhas extraídas, na ordem do zip
+    """
+    extraidas = []
+    total = 0
+
+    def excedeu():
+        return LimiteZipExcedido(
+            f"Conteúdo descompactado do .zip excede o limite de {max_bytes // (1024 * 1024)} MB.")
+
+    with zipfile.ZipFile(caminho_zip) as zf:
+        for info in zf.infolist():
+            nome = os.path.basename(info.filename)
+            if (info.is_dir() or not nome or nome.startswith(('.', '~$'))
+                    or '__MACOSX' in info.filename
+                    or not nome.lower().endswith(EXTENSOES_PLANILHA)):
+                continue
+            if max_arquivos is not None and len(extraidas) >= max_arquivos:
+                raise LimiteZipExcedido(f"O .zip tem mais de {max_arquivos} planilhas.")
+            if max_bytes is not None and total + info.file_size > max_bytes:
+                raise excedeu()
+            destino = caminho_livre(os.path.join(pasta_destino, nome), extraidas)
+            extraidas.append(destino)
+            with zf.open(info) as origem, open(destino, 'wb') as saida:
+                while True:
+                    bloco = origem.read(1024 * 1024)
+                    if not bloco:
+                        break
+                    # O tamanho declarado no zip pode mentir: conta o que sai de fato
+                    total += len(bloco)
+                    if max_bytes is not None and total > max_bytes:
+                        raise excedeu()
+                    saida.write(bloco)
+    return extraidas
+
+
+def _executar_tarefa(funcao, silencioso: bool, argumentos: tuple):
+    """
+    Executa funcao(*argumentos) num processo do pool. `silencioso` manda as
+    mensagens de progresso para o stderr (stdout fica livre para o resumo).
+    """
+    if silencioso:
+        with contextlib.redirect_stdout(sys.stderr):
+            return funcao(*argumentos)
+    return funcao(*argumentos)
+
+
+def executar_em_pool(funcao, lista_argumentos: list, trabalhadores: int = None,
+                     atributos_por_ncm: dict = None, silencioso: bool = False) -> list:
+    """
+    Executa `funcao` (de módulo) para cada tupla de `lista_argumentos` num
+    pool limitado de processos, devolvendo os resultados na mesma ordem.
+
+    O catálogo `atributos_por_ncm` é enviado uma única vez a cada processo
+    (initializer do pool) e fica em _CATALOGO_TRABALHADOR. Com um único
+    trabalhador, roda no próprio processo.
+    """
+    if not lista_argumentos:
+        return []
+    trabalhadores = trabalhadores or min(TRABALHADORES_LOTE_PADRAO, os.cpu_count() or 1)
+    trabalhadores = max(1, min(trabalhadores, len(lista_argumentos)))
+
+    if trabalhadores == 1:
+        anterior = _CATALOGO_TRABALHADOR
+        _iniciar_trabalhador_lote(atributos_por_ncm)
+        try:
+            return [_executar_tarefa(funcao, silencioso, args) for args in lista_argumentos]
+        finally:
+            _iniciar_trabalhador_lote(anterior)
+
+    with ProcessPoolExecutor(max_workers=trabalhadores,
+                             initializer=_iniciar_trabalhador_lote,
+                             initargs=(atributos_por_ncm,)) as executor:
+        total = len(lista_argumentos)
+        return list(executor.map(_executar_tarefa, [funcao] * total,
+                                 [silencioso] * total, lista_argumentos))
+
+
+def _converter_arquivo_lote(caminho_excel: str, caminho_saida: str, modo: str,
+                            formato: str, defaults: dict, auto_truncar: bool,
+                            injecao: PlanoInjecao = None) -> dict:
+    """
+    Converte uma planilha do lote (roda num processo do pool). Nunca lança:
+    falhas viram status 'erro' no resultado do arquivo.
+    """
+    resultado = {
+        'arquivo': os.path.basename(caminho_excel),
+        'status': 'erro',
+        'produtos': 0,
+        'saida': None,
+        'erros': [],
+        'avisos': [],
+    }
+    inicio = time.perf_counter()
+    try:
+        conversor = ConversorCatalogoSiscomex(auto_truncar=auto_truncar, injecao=injecao)
+        produtos = conversor.ler_planilha(caminho_excel, defaults=defaults,
+                                          atributos_por_ncm=_CATALOGO_TRABALHADOR)
+        if not conversor.erros and not produtos:
+            conversor.erros.append("Nenhum produto encontrado na planilha.")
+        if not conversor.erros:
+            gravar_saida(conversor.gerar_json(modo, produtos), caminho_saida, formato)
+            resultado.update(status='ok', produtos=len(produtos),
+                             saida=os.path.basename(caminho_saida))
+        resultado['erros'] = conversor.erros
+        resultado['avisos'] = conversor.avisos
+    except Exception as e:
+        resultado['erros'] = [f"Erro ao converter: {e}"]
+    resultado['tempo_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+    return resultado
+
+
+def converter_lote(arquivos: list, pasta_saida: str = None, modo: str = "post",
+                   formato: str = "pretty", defaults: dict = None,
+                   auto_truncar: bool = False, atributos_por_ncm: dict = None,
+                   trabalhadores: int = None, silencioso: bool = False,
+                   injecao: PlanoInjecao = None) -> list:
+    """
+    Converte várias planilhas em paralelo num pool limitado de processos
+    (ver executar_em_pool). A saída de cada planilha vai para `pasta_saida`
+    (ou, se None, para a pasta da própria planilha) como
+    <nome>_CATALOGO<SUFIXO>.<ext>.
+
+    Args:
+        arquivos: Caminhos das planilhas .xlsx
+        trabalhadores: Tamanho do pool (padrão: min(4, CPUs, nº de arquivos))
+        injecao: Atributos padrão para células vazias (PlanoInjecao)
+
+    Returns:
+        Um dict por arquivo, na ordem de `arquivos`:
+        {arquivo, status ('ok'/'erro'), produtos, saida, erros, avisos, tempo_ms}
+    """
+    if modo not in MODOS_SAIDA:
+        raise ValueError(f"Modo '{modo}' inválido. Use: {', '.join(MODOS_SAIDA)}")
+    if formato not in FORMATOS_SAIDA:
+        raise ValueError(f"Formato '{formato}' inválido. Use: {', '.join(FORMATOS_SAIDA)}")
+    if not arquivos:
+        return []
+
+    if pasta_saida:
+        os.makedirs(pasta_saida, exist_ok=True)
+    defaults = defaults or {}
+    saidas = []
+    for caminho in arquivos:
+        pasta = pasta_saida or os.path.dirname(os.path.abspath(caminho))
+        base = os.path.splitext(os.path.basename(caminho))[0]
+        sufixo = f"_CATALOGO{SUFIXOS_MODO[modo]}{EXTENSOES_FORMATO[formato]}"
+        saida = os.path.join(pasta, base + sufixo)
+        n = 1
+        while saida in saidas:  # Mesmo nome em pastas diferentes: não sobrescrever
+            n += 1
+            saida = os.path.join(pasta, f"{base}_{n}{sufixo}")
+        saidas.append(saida)
+
+    argumentos = [(caminho, saida, modo, formato, defaults, auto_truncar, injecao or None)
+                  for caminho, saida in zip(arquivos, saidas)]
+    return executar_em_pool(_converter_arquivo_lote, argumentos, trabalhadores,
+                            atributos_por_ncm, silencioso)
+
+
+def _validar_arquivo_lote(caminho_excel: str, defaults: dict, max_erros: int,
+                          rapida: bool, injecao: PlanoInjecao = None) -> dict:
+    """Valida uma planilha do lote (roda num processo do pool). Nunca lança."""
+    resultado = {
+        'arquivo': os.path.basename(caminho_excel),
+        'status': 'erro',
+        'erros': [],
+        'avisos': [],
+    }
+    inicio = time.perf_counter()
+    try:
+        conversor = ConversorCatalogoSiscomex(injecao=injecao)
+        if rapida:
+            resumo = conversor.verificar_amostra(caminho_excel, defaults=defaults,
+                                                 atributos_por_ncm=_CATALOGO_TRABALHADOR)
+        else:
+            resumo = conversor.validar_planilha(caminho_excel, defaults=defaults, max_erros=max_erros,
+                                                atributos_por_ncm=_CATALOGO_TRABALHADOR)
+        resumo.pop('tempo_ms', None)
+        resultado.update(resumo)
+        if resumo.get('inconclusivo') and not conversor.erros:
+            conversor.erros.append(MENSAGEM_AMOSTRA_VAZIA)
+        resultado['status'] = 'erro' if conversor.erros else 'ok'
+        resultado['erros'] = conversor.erros
+        resultado['avisos'] = conversor.avisos
+    except Exception as e:
+        resultado['erros'] = [f"Erro ao validar: {e}"]
+    resultado['tempo_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+    return resultado
+
+
+def validar_lote(arquivos: list, defaults: dict = None, max_erros: int = None,
+                 rapida: bool = False, atributos_por_ncm: dict = None,
+                 trabalhadores: int = None, silencioso: bool = False,
+                 injecao: PlanoInjecao = None) -> list:
+    """
+    Valida várias planilhas em paralelo (validar_planilha, ou verificar_amostra
+    se `rapida`). Retorna um dict por arquivo com status, erros, avisos e o
+    resumo da validação.
+    """
+    argumentos = [(caminho, defaults or {}, max_erros, rapida, injecao or None) for caminho in arquivos]
+    return executar_em_pool(_validar_arquivo_lote, argumentos, trabalhadores,
+                            atributos_por_ncm, silencioso)
+
+
+def _operadores_arquivo_lote(caminho_excel: str, caminho_saida: str, vincular: bool,
+                             cnpj_raiz: str, codigo_pais: str) -> dict:
+    """Converte uma planilha de operadores (ou de vínculos) para JSON. Nunca lança."""
+    resultado = {
+        'arquivo': os.path.basename(caminho_excel),
+        'status': 'erro',
+        'total': 0,
+        'saida': None,
+        'erros': [],
+        'avisos': [],
+    }
+    try:
+        if vincular:
+            itens, avisos = ler_vinculos_operador(caminho_excel, cnpj_raiz, codigo_pais)
+        else:
+            itens, avisos = ler_operadores_estrangeiros(caminho_excel, cnpj_raiz)
+        resultado['avisos'] = avisos
+        if itens:
+            gravar_json(itens, caminho_saida)
+            resultado.update(status='ok', total=len(itens), saida=os.path.basename(caminho_saida))
+        else:
+            resultado['erros'] = ["Nenhum registro encontrado na planilha."]
+    except ValueError as e:
+        resultado['erros'] = [str(e)]
+    except Exception as e:
+        resultado['erros'] = [f"Erro ao converter: {e}"]
+    return resultado
+
+
+def gravar_relatorio_lote_zip(resultados: list, pasta_saida: str, caminho_zip: str):
+    """
+    Junta num .zip as saídas dos arquivos convertidos com sucesso e um
+    RELATORIO_LOTE.json com o status de cada arquivo.
+    """
+    with zipfile.ZipFile(caminho_zip, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for resultado in resultados:
+            if resultado.get('saida'):
+                zf.write(os.path.join(pasta_saida, resultado['saida']), resultado['saida'])
+        zf.writestr("RELATORIO_LOTE.json", serializar_json(resultados))
+
+
+# ============================================================================
+# VIGILÂNCIA DE PASTA (CONVERSÃO CONTÍNUA E INCREMENTAL)
+# ============================================================================
+
+ARQUIVO_ESTADO_VIGILANCIA = ".conversor_siscomex_estado.json"
+SUFIXO_DIAGNOSTICO = "_DIAGNOSTICO.json"
+VIGILANCIA_INTERVALO_S = 2.0       # Intervalo entre varreduras da pasta
+VIGILANCIA_ESTABILIDADE_S = 3.0    # Arquivo sem alterações há N s = gravação concluída
+
+
+def hash_arquivo(caminho: str) -> str:
+    """SHA-256 do conteúdo do arquivo (lido em blocos de 1 MB)."""
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def _ler_estado_vigilancia(pasta: str) -> dict:
+    """Estado salvo da pasta vigiada: { nome_planilha: {hash, assinatura, opcoes, ...} }."""
+    try:
+        with open(os.path.join(pasta, ARQUIVO_ESTADO_VIGILANCIA), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _gravar_estado_vigilancia(pasta: str, estado: dict):
+    """Grava o estado de forma atômica (arquivo temporário + os.replace)."""
+    caminho = os.path.join(pasta, ARQUIVO_ESTADO_VIGILANCIA)
+    gravar_json(estado, caminho + ".tmp")
+    os.replace(caminho + ".tmp", caminho)
+
+
+def varrer_pasta_vigiada(pasta: str, estado: dict, modo: str = "post", formato: str = "pretty",
+                         defaults: dict = None, auto_truncar: bool = False,
+                         atributos_por_ncm: dict = None, trabalhadores: int = None,
+                         estabilidade_s: float = VIGILANCIA_ESTABILIDADE_S,
+                         silencioso: bool = False, injecao: PlanoInjecao = None) -> list:
+    """
+    Uma varredura da pasta vigiada: converte as planilhas novas ou alteradas
+    e grava ao lado de cada uma a saída JSON e <nome>_DIAGNOSTICO.json.
+
+    - Planilhas modificadas há menos de `estabilidade_s` segundos ficam para a
+      próxima varredura (cópias/gravações ainda em andamento).
+    - Planilhas com o mesmo conteúdo (SHA-256) e as mesmas opções de uma
+      conversão anterior são ignoradas; tamanho + mtime iguais evitam até
+      recalcular o hash.
+
+    `estado` é atualizado no lugar. Returns: resultados das planilhas convertidas.
+    """
+    opcoes = {'modo': modo, 'formato': formato, 'defaults': defaults or {}, 'auto_truncar': auto_truncar}
+    if injecao:
+        opcoes['atributos_padrao'] = injecao.padroes
+    agora = time.time()
+    prontos = []
+    hashes = {}
+    presentes = set()
+    for caminho in expandir_entradas([pasta]):
+        nome = os.path.basename(caminho)
+        presentes.add(nome)
+        try:
+            st = os.stat(caminho)
+        except OSError:
+            continue  # Removido durante a varredura
+        if agora - st.st_mtime < estabilidade_s:
+            continue  # Ainda sendo gravado (debounce)
+
+        assinatura = [st.st_size, st.st_mtime_ns]
+        anterior = estado.get(nome)
+        if anterior and anterior.get('opcoes') == opcoes and anterior.get('assinatura') == assinatura:
+            continue
+        try:
+            conteudo_hash = hash_arquivo(caminho)
+        except OSError:
+            continue
+        if anterior and anterior.get('opcoes') == opcoes and anterior.get('hash') == conteudo_hash:
+            anterior['assinatura'] = assinatura  # Só o mtime mudou (ex.: cópia idêntica)
+            continue
+        hashes[caminho] = (conteudo_hash, assinatura)
+        prontos.append(caminho)
+
+    # Planilhas removidas da pasta saem do estado
+    for nome in [n for n in estado if n not in presentes]:
+        del estado[nome]
+
+    if not prontos:
+        return []
+
+    resultados = converter_lote(prontos, None, modo, formato, defaults=defaults,
+                                auto_truncar=auto_truncar, atributos_por_ncm=atributos_por_ncm,
+                                trabalhadores=trabalhadores, silencioso=silencioso, injecao=injecao)
+
+    momento = datetime.now().isoformat(timespec="seconds")
+    for caminho, resultado in zip(prontos, resultados):
+        conteudo_hash, assinatura = hashes[caminho]
+        base = os.path.splitext(caminho)[0]
+        anterior = estado.get(os.path.basename(caminho)) or {}
+        if anterior.get('saida') and anterior['saida'] != resultado['saida']:
+            # Saída da versão anterior não corresponde mais à planilha
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(os.path.dirname(caminho), anterior['saida']))
+        gravar_json(dict(resultado, hash=conteudo_hash, convertido_em=momento, **opcoes),
+                    base + SUFIXO_DIAGNOSTICO)
+        estado[os.path.basename(caminho)] = {
+            'hash': conteudo_hash,
+            'assinatura': assinatura,
+            'opcoes': opcoes,
+            'status': resultado['status'],
+            'saida': resultado['saida'],
+            'convertido_em': momento,
+        }
+    return resultados
+
+
+def vigiar_pasta(pasta: str, modo: str = "post", formato: str = "pretty",
+                 intervalo_s: float = VIGILANCIA_INTERVALO_S, uma_vez: bool = False,
+                 ao_converter=None, **opcoes):
+    """
+    Vigia `pasta` por polling (portável; sem dependências), convertendo as
+    planilhas novas ou alteradas a cada `intervalo_s` segundos, até Ctrl+C.
+    O estado (hash por planilha) fica em ARQUIVO_ESTADO_VIGILANCIA na própria
+    pasta, então reiniciar o serviço não reconverte o que já foi feito.
+
+    Args:
+        uma_vez: Faz uma única varredura e retorna (útil em cron)
+        ao_converter: Chamado com a lista de resultados de cada varredura
+        **opcoes: Repassadas a varrer_pasta_vigiada (defaults, auto_truncar, ...)
+    """
+    estado = _ler_estado_vigilancia(pasta)
+    gravado = serializar_json(estado)
+    try:
+        while True:
+            resultados = varrer_pasta_vigiada(pasta, estado, modo, formato, **opcoes)
+            atual = serializar_json(estado)
+            if atual != gravado:
+                _gravar_estado_vigilancia(pasta, estado)
+                gravado = atual
+            if resultados and ao_converter:
+                ao_converter(resultados)
+            if uma_vez:
+                return
+            time.sleep(intervalo_s)
+    except KeyboardInterrupt:
+        _gravar_estado_vigilancia(pasta, estado)
+
+
 # ============================================================================
 # INTERFACE DE LINHA DE COMANDO (CLI)
 # ============================================================================
@@ -1323,8 +3252,296 @@ def solicitar_caminho(mensagem: str, extensao: str = None, deve_existir: bool =
         return caminho
 
 
+# Subcomandos não interativos e códigos de saída
+SUBCOMANDOS_CLI = ("convert", "validate", "template", "json2xlsx", "operators", "watch")
+SAIDA_OK = 0        # Todos os arquivos processados sem erro
+SAIDA_FALHA = 1     # Algum arquivo com erro (conversão/validação)
+SAIDA_USO = 2       # Argumentos inválidos ou nenhum arquivo de entrada
+
+
+def expandir_entradas(entradas: list, extensoes: tuple = EXTENSOES_PLANILHA) -> list:
+    """
+    Expande arquivos, pastas (arquivos com as `extensoes`, sem subpastas) e
+    padrões glob ('**' recursivo) numa lista ordenada e sem repetições.
+    Arquivos temporários do Excel (~$...) e ocultos são ignorados.
+    """
+    import glob
+
+    encontrados = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            candidatos = [os.path.join(entrada, nome) for nome in sorted(os.listdir(entrada))]
+        elif glob.has_magic(entrada):
+            candidatos = sorted(glob.glob(entrada, recursive=True))
+        else:
+            candidatos = [entrada]
+        for caminho in candidatos:
+            nome = os.path.basename(caminho)
+            if nome.startswith(('.', '~$')) or not nome.lower().endswith(extensoes):
+                continue
+            if os.path.isfile(caminho) and caminho not in encontrados:
+                encontrados.append(caminho)
+    return encontrados
+
+
+def _adicionar_opcoes_padrao(parser):
+    """Atributos padrão para células vazias (mesmos campos do site): --pais-origem, --embalagem, ..."""
+    for opcao in OPCOES_PADRAO:
+        codigo = ATRIBUTOS_PADRAO.get(opcao) or ATRIBUTOS_PADRAO_MULTI.get(opcao)
+        descricao = f"{codigo} ({ATRIBUTOS_LABELS.get(codigo, codigo)})" if codigo else "codigoOperadorEstrangeiro"
+        parser.add_argument(f"--{opcao.replace('_', '-')}", dest=opcao,
+                            help=f"Valor padrão de {descricao} para células vazias")
+
+
+def _criar_parser_subcomandos():
+    """Parser dos subcomandos não interativos (convert, validate, ...)."""
+    import argparse
+
+    comum = argparse.ArgumentParser(add_help=False)
+    comum.add_argument("--json", action="store_true",
+                       help="Imprimir no stdout um resumo JSON (mensagens de progresso vão para o stderr)")
+
+    paralelo = argparse.ArgumentParser(add_help=False)
+    paralelo.add_argument("entradas", nargs="+", help="Arquivos, pastas ou padrões glob (ex.: 'in/**/*.xlsx')")
+    paralelo.add_argument("-j", "--jobs", type=int,
+                          help=f"Processos simultâneos (padrão: até {TRABALHADORES_LOTE_PADRAO})")
+    paralelo.add_argument("--catalogo-ncm", help="JSON oficial de atributos por NCM")
+    paralelo.add_argument("--cnpj", help="cpfCnpjRaiz padrão para planilhas sem a coluna")
+    paralelo.add_argument("--modalidade", help="Modalidade padrão para planilhas sem a coluna")
+
+    padroes = argparse.ArgumentParser(add_help=False)
+    _adicionar_opcoes_padrao(padroes)
+
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else "conversor",
+        description="Conversor Excel → JSON para API CATP Siscomex (modo não interativo)",
+        epilog=f"Códigos de saída: {SAIDA_OK} = sucesso, {SAIDA_FALHA} = algum arquivo com erro, "
+               f"{SAIDA_USO} = uso inválido ou nenhum arquivo encontrado.",
+    )
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("convert", parents=[comum, paralelo, padroes], help="Converter planilhas em JSON")
+    p.add_argument("-m", "--modo", choices=MODOS_SAIDA, default="api_post", help="Modo de geração")
+    p.add_argument("-f", "--formato", choices=FORMATOS_SAIDA, default="pretty", help="Formato do arquivo")
+    p.add_argument("-o", "--output", help="Pasta de saída (padrão: pasta de cada planilha)")
+    p.add_argument("--auto-truncar", action="store_true", help="Truncar campos acima do limite")
+
+    p = sub.add_parser("validate", parents=[comum, paralelo, padroes], help="Validar planilhas sem gerar JSON")
+    p.add_argument("--max-erros", type=int, help="Parar cada planilha após N erros")
+    p.add_argument("--rapida", action="store_true", help="Validar só uma amostra das linhas")
+
+    p = sub.add_parser("template", parents=[comum], help="Gerar planilha modelo")
+    p.add_argument("saida", nargs="?", default="MODELO_catalogo_produtos.xlsx", help="Arquivo .xlsx de saída")
+    p.add_argument("--atributos", help="Atributos extras (ATT_...), separados por vírgula")
+    p.add_argument("--ncm", help="NCMs separados por vírgula: colunas = atributos válidos para eles "
+                                 "(requer --catalogo-ncm)")
+    p.add_argument("--catalogo-ncm", help="JSON oficial de atributos por NCM")
+
+    p = sub.add_parser("json2xlsx", parents=[comum], help="Converter JSON do portal em planilha")
+    p.add_argument("json_entrada", help="JSON exportado do portal")
+    p.add_argument("saida", nargs="?", help="Arquivo .xlsx de saída (padrão: mesmo nome)")
+
+    p = sub.add_parser("operators", parents=[comum, paralelo], help="Planilhas de operadores estrangeiros → JSON")
+    p.add_argument("--vincular", action="store_true",
+                   help="Planilhas de vínculo produto ↔ operador (codigo, operador, país)")
+    p.add_argument("--pais", default="", help="Código do país padrão (com --vincular)")
+    p.add_argument("-o", "--output", help="Pasta de saída (padrão: pasta de cada planilha)")
+
+    p = sub.add_parser("watch", parents=[comum, padroes],
+                       help="Vigiar uma pasta e converter planilhas novas/alteradas")
+    p.add_argument("pasta", help="Pasta vigiada (saídas e diagnósticos são gravados nela)")
+    p.add_argument("-m", "--modo", choices=MODOS_SAIDA, default="api_post", help="Modo de geração")
+    p.add_argument("-f", "--formato", choices=FORMATOS_SAIDA, default="pretty", help="Formato do arquivo")
+    p.add_argument("-j", "--jobs", type=int, help="Processos simultâneos por varredura")
+    p.add_argument("--catalogo-ncm", help="JSON oficial de atributos por NCM")
+    p.add_argument("--cnpj", help="cpfCnpjRaiz padrão para planilhas sem a coluna")
+    p.add_argument("--modalidade", help="Modalidade padrão para planilhas sem a coluna")
+    p.add_argument("--auto-truncar", action="store_true", help="Truncar campos acima do limite")
+    p.add_argument("--intervalo", type=float, default=VIGILANCIA_INTERVALO_S,
+                   help=f"Segundos entre varreduras (padrão: {VIGILANCIA_INTERVALO_S})")
+    p.add_argument("--estabilidade", type=float, default=VIGILANCIA_ESTABILIDADE_S,
+                   help="Segundos sem alteração para considerar a gravação concluída "
+                        f"(padrão: {VIGILANCIA_ESTABILIDADE_S})")
+    p.add_argument("--uma-vez", action="store_true", help="Fazer uma única varredura e sair")
+    return parser
+
+
+def _imprimir_resultados(comando: str, resultados: list):
+    """Resumo legível por arquivo (modo sem --json), no stdout."""
+    print(f"\n{'='*70}")
+    for r in resultados:
+        if r['status'] == 'ok':
+            detalhe = r.get('saida') or f"{r.get('linhas_validas', r.get('amostra', 0))} linha(s) válida(s)"
+            print(f"✅ {r['arquivo']}: {detalhe}")
+        else:
+            print(f"❌ {r['arquivo']}: {len(r['erros'])} erro(s)")
+            for erro in r['erros'][:5]:
+                print(f"   ⛔ {erro}")
+    falhas = sum(1 for r in resultados if r['status'] != 'ok')
+    print(f"{'='*70}")
+    print(f"📦 {comando}: {len(resultados) - falhas} de {len(resultados)} arquivo(s) sem erro")
+
+
+def _executar_vigilancia_cli(args, defaults: dict, injecao: PlanoInjecao, stdout) -> int:
+    """Subcomando watch: varre a pasta até Ctrl+C (ou uma vez, com --uma-vez)."""
+    if not os.path.isdir(args.pasta):
+        print(f"⚠️  Pasta não encontrada: {args.pasta}", file=sys.stderr)
+        return SAIDA_USO
+    catalogo = carregar_catalogo_ncm(args.catalogo_ncm) if args.catalogo_ncm else None
+    falhas = []
+
+    def ao_converter(resultados):
+        falhas.extend(r for r in resultados if r['status'] != 'ok')
+        if args.json:
+            # Uma linha JSON por varredura com conversões (NDJSON)
+            stdout.write(serializar_json({'comando': 'watch', 'arquivos': resultados}, 0) + "\n")
+            stdout.flush()
+        else:
+            _imprimir_resultados("watch", resultados)
+
+    print(f"👀 Vigiando {os.path.abspath(args.pasta)} (Ctrl+C para sair)")
+    vigiar_pasta(
+        args.pasta, args.modo, args.formato, intervalo_s=args.intervalo,
+        uma_vez=args.uma_vez, ao_converter=ao_converter, defaults=defaults,
+        auto_truncar=args.auto_truncar, atributos_por_ncm=catalogo,
+        trabalhadores=args.jobs, estabilidade_s=args.estabilidade, silencioso=args.json,
+        injecao=injecao,
+    )
+    return SAIDA_FALHA if args.uma_vez and falhas else SAIDA_OK
+
+
+def _main_subcomandos(argv: list) -> int:
+    """Executa um subcomando não interativo e retorna o código de saída."""
+    args = _criar_parser_subcomandos().parse_args(argv)
+    stdout = sys.stdout
+    inicio = time.perf_counter()
+
+    # Com --json, o stdout recebe só o resumo
+    with contextlib.redirect_stdout(sys.stderr if args.json else stdout):
+        defaults = {}
+        if getattr(args, "cnpj", None):
+            defaults["cpfCnpjRaiz"] = args.cnpj
+        if getattr(args, "modalidade", None):
+            defaults["modalidade"] = args.modalidade
+        injecao = PlanoInjecao({opcao: getattr(args, opcao, None) for opcao in OPCOES_PADRAO}) or None
+
+        if args.comando == "watch":
+            return _executar_vigilancia_cli(args, defaults, injecao, stdout)
+
+        if args.comando in ("convert", "validate", "operators"):
+            arquivos = expandir_entradas(args.entradas)
+            if not arquivos:
+                print(f"⚠️  Nenhuma planilha .xlsx encontrada em: {' '.join(args.entradas)}", file=sys.stderr)
+                return SAIDA_USO
+            catalogo = carregar_catalogo_ncm(args.catalogo_ncm) if args.catalogo_ncm else None
+
+        if args.comando == "convert":
+            resultados = converter_lote(
+                arquivos, args.output, args.modo, args.formato, defaults=defaults,
+                auto_truncar=args.auto_truncar, atributos_por_ncm=catalogo,
+                trabalhadores=args.jobs, silencioso=args.json, injecao=injecao,
+            )
+        elif args.comando == "validate":
+            resultados = validar_lote(
+                arquivos, defaults=defaults, max_erros=args.max_erros, rapida=args.rapida,
+                atributos_por_ncm=catalogo, trabalhadores=args.jobs, silencioso=args.json,
+                injecao=injecao,
+            )
+        elif args.comando == "operators":
+            sufixo = "_VINCULAR_OPERADOR.json" if args.vincular else "_OPERADORES_ESTRANGEIROS.json"
+            if args.output:
+                os.makedirs(args.output, exist_ok=True)
+            argumentos = [
+                (caminho,
+                 os.path.join(args.output or os.path.dirname(os.path.abspath(caminho)),
+                              os.path.splitext(os.path.basename(caminho))[0] + sufixo),
+                 args.vincular, args.cnpj or "", args.pais)
+                for caminho in arquivos
+            ]
+            resultados = executar_em_pool(_operadores_arquivo_lote, argumentos, args.jobs,
+                                          silencioso=args.json)
+        else:
+            conversor = ConversorCatalogoSiscomex()
+            resultado = {'arquivo': None, 'status': 'ok', 'saida': None, 'erros': [], 'avisos': []}
+            try:
+                if args.comando == "template":
+                    extras = [a.strip() for a in args.atributos.split(",") if a.strip()] if args.atributos else None
+                    multi = obrigatorios = None
+                    if args.ncm:
+                        if not args.catalogo_ncm:
+                            print("⚠️  --ncm requer --catalogo-ncm", file=sys.stderr)
+                            return SAIDA_USO
+                        ncms = [n.strip().replace('.', '') for n in args.ncm.split(",") if n.strip()]
+                        colunas = atributos_modelo_ncm(ncms, carregar_catalogo_ncm(args.catalogo_ncm))
+                        if colunas['desconhecidos']:
+                            raise ValueError(f"NCM não encontrado no catálogo: {', '.join(colunas['desconhecidos'])}")
+                        extras, multi, obrigatorios = colunas['simples'], colunas['multi'], colunas['obrigatorios']
+                    resultado['arquivo'] = os.path.basename(args.saida)
+                    conversor.gerar_planilha_modelo(args.saida, extras, multi, obrigatorios)
+                    resultado['saida'] = os.path.basename(args.saida)
+                else:
+                    saida = args.saida or os.path.splitext(args.json_entrada)[0] + ".xlsx"
+                    resultado['arquivo'] = os.path.basename(args.json_entrada)
+                    conversor.json_para_planilha(args.json_entrada, saida)
+                    resultado['saida'] = os.path.basename(saida)
+            except Exception as e:
+                resultado.update(status='erro', saida=None, erros=[str(e)])
+            resultados = [resultado]
+
+        if not args.json:
+            _imprimir_resultados(args.comando, resultados)
+
+    falhas = sum(1 for r in resultados if r['status'] != 'ok')
+    if args.json:
+        resumo = {
+            'comando': args.comando,
+            'total': len(resultados),
+            'ok': len(resultados) - falhas,
+            'falhas': falhas,
+            'tempo_ms': round((time.perf_counter() - inicio) * 1000, 1),
+            'arquivos': resultados,
+        }
+        stdout.write(serializar_json(resumo) + "\n")
+    return SAIDA_FALHA if falhas else SAIDA_OK
+
+
+def _executar_lote_cli(args) -> int:
+    """
+    Modo legado --lote: atalho para o subcomando convert (mesma listagem de
+    arquivos, atributos padrão, resumo, --json e códigos de saída). Um .zip
+    é extraído numa pasta temporária e as saídas vão para
+    <nome do zip>_CATALOGO.
+    """
+    import tempfile
+
+    formato = args.formato or ("compact" if args.compacto else "pretty")
+    argv = ["convert", "-m", args.modo, "-f", formato]
+    if args.trabalhadores:
+        argv += ["-j", str(args.trabalhadores)]
+    if args.catalogo_ncm:
+        argv += ["--catalogo-ncm", args.catalogo_ncm]
+    if args.json:
+        argv.append("--json")
+    for opcao in OPCOES_PADRAO:
+        if getattr(args, opcao):
+            argv += [f"--{opcao.replace('_', '-')}", getattr(args, opcao)]
+
+    with tempfile.TemporaryDirectory() as temporario:
+        entrada, saida = args.arquivo, args.output
+        if not os.path.isdir(entrada) and entrada.lower().endswith(".zip"):
+            extrair_planilhas_zip(entrada, temporario)
+            entrada, saida = temporario, saida or os.path.splitext(entrada)[0] + "_CATALOGO"
+        if saida:
+            argv += ["-o", saida]
+        return _main_subcomandos(argv + ["--", entrada])
+
+
 def main():
     """Função principal - modo interativo."""
+    # Subcomandos não interativos (convert, validate, template, json2xlsx, operators)
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMANDOS_CLI:
+        sys.exit(_main_subcomandos(sys.argv[1:]))
+
     conversor = ConversorCatalogoSiscomex()
 
     # Se argumentos de linha de comando foram passados
@@ -1337,9 +3554,14 @@ def main():
         parser.add_argument("arquivo", help="Caminho do arquivo Excel (.xlsx)")
         parser.add_argument(
             "-m", "--modo",
-            choices=["post", "put", "api_post", "api_put", "completo"],
+            choices=MODOS_SAIDA + ["multi"],
             default="api_post",
-            help="Modo de geração: api_post (padrão), api_put, post (lote), put (lote) ou completo"
+            help="Modo de geração: api_post (padrão), api_put, post (lote), put (lote), completo "
+                 "ou multi (vários formatos num .zip)"
+        )
+        parser.add_argument(
+            "--modos",
+            help="Formatos do modo multi, separados por vírgula (padrão: todos)"
         )
         parser.add_argument(
             "-o", "--output",
@@ -1357,18 +3579,77 @@ def main():
         parser.add_argument(
             "--compacto",
             action="store_true",
-            help="Gerar JSON compacto (sem indentação)"
+            help="Gerar JSON compacto (sem espaços; mesmo que --formato compact)"
+        )
+        parser.add_argument(
+            "-f", "--formato",
+            choices=FORMATOS_SAIDA,
+            help="Formato do arquivo: pretty (padrão), compact ou ndjson (um produto por linha)"
+        )
+        parser.add_argument(
+            "--abas",
+            help="Abas a converter, separadas por vírgula, ou 'todas' (padrão: aba ativa)"
+        )
+        parser.add_argument(
+            "--processos",
+            type=int,
+            help="Máximo de processos na leitura de várias abas (padrão: nº de CPUs)"
+        )
+        parser.add_argument(
+            "--lote",
+            action="store_true",
+            help="Converter em paralelo todas as planilhas de uma pasta ou .zip "
+                 "(-o indica a pasta de saída); atalho para o subcomando convert"
+        )
+        parser.add_argument(
+            "--trabalhadores",
+            type=int,
+            help=f"Processos simultâneos no modo --lote (padrão: até {TRABALHADORES_LOTE_PADRAO})"
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            help="Com --lote: resumo JSON no stdout, como no subcomando convert"
+        )
+        parser.add_argument(
+            "--catalogo-ncm",
+            help="JSON oficial de atributos por NCM (avisa atributos inválidos/faltantes)"
+        )
+        parser.add_argument(
+            "--lote-produtos",
+            type=int,
+            help="Dividir a saída em lotes de até N produtos (gera um .zip)"
+        )
+        parser.add_argument(
+            "--lote-mb",
+            type=float,
+            help="Dividir a saída em lotes de até N MB (gera um .zip)"
         )
+        _adicionar_opcoes_padrao(parser)
 
         args = parser.parse_args()
+        # Mesmo plano de atributos padrão do site, de convert/watch e de --lote
+        conversor.injecao = PlanoInjecao({opcao: getattr(args, opcao) for opcao in OPCOES_PADRAO}) or None
 
         if args.modelo:
             conversor.gerar_planilha_modelo(args.arquivo)
         elif args.json_para_excel:
             conversor.json_para_planilha(args.json_para_excel, args.arquivo)
+        elif args.lote:
+            if args.modo == "multi":
+                parser.error("o modo --lote gera um único formato por planilha; escolha um modo com -m")
+            sys.exit(_executar_lote_cli(args))
         else:
-            indent = None if args.compacto else 2
-            conversor.converter(args.arquivo, args.output, args.modo, indent)
+            formato = args.formato or ("compact" if args.compacto else "pretty")
+            modos = [m.strip() for m in args.modos.split(",") if m.strip()] if args.modos else None
+            abas = args.abas
+            if abas and abas.strip().lower() != "todas":
+                abas = [a.strip() for a in abas.split(",") if a.strip()]
+            elif abas:
+                abas = "todas"
+            conversor.converter(args.arquivo, args.output, args.modo, modos=modos, formato=formato,
+                                lote_max_produtos=args.lote_produtos, lote_max_mb=args.lote_mb,
+                                abas=abas, processos=args.processos)
         return
 
     # Modo interativo
@@ -1440,14 +3721,15 @@ def main():
             )
             conversor.erros = []
             conversor.avisos = []
-            produtos = conversor.ler_planilha(caminho_excel)
+            resumo = conversor.validar_planilha(caminho_excel)
 
             if conversor.erros:
                 print(f"\n  ❌ {len(conversor.erros)} ERRO(S):")
                 for erro in conversor.erros:
                     print(f"     ⛔ {erro}")
             else:
-                print(f"\n  ✅ Planilha válida! {len(produtos)} produtos prontos.")
+                print(f"\n  ✅ Planilha válida! {resumo['linhas_validas']} produtos prontos.")
+            print(f"  ⏱️  Validação em {resumo['tempo_ms']:.0f} ms")
 
             if conversor.avisos:
                 print(f"\n  ⚠️  {len(conversor.avisos)} AVISO(S):")
@@ -3,21 +3,136 @@
 Script de teste: valida conversão JSON → Excel → JSON com compatibilidade 100%.
 """
 
+import contextlib
+import io
 import json
 import os
+import re
+import subprocess
 import sys
+import tempfile
+import time
+import zipfile
+
+import openpyxl
 
 # Adicionar o diretório ao path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from conversor_catalogo_siscomex import ConversorCatalogoSiscomex
+from conversor_catalogo_siscomex import (
+    ConversorCatalogoSiscomex, serializar_json, gravar_json, gravar_saida, dividir_em_lotes, orjson,
+    PlanoInjecao, _sortear_linhas_estratificadas, _intervalo_wilson,
+    extrair_planilhas_zip, LimiteZipExcedido, SUFIXOS_MODO,
+)
 
 DIRETORIO = os.path.dirname(os.path.abspath(__file__))
 JSON_ORIGINAL = os.path.join(DIRETORIO, "CATALOGO_PRODUTOS_25940099_20260220031001.json")
 EXCEL_TESTE = os.path.join(DIRETORIO, "TESTE_catalogo.xlsx")
+EXCEL_SEM_DIMENSAO = os.path.join(DIRETORIO, "TESTE_sem_dimensao.xlsx")
 JSON_POST = os.path.join(DIRETORIO, "TESTE_saida_POST.json")
 JSON_COMPLETO = os.path.join(DIRETORIO, "TESTE_saida_COMPLETO.json")
 EXCEL_MODELO = os.path.join(DIRETORIO, "MODELO_catalogo_produtos.xlsx")
+JSON_SERIALIZADO = os.path.join(DIRETORIO, "TESTE_serializado.json")
+CONVERSOR = os.path.join(DIRETORIO, "conversor_catalogo_siscomex.py")
+
+
+def planilha_teste() -> str:
+    """EXCEL_TESTE (gerada pelo teste 1), criada aqui se o teste rodar sozinho."""
+    if not os.path.exists(EXCEL_TESTE):
+        ConversorCatalogoSiscomex().json_para_planilha(JSON_ORIGINAL, EXCEL_TESTE)
+    return EXCEL_TESTE
+
+
+def planilha_alterada(destino: str, alteracoes: dict) -> str:
+    """
+    Cópia de planilha_teste() em `destino` com as células {(linha, cabeçalho):
+    valor} alteradas (cabeçalho novo vira coluna no fim).
+    """
+    wb = openpyxl.load_workbook(planilha_teste())
+    ws = wb.active
+    colunas = {celula.value: celula.column for celula in ws[1]}
+    for (linha, cabecalho), valor in alteracoes.items():
+        if cabecalho not in colunas:
+            colunas[cabecalho] = ws.max_column + 1
+            ws.cell(row=1, column=colunas[cabecalho], value=cabecalho)
+        ws.cell(row=linha, column=colunas[cabecalho], value=valor)
+    wb.save(destino)
+    return destino
+
+
+def planilha_unica(pasta: str) -> str:
+    """Cópia da planilha de teste com conteúdo inédito (não reaproveita conversões idênticas)."""
+    return planilha_alterada(os.path.join(pasta, "unica.xlsx"),
+                             {(2, "denominacao"): f"PRODUTO {os.urandom(8).hex()}"})
+
+
+@contextlib.contextmanager
+def valores_temporarios(modulo, **valores):
+    """Troca atributos de `modulo` (limites, prazos) durante o bloco."""
+    originais = {nome: getattr(modulo, nome) for nome in valores}
+    for nome, valor in valores.items():
+        setattr(modulo, nome, valor)
+    try:
+        yield
+    finally:
+        for nome, valor in originais.items():
+            setattr(modulo, nome, valor)
+
+
+def aguardar_job(cliente, job_id: str, limite_s: float = 30) -> dict:
+    """Consulta /jobs/<id> até o job terminar (concluido, erro ou cancelado)."""
+    fim = time.monotonic() + limite_s
+    while True:
+        job = cliente.get(f"/jobs/{job_id}").get_json()
+        if job['status'] in ('concluido', 'erro', 'cancelado') or time.monotonic() > fim:
+            return job
+        time.sleep(0.05)
+
+
+def executar_cli(*argumentos) -> tuple:
+    """Roda o conversor pela linha de comando: (código de saída, stdout)."""
+    processo = subprocess.run([sys.executable, CONVERSOR, *argumentos], capture_output=True,
+                              text=True, encoding='utf-8', cwd=DIRETORIO)
+    return processo.returncode, processo.stdout
+
+
+def app_web():
+    """Módulo web/app.py (importado uma vez; o Flask test client vem de app_web().app)."""
+    sys.path.insert(0, os.path.join(DIRETORIO, "web"))
+    import app
+    return app
+
+
+@contextlib.contextmanager
+def catalogo_ncm(web, catalogo: dict, versao: str = "versao-teste"):
+    """Carrega `catalogo` ({ncm: {att: info}}) como catálogo de NCMs do app durante o bloco."""
+    original = dict(web.ATRIBUTOS_POR_NCM), web.INDICE_NCM, web.VERSAO_CATALOGO_NCM
+    web.ATRIBUTOS_POR_NCM.clear()
+    web.ATRIBUTOS_POR_NCM.update(catalogo)
+    web.INDICE_NCM = web.IndiceNcm(catalogo)
+    web.VERSAO_CATALOGO_NCM = versao
+    try:
+        yield
+    finally:
+        web.ATRIBUTOS_POR_NCM.clear()
+        web.ATRIBUTOS_POR_NCM.update(original[0])
+        web.INDICE_NCM, web.VERSAO_CATALOGO_NCM = original[1], original[2]
+
+
+def enviar_planilha(cliente, rota: str, caminho: str, nome: str = "catalogo.xlsx", **campos):
+    """POST multipart da planilha em `caminho` (campo 'arquivo') para `rota` do app."""
+    with open(caminho, "rb") as f:
+        dados = {"arquivo": (io.BytesIO(f.read()), nome), **campos}
+    return cliente.post(rota, data=dados, content_type="multipart/form-data")
+
+
+def remover_saidas(web, dados: dict):
+    """Remove do armazém os arquivos de download citados numa resposta de /converter."""
+    nomes = [dados.get("arquivo_download"), *(dados.get("arquivos_download") or {}).values()]
+    for nome in filter(None, set(nomes)):
+        localizado = web.ARMAZEM.localizar(nome)
+        if localizado:
+            os.remove(localizado[0])
 
 
 def teste_1_json_para_excel():
@@ -182,6 +297,18 @@ def teste_4_gerar_modelo():
     conversor.gerar_planilha_modelo(EXCEL_MODELO)
     
     assert os.path.exists(EXCEL_MODELO), "Planilha modelo não foi criada!"
+
+    # abas="todas": INSTRUÇÕES e CÓDIGOS PAÍS não são de produtos e só geram aviso
+    leitor = ConversorCatalogoSiscomex()
+    leitor.ler_planilha(EXCEL_MODELO, abas="todas")
+    assert not any("Colunas obrigatórias" in e for e in leitor.erros), leitor.erros
+    ignoradas = [a for a in leitor.avisos if "ignorada" in a]
+    assert len(ignoradas) == 2, leitor.avisos
+
+    # Aba pedida pelo nome continua exigindo as colunas obrigatórias
+    leitor = ConversorCatalogoSiscomex()
+    leitor.ler_planilha(EXCEL_MODELO, abas=["INSTRUÇÕES"])
+    assert any("Colunas obrigatórias" in e for e in leitor.erros), leitor.erros
     print("✅ TESTE 4 PASSOU: Planilha modelo criada com sucesso.")
     return True
 
@@ -210,6 +337,1263 @@ def teste_5_excel_para_json_completo():
     return True
 
 
+def teste_6_serializador_identico():
+    """Valida que o serializador (orjson ou json padrão) gera bytes idênticos ao json."""
+    print("\n" + "=" * 70)
+    print("TESTE 6: Serializador JSON idêntico ao json padrão")
+    print("=" * 70)
+    print(f"   Backend: {'orjson' if orjson is not None else 'json (padrão)'}")
+
+    with open(JSON_ORIGINAL, 'r', encoding='utf-8') as f:
+        original = json.load(f)
+
+    conversor = ConversorCatalogoSiscomex()
+    casos = {
+        "original": original,
+        "post": conversor.gerar_json_post(original),
+        "put": conversor.gerar_json_put(original),
+        "api_post": conversor.gerar_json_api_post(original),
+        "completo": conversor.gerar_json_completo(original),
+        "especiais": [{
+            "descricao": "Aço inox \"ç\" / \\ \u2028 \x1f \x7f 日本",
+            "atributos": [],
+            "atributosCompostos": {},
+            "codigo": 123,
+            "ativo": True,
+            "versao": None,
+        }],
+        "vazio": [],
+    }
+
+    for nome, dados in casos.items():
+        esperado = json.dumps(dados, ensure_ascii=False, indent=2)
+        assert serializar_json(dados) == esperado, f"serializar_json diverge em '{nome}'"
+        assert serializar_json(dados, produtos=True) == esperado, f"produtos=True diverge em '{nome}'"
+
+        gravar_json(dados, JSON_SERIALIZADO)
+        with open(JSON_SERIALIZADO, 'r', encoding='utf-8') as f:
+            assert f.read() == esperado, f"gravar_json diverge em '{nome}'"
+
+        # Formatos compact e ndjson equivalem ao json sem espaços
+        compacto = json.dumps(dados, ensure_ascii=False, separators=(',', ':'))
+        gravar_saida(dados, JSON_SERIALIZADO, "compact")
+        with open(JSON_SERIALIZADO, 'r', encoding='utf-8') as f:
+            assert f.read() == compacto, f"formato compact diverge em '{nome}'"
+        if isinstance(dados, list):
+            gravar_saida(dados, JSON_SERIALIZADO, "ndjson")
+            with open(JSON_SERIALIZADO, 'r', encoding='utf-8') as f:
+                linhas = f.read().split("\n")[:-1]
+            assert [json.loads(l) for l in linhas] == dados, f"formato ndjson diverge em '{nome}'"
+
+        # Ordem das chaves do portal preservada
+        if dados and isinstance(dados[0], dict):
+            assert list(json.loads(esperado)[0]) == list(dados[0]), f"Ordem das chaves alterada em '{nome}'"
+
+    # Indentação diferente de 2 sempre usa o json padrão
+    assert serializar_json(original, indent=4) == json.dumps(original, ensure_ascii=False, indent=4)
+
+    # Floats, datas e NaN: mesma saída (ou mesmo erro) com e sem orjson
+    from datetime import date, datetime
+    import conversor_catalogo_siscomex as modulo
+    datas = [{"validade": date(2026, 2, 20), "gerado": datetime(2026, 2, 20, 3, 10, 1), "peso": 1.5}]
+    esperado_datas = json.dumps(datas, ensure_ascii=False, indent=2, default=lambda v: v.isoformat())
+    for backend in ([orjson, None] if orjson is not None else [None]):
+        modulo.orjson = backend
+        try:
+            assert serializar_json(datas) == esperado_datas, f"Datas divergem (orjson={backend is not None})"
+            assert serializar_json(datas[0] | {"peso": None}, indent=0) == json.dumps(
+                datas[0] | {"peso": None}, ensure_ascii=False, separators=(',', ':'), default=lambda v: v.isoformat())
+            # produtos=True: float num campo de primeiro nível do produto também vai ao json padrão
+            produto_float = [{"seq": 1, "codigo": 2.5e-5, "atributos": []}]
+            assert serializar_json(produto_float, produtos=True) == json.dumps(
+                produto_float, ensure_ascii=False, indent=2), f"Float de produto diverge (orjson={backend is not None})"
+            for invalido in (float("nan"), float("inf")):
+                try:
+                    serializar_json([{"valor": invalido}], produtos=True)
+                except ValueError:
+                    pass
+                else:
+                    raise AssertionError(f"{invalido} deveria ser recusado (orjson={backend is not None})")
+        finally:
+            modulo.orjson = orjson
+
+    os.remove(JSON_SERIALIZADO)
+    print(f"✅ TESTE 6 PASSOU: {len(casos)} casos com saída byte a byte idêntica.")
+    return True
+
+
+def teste_7_lotes():
+    """Testa a divisão da saída em lotes: limites respeitados e seq por lote."""
+    print("\n" + "=" * 70)
+    print("TESTE 7: Divisão em lotes")
+    print("=" * 70)
+
+    with open(JSON_ORIGINAL, 'r', encoding='utf-8') as f:
+        original = json.load(f)
+
+    conversor = ConversorCatalogoSiscomex()
+    post = conversor.gerar_json_post(original * 5)
+    max_bytes = 4000
+
+    for formato in ("pretty", "compact", "ndjson"):
+        lotes = list(dividir_em_lotes(post, formato, max_produtos=4, max_bytes=max_bytes))
+        recompostos = []
+        for conteudo in lotes:
+            texto = conteudo.decode('utf-8')
+            if formato == "ndjson":
+                itens = [json.loads(l) for l in texto.split("\n")[:-1]]
+            else:
+                itens = json.loads(texto)
+            assert 1 <= len(itens) <= 4, f"Lote com {len(itens)} produtos ({formato})"
+            assert len(itens) == 1 or len(conteudo) <= max_bytes, f"Lote acima do limite ({formato})"
+            assert [p["seq"] for p in itens] == list(range(1, len(itens) + 1)), "seq não recomeça no lote"
+            recompostos.extend(itens)
+        sem_seq = [{k: v for k, v in p.items() if k != "seq"} for p in recompostos]
+        assert sem_seq == [{k: v for k, v in p.items() if k != "seq"} for p in post], "Produtos perdidos"
+
+    # Sem limites: um único lote igual à saída normal
+    assert list(dividir_em_lotes(post)) == [serializar_json(post).encode('utf-8')]
+
+    # Zip de entrada do lote: limites de planilhas e de bytes descompactados
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho_zip = os.path.join(pasta, "lote.zip")
+        with zipfile.ZipFile(caminho_zip, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for i in range(3):
+                zf.writestr(f"p{i}.xlsx", b"\0" * 1024 * 1024)
+            zf.writestr("__MACOSX/._p0.xlsx", b"")
+        assert len(extrair_planilhas_zip(caminho_zip, pasta, 3 * 1024 * 1024, 3)) == 3
+        for max_bytes, max_arquivos in ((3 * 1024 * 1024 - 1, None), (None, 2)):
+            try:
+                extrair_planilhas_zip(caminho_zip, pasta, max_bytes, max_arquivos)
+                assert False, f"Zip acima do limite aceito ({max_bytes}, {max_arquivos})"
+            except LimiteZipExcedido:
+                pass
+
+    print(f"✅ TESTE 7 PASSOU: {len(post)} produtos divididos em lotes ({len(lotes)} em ndjson).")
+    return True
+
+
+def teste_8_injecao_padroes():
+    """Testa o plano de atributos padrão: só preenche o que a planilha não traz."""
+    print("\n" + "=" * 70)
+    print("TESTE 8: Atributos padrão (PlanoInjecao)")
+    print("=" * 70)
+
+    base = ConversorCatalogoSiscomex().ler_planilha(EXCEL_TESTE)
+    plano = PlanoInjecao({'pais_origem': '999', 'embalagem': '10', 'fabricante': ''})
+    assert 'fabricante' not in plano.padroes, "Padrão vazio não deve entrar no plano"
+    produtos = ConversorCatalogoSiscomex(injecao=plano).ler_planilha(EXCEL_TESTE)
+    assert len(produtos) == len(base), "Número de produtos mudou com a injeção"
+
+    for antes, depois in zip(base, produtos):
+        simples = {a["atributo"]: a["valor"] for a in antes["atributos"]}
+        if "ATT_14545" in simples:
+            assert depois["atributos"] == antes["atributos"], "Valor da planilha sobrescrito"
+        else:
+            assert depois["atributos"][0] == {"atributo": "ATT_14545", "valor": "999"}, "ATT_14545 não injetado no início"
+            assert depois["atributos"][1:] == antes["atributos"]
+        multi = {a["atributo"] for a in antes["atributosMultivalorados"]}
+        if "ATT_14556" not in multi:
+            assert depois["atributosMultivalorados"][-1] == {"atributo": "ATT_14556", "valores": ["10"]}
+
+    print(f"✅ TESTE 8 PASSOU: plano aplicado a {len(produtos)} produtos sem sobrescrever a planilha.")
+    return True
+
+
+def teste_9_amostragem():
+    """Testa a verificação rápida: sorteio estratificado, Wilson e abas sem <dimension>."""
+    print("\n" + "=" * 70)
+    print("TESTE 9: Verificação por amostragem")
+    print("=" * 70)
+
+    sorteadas = _sortear_linhas_estratificadas(1000, 50, semente=7)
+    assert len(sorteadas) == 50, f"Amostra com {len(sorteadas)} linhas (esperado 50)"
+    assert set(range(2, 7)) <= sorteadas and set(range(997, 1002)) <= sorteadas, "Bordas não sorteadas"
+    assert min(sorteadas) >= 2 and max(sorteadas) <= 1001, "Linha fora da planilha"
+    assert sorteadas == _sortear_linhas_estratificadas(1000, 50, semente=7), "Sorteio não reprodutível"
+    assert _sortear_linhas_estratificadas(5, 50) == {2, 3, 4, 5, 6}, "Planilha pequena: todas as linhas"
+
+    assert _intervalo_wilson(0, 0) == (0.0, 1.0), "Sem amostra o intervalo deve ser [0, 1]"
+    baixo, alto = _intervalo_wilson(0, 7)
+    assert baixo == 0.0 and abs(alto - 0.3543) < 1e-3, f"Wilson(0, 7) = {baixo}, {alto}"
+    baixo, alto = _intervalo_wilson(5, 10)
+    assert abs((baixo + alto) / 2 - 0.5) < 1e-9, "Wilson(5, 10) deve ser simétrico em 0,5"
+
+    com_dimensao = ConversorCatalogoSiscomex().verificar_amostra(EXCEL_TESTE, semente=1)
+    assert com_dimensao['amostra'] > 0 and not com_dimensao['inconclusivo']
+
+    # Mesma planilha sem <dimension>: openpyxl read-only devolve max_row None
+    with zipfile.ZipFile(EXCEL_TESTE) as origem, zipfile.ZipFile(EXCEL_SEM_DIMENSAO, "w") as destino:
+        for info in origem.infolist():
+            dados = origem.read(info)
+            if info.filename.startswith("xl/worksheets/"):
+                dados = re.sub(rb"<dimension[^>]*/>", b"", dados)
+            destino.writestr(info, dados)
+    sem_dimensao = ConversorCatalogoSiscomex().verificar_amostra(EXCEL_SEM_DIMENSAO, semente=1)
+    os.remove(EXCEL_SEM_DIMENSAO)
+    for campo in ("amostra", "linhas_com_erro", "intervalo_95"):
+        assert sem_dimensao[campo] == com_dimensao[campo], \
+            f"{campo}: {sem_dimensao[campo]} sem <dimension>, {com_dimensao[campo]} com"
+    assert sem_dimensao['total_linhas_estimado'] == com_dimensao['amostra']
+
+    # Nenhuma linha de dados: resultado inconclusivo, nunca "válido"
+    from openpyxl import load_workbook
+    wb = load_workbook(EXCEL_TESTE)
+    wb.active.delete_rows(2, wb.active.max_row)
+    wb.save(EXCEL_SEM_DIMENSAO)
+    vazia = ConversorCatalogoSiscomex().verificar_amostra(EXCEL_SEM_DIMENSAO)
+    os.remove(EXCEL_SEM_DIMENSAO)
+    assert vazia['amostra'] == 0 and vazia['inconclusivo'], "Amostra vazia deve ser inconclusiva"
+    assert vazia['intervalo_95'] == [0.0, 1.0] and vazia['taxa_erro_estimada'] is None
+
+    print(f"✅ TESTE 9 PASSOU: amostra de {com_dimensao['amostra']} linhas com e sem <dimension>.")
+    return True
+
+
+def teste_10_armazem_download():
+    """Testa o armazém em shards e o download de JSON gzip (com e sem Accept-Encoding)."""
+    print("\n" + "=" * 70)
+    print("TESTE 10: Armazém de artefatos e download gzip")
+    print("=" * 70)
+
+    import gzip
+    web = app_web()
+
+    uid = web.novo_id_artefato()
+    with tempfile.TemporaryDirectory() as pasta:
+        armazem = web.ArmazemArtefatos(pasta)
+        caminho = armazem.caminho(f"{uid}_CATALOGO.xlsx")
+        assert caminho == os.path.join(pasta, uid[:2], uid[2:4], f"{uid}_CATALOGO.xlsx"), caminho
+        for invalido in ("CATALOGO.xlsx", f"{uid}_../x", f"../{uid}_x"):
+            try:
+                armazem.caminho(invalido)
+                assert False, f"Nome aceito: {invalido}"
+            except ValueError:
+                pass
+        assert armazem.localizar(f"{uid}_CATALOGO.xlsx") is None
+        assert armazem.localizar("../../etc/passwd") is None
+
+        with armazem.gravar(f"{uid}_CATALOGO.xlsx") as f:
+            f.write(b"xlsx")
+        with armazem.gravar(f"{uid}_CATALOGO.json") as f:
+            f.write(b'{"a": 1}')
+        assert armazem.localizar(f"{uid}_CATALOGO.xlsx") == (caminho, False)
+        caminho_json, comprimido = armazem.localizar(f"{uid}_CATALOGO.json")
+        assert comprimido and caminho_json.endswith(".json.gz")
+        with armazem.abrir(f"{uid}_CATALOGO.json") as f:
+            assert f.read() == b'{"a": 1}'
+
+    # /download: gzip como está só para quem aceita gzip com q > 0
+    conteudo = serializar_json([{"seq": i, "descricao": "PRODUTO " * 20} for i in range(200)]).encode('utf-8')
+    nome = f"{uid}_CATALOGO_POST.json"
+    with web.ARMAZEM.gravar(nome) as f:
+        f.write(conteudo)
+    cliente = web.app.test_client()
+    try:
+        for aceita, comprimida in (("gzip, deflate", True), ("gzip;q=0", False), ("identity", False), ("*", True)):
+            resposta = cliente.get(f"/download/{nome}", headers={"Accept-Encoding": aceita})
+            corpo = resposta.get_data()
+            resposta.close()
+            assert resposta.status_code == 200, (aceita, resposta.status_code)
+            assert "Accept-Encoding" in resposta.headers.get("Vary", ""), aceita
+            if comprimida:
+                assert resposta.headers.get("Content-Encoding") == "gzip", aceita
+                assert len(corpo) < len(conteudo) and gzip.decompress(corpo) == conteudo, aceita
+            else:
+                assert "Content-Encoding" not in resposta.headers, aceita
+                assert corpo == conteudo, aceita
+    finally:
+        os.remove(web.ARMAZEM.localizar(nome)[0])
+
+    # Uploads e saídas das rotas vão para os shards do armazém, registrados no índice
+    resposta = enviar_planilha(cliente, "/json-para-excel", JSON_ORIGINAL, nome="catalogo.json")
+    nome_excel = resposta.get_json()["arquivo_download"]
+    try:
+        caminho_excel, _ = web.ARMAZEM.localizar(nome_excel)
+        assert caminho_excel == web.ARMAZEM.caminho(nome_excel), caminho_excel
+        with web.ARTEFATOS._conexao() as db:
+            registrado = db.execute("SELECT 1 FROM artefatos WHERE nome = ?",
+                                    (os.path.relpath(caminho_excel, web.UPLOAD_FOLDER),)).fetchone()
+        assert registrado, "Saída fora do índice de expiração"
+        pasta_shard = os.path.dirname(caminho_excel)
+        assert [n for n in os.listdir(pasta_shard) if n.startswith(nome_excel[:32])] == [nome_excel], \
+            "Upload JSON não removido do shard"
+    finally:
+        remover_saidas(web, {"arquivo_download": nome_excel})
+
+    print("✅ TESTE 10 PASSOU: shards, gzip e download com e sem compressão.")
+    return True
+
+
+def teste_11_cli_lote():
+    """Testa os códigos de saída do subcomando convert e o atalho legado --lote."""
+    print("\n" + "=" * 70)
+    print("TESTE 11: CLI não interativa (convert e --lote)")
+    print("=" * 70)
+
+    import shutil
+    with tempfile.TemporaryDirectory() as pasta:
+        entrada = os.path.join(pasta, "entrada")
+        os.makedirs(entrada)
+        for nome in ("a.xlsx", "b.xlsx"):
+            shutil.copy(planilha_teste(), os.path.join(entrada, nome))
+
+        codigo, saida = executar_cli("convert", entrada, "-m", "post", "--json")
+        resumo = json.loads(saida)
+        assert codigo == 0 and resumo["ok"] == 2 and resumo["falhas"] == 0, (codigo, saida[-500:])
+        assert sorted(os.listdir(entrada)) == ["a.xlsx", "a_CATALOGO_POST.json", "b.xlsx", "b_CATALOGO_POST.json"]
+
+        # Nenhuma planilha: uso inválido (2); planilha quebrada: falha (1)
+        vazia = os.path.join(pasta, "vazia")
+        os.makedirs(vazia)
+        assert executar_cli("convert", vazia)[0] == 2
+        with open(os.path.join(entrada, "quebrada.xlsx"), 'wb') as f:
+            f.write(b"nao e um xlsx")
+        codigo, saida = executar_cli("convert", entrada, "-m", "post", "--json")
+        assert codigo == 1 and json.loads(saida)["falhas"] == 1, (codigo, saida[-500:])
+
+        # --lote é o mesmo caminho do convert (resumo --json e códigos de saída)
+        codigo, saida = executar_cli(entrada, "--lote", "-m", "post", "--json")
+        resumo = json.loads(saida)
+        assert codigo == 1 and resumo["comando"] == "convert" and resumo["total"] == 3, (codigo, saida[-500:])
+        os.remove(os.path.join(entrada, "quebrada.xlsx"))
+        caminho_zip = os.path.join(pasta, "lote.zip")
+        with zipfile.ZipFile(caminho_zip, 'w') as zf:
+            zf.write(os.path.join(entrada, "a.xlsx"), "a.xlsx")
+        codigo, saida = executar_cli(caminho_zip, "--lote", "-m", "post", "--json")
+        assert codigo == 0 and json.loads(saida)["ok"] == 1, (codigo, saida[-500:])
+        assert os.listdir(os.path.join(pasta, "lote_CATALOGO")) == ["a_CATALOGO_POST.json"]
+        assert executar_cli(vazia, "--lote")[0] == 2
+
+        # Atributos padrão: --lote, convert e conversão de um arquivo geram o mesmo payload
+        saidas = {}
+        for nome, argumentos in (
+            ("convert", ("convert", entrada, "-m", "post", "-o", os.path.join(pasta, "convert"))),
+            ("lote", (entrada, "--lote", "-m", "post", "-o", os.path.join(pasta, "lote"))),
+            ("arquivo", (os.path.join(entrada, "a.xlsx"), "-m", "post",
+                         "-o", os.path.join(pasta, "arquivo", "a_CATALOGO_POST.json"))),
+        ):
+            os.makedirs(os.path.join(pasta, nome), exist_ok=True)
+            codigo, saida = executar_cli(*argumentos, "--operador-estrangeiro", "BR00012345")
+            assert codigo == 0, (nome, codigo, saida[-500:])
+            with open(os.path.join(pasta, nome, "a_CATALOGO_POST.json"), 'r', encoding='utf-8') as f:
+                saidas[nome] = json.load(f)
+        assert saidas["convert"] == saidas["lote"] == saidas["arquivo"], "Atributos padrão divergem entre entradas"
+        assert all(p.get("codigoOperadorEstrangeiro") == "BR00012345"
+                   for p in saidas["lote"]), "--operador-estrangeiro não aplicado"
+
+    print("✅ TESTE 11 PASSOU: convert e --lote com os mesmos resumos, códigos de saída e atributos padrão.")
+    return True
+
+
+def teste_12_indice_ncm():
+    """Testa o índice de NCMs e o autocompletar em /ncm."""
+    print("\n" + "=" * 70)
+    print("TESTE 12: Índice de NCMs e /ncm")
+    print("=" * 70)
+
+    web = app_web()
+    att = {'obrigatorio': False, 'multivalorado': False, 'modalidade': 'Importação', 'dominio': None}
+    catalogo = {
+        '90211010': {'ATT_1': dict(att, obrigatorio=True), 'ATT_2': att},
+        '90211020': {'ATT_1': att},
+        '90212100': {'ATT_3': att},
+        '84713012': {'ATT_4': att},
+    }
+    indice = web.IndiceNcm(catalogo)
+    assert len(indice) == 4 and '90211020' in indice and '9021' not in indice
+    assert indice.buscar_prefixo('9021') == ['90211010', '90211020', '90212100']
+    assert indice.buscar_prefixo('9021', 2) == ['90211010', '90211020']
+    assert indice.contar_prefixo('902110') == 2 and indice.contar_prefixo('99') == 0
+
+    cliente = web.app.test_client()
+    with catalogo_ncm(web, catalogo):
+        resposta = cliente.get('/ncm?prefix=9021.10&limite=1')
+        assert resposta.status_code == 200, resposta.status_code
+        dados = resposta.get_json()
+        assert dados['prefixo'] == '902110' and dados['total'] == 2, dados
+        assert [item['ncm'] for item in dados['ncms']] == ['90211010'], dados
+        item = dados['ncms'][0]
+        assert item['atributos'] == 2 and item['obrigatorios'] == 1, item
+        assert item['url_atributos'] == '/atributos/90211010?v=versao-teste', item
+        assert cliente.get('/ncm?prefix=7').get_json()['ncms'] == []
+        for invalido in ('/ncm', '/ncm?prefix=90a', '/ncm?prefix=123456789', '/ncm?prefix=9021&limite=x'):
+            assert cliente.get(invalido).status_code == 400, invalido
+
+    print("✅ TESTE 12 PASSOU: busca por prefixo, limite, contagem e validação do prefixo.")
+    return True
+
+
+def teste_13_coalescencia():
+    """Testa o single-flight de conversões idênticas (conversao_unica e /converter)."""
+    print("\n" + "=" * 70)
+    print("TESTE 13: Conversões idênticas coalescidas")
+    print("=" * 70)
+
+    import threading
+    web = app_web()
+    chave = web.novo_id_artefato()
+    base = os.path.join(web.UPLOAD_FOLDER, f"_conversao_{chave}")
+    dentro, liberar = threading.Event(), threading.Event()
+
+    def primeira():
+        with web.conversao_unica(chave) as registro:
+            assert not registro['reaproveitado']
+            dentro.set()
+            liberar.wait(10)
+            registro['resposta'], registro['status'] = {'sucesso': True, 'n': 1}, 200
+
+    try:
+        fio = threading.Thread(target=primeira)
+        fio.start()
+        assert dentro.wait(10)
+        # Trava em uso: nunca registrada no índice (a faxina não pode apagá-la)
+        with web.ARTEFATOS._conexao() as db:
+            nomes = {nome for (nome,) in db.execute('SELECT nome FROM artefatos')}
+        assert os.path.basename(base + '.lock') not in nomes
+        web.ARTEFATOS.adotar()
+        with web.ARTEFATOS._conexao() as db:
+            assert not db.execute('SELECT 1 FROM artefatos WHERE nome = ?',
+                                  (os.path.basename(base + '.lock'),)).fetchone()
+
+        with web.conversao_unica(chave, espera_s=0.3) as registro:
+            assert registro['ocupado'] and not registro['reaproveitado'], registro
+
+        threading.Timer(0.3, liberar.set).start()
+        with web.conversao_unica(chave) as registro:
+            assert registro['reaproveitado'], registro
+            assert registro['resposta'] == {'sucesso': True, 'n': 1} and registro['status'] == 200
+        fio.join(10)
+        assert not os.path.exists(base + '.lock'), "Trava não apagada ao ser solta"
+        with web.ARTEFATOS._conexao() as db:
+            expira = db.execute('SELECT expira FROM artefatos WHERE nome = ?',
+                                (os.path.basename(base + '.json'),)).fetchone()[0]
+        assert expira <= time.time() + web.COALESCER_RESULTADO_S + 1
+    finally:
+        liberar.set()
+        for caminho in (base + '.json', base + '.lock'):
+            if os.path.exists(caminho):
+                os.remove(caminho)
+
+    # Mesma planilha e opções em /converter: a segunda requisição reaproveita a primeira
+    cliente = web.app.test_client()
+    primeira_resposta = enviar_planilha(cliente, '/converter', planilha_teste(), modo='post')
+    segunda_resposta = enviar_planilha(cliente, '/converter', planilha_teste(), modo='post')
+    try:
+        assert primeira_resposta.status_code == 200, primeira_resposta.get_json()
+        assert segunda_resposta.get_json() == primeira_resposta.get_json()
+        outra = enviar_planilha(cliente, '/converter', planilha_teste(), modo='completo')
+        assert outra.get_json()['arquivo_download'] != primeira_resposta.get_json()['arquivo_download']
+        remover_saidas(web, outra.get_json())
+    finally:
+        remover_saidas(web, primeira_resposta.get_json())
+
+    print("✅ TESTE 13 PASSOU: espera pela conversão idêntica, trava fora da faxina e reaproveitamento.")
+    return True
+
+
+def teste_14_validacao_streaming():
+    """Testa a validação sem montar produtos (validar_planilha e /validar)."""
+    print("\n" + "=" * 70)
+    print("TESTE 14: Validação em streaming")
+    print("=" * 70)
+
+    web = app_web()
+    cliente = web.app.test_client()
+    with tempfile.TemporaryDirectory() as pasta:
+        quebrada = planilha_alterada(os.path.join(pasta, "quebrada.xlsx"), {
+            (2, "ncm"): "ABC12345", (4, "modalidade"): "XYZ", (6, "cpfCnpjRaiz"): "12A",
+        })
+
+        # Mesmos erros e mesma contagem da leitura completa
+        completo = ConversorCatalogoSiscomex()
+        produtos = completo.ler_planilha(quebrada)
+        validador = ConversorCatalogoSiscomex()
+        resumo = validador.validar_planilha(quebrada)
+        assert validador.erros == completo.erros and len(validador.erros) == 3, validador.erros
+        assert resumo['total_linhas'] == 7 and resumo['linhas_validas'] == len(produtos) == 4, resumo
+        assert not resumo['interrompido'] and resumo['tempo_ms'] >= 0
+
+        validador = ConversorCatalogoSiscomex()
+        resumo = validador.validar_planilha(quebrada, max_erros=1)
+        assert resumo['interrompido'] and resumo['total_linhas'] == 1, resumo
+        assert validador.erros == completo.erros[:1]
+
+        dados = enviar_planilha(cliente, '/validar', planilha_teste()).get_json()
+        assert dados['valido'] and dados['total_produtos'] == 7 and dados['erros'] == [], dados
+        dados = enviar_planilha(cliente, '/validar', quebrada, max_erros='2').get_json()
+        assert dados['valido'] is False and dados['interrompido'], dados
+        assert dados['erros'] == completo.erros[:2], dados['erros']
+        assert enviar_planilha(cliente, '/validar', quebrada, max_erros='x').status_code == 400
+
+    print("✅ TESTE 14 PASSOU: validação igual à da leitura completa, com parada em max_erros.")
+    return True
+
+
+def teste_15_normalizacao_memoizada():
+    """Testa a memoização da normalização/validação de NCM, CNPJ, modalidade e situação."""
+    print("\n" + "=" * 70)
+    print("TESTE 15: Normalização memoizada")
+    print("=" * 70)
+
+    import conversor_catalogo_siscomex as motor
+
+    valores = {
+        'ncm': [90211010, '9021.10.10', ' 3006401 ', '12A', 1, '1'],
+        'cpfCnpjRaiz': [25940099, '25.940.099', '12A', '1' * 20],
+        'modalidade': ['importacao', 'EXPORTACAO', 'XYZ'],
+        'situacao': ['ativado', 'Desativado', 'x', None],
+    }
+    conversor = ConversorCatalogoSiscomex()
+    for campo, lista in valores.items():
+        for valor in lista * 2:  # segunda passada sai do cache
+            normalizado = conversor._normalizar_campo(campo, valor)
+            esperado = (normalizado, motor.VERIFICADORES_CAMPO[campo](normalizado) if normalizado else None)
+            assert conversor._normalizar_validar(campo, valor) == esperado, (campo, valor)
+    # A chave inclui o tipo da célula: 1 e True não se confundem
+    assert (int, 1) in conversor._cache_normalizacao['ncm']
+    assert conversor._normalizar_validar('ncm', True) != conversor._normalizar_validar('ncm', 1)
+
+    with tempfile.TemporaryDirectory() as pasta:
+        # Valor inválido repetido: um erro por linha, cada um com a sua linha
+        repetida = planilha_alterada(os.path.join(pasta, "repetida.xlsx"),
+                                     {(linha, "modalidade"): "XYZ" for linha in (2, 3, 5)})
+        conversor = ConversorCatalogoSiscomex()
+        produtos = conversor.ler_planilha(repetida)
+        assert len(produtos) == 4
+        assert [erro.split(":")[0] for erro in conversor.erros] == ["Linha 2", "Linha 3", "Linha 5"], conversor.erros
+        assert len({erro.split(": ", 1)[1] for erro in conversor.erros}) == 1
+
+        # Cache limitado por campo e zerado a cada leitura
+        limite_original = motor.CACHE_NORMALIZACAO_MAX
+        motor.CACHE_NORMALIZACAO_MAX = 2
+        try:
+            distintos = planilha_alterada(os.path.join(pasta, "distintos.xlsx"),
+                                          {(linha, "ncm"): f"9021101{linha}" for linha in range(2, 9)})
+            conversor = ConversorCatalogoSiscomex()
+            produtos = conversor.ler_planilha(distintos)
+            assert [p['ncm'] for p in produtos] == [f"9021101{linha}" for linha in range(2, 9)]
+            assert len(conversor._cache_normalizacao['ncm']) == 2
+            conversor.ler_planilha(repetida)
+            assert all(chave[1] != "90211012" for chave in conversor._cache_normalizacao['ncm'])
+        finally:
+            motor.CACHE_NORMALIZACAO_MAX = limite_original
+
+    print("✅ TESTE 15 PASSOU: mesmos valores e erros por linha, cache limitado e por conversão.")
+    return True
+
+
+def teste_16_projecoes_compiladas():
+    """Testa as projeções compiladas de ESQUEMAS_SAIDA contra uma leitura direta do esquema."""
+    print("\n" + "=" * 70)
+    print("TESTE 16: Projeções compiladas dos modos de saída")
+    print("=" * 70)
+
+    import conversor_catalogo_siscomex as motor
+
+    def projetar_referencia(campos, produto, seq):
+        """Interpretação campo a campo do esquema (o que a versão compilada deve reproduzir)."""
+        item = {}
+        for chave, origem, padrao, transformacao, presenca in campos:
+            if origem is None:
+                item[chave] = seq
+            elif presenca == motor.SEMPRE:
+                valor = produto.get(origem, padrao)
+                item[chave] = transformacao(valor, seq) if transformacao else valor
+            else:
+                valor = produto.get(origem)
+                if valor and transformacao:
+                    valor = transformacao(valor, seq)
+                if valor:
+                    item[chave] = valor
+        return item
+
+    produtos = ConversorCatalogoSiscomex().ler_planilha(planilha_teste())
+    produtos += [
+        {},
+        {'codigo': '', 'versao': '', 'situacao': 'desativado', 'codigoOperadorEstrangeiro': ''},
+        {'codigo': 12.0, 'versao': 3, 'codigoOperadorEstrangeiro': 'BR00012345', 'ncm': '90211010'},
+        {'codigo': 'ABC', 'versao': ' 2 ', 'situacao': 'Rascunho', 'codigosInterno': ['X1']},
+    ]
+    for modo, campos in motor.ESQUEMAS_SAIDA.items():
+        for seq, produto in enumerate(produtos, 1):
+            compilado = motor.PROJECOES[modo](produto, seq)
+            referencia = projetar_referencia(campos, produto, seq)
+            assert compilado == referencia and list(compilado) == list(referencia), (modo, produto)
+
+    # Ordem dos campos do portal
+    conversor = ConversorCatalogoSiscomex()
+    post = conversor.gerar_json_post(produtos[:1])[0]
+    assert list(post) == ['seq', 'descricao', 'denominacao', 'cpfCnpjRaiz', 'situacao', 'modalidade', 'ncm',
+                          'atributos', 'atributosMultivalorados', 'atributosCompostos',
+                          'atributosCompostosMultivalorados', 'codigosInterno'], list(post)
+    completo = conversor.gerar_json_completo(produtos[-2:])
+    assert [item['codigo'] for item in completo] == [12, 2] and completo[0]['versao'] == '3', completo
+    assert completo[0]['codigoOperadorEstrangeiro'] == 'BR00012345'
+    assert conversor.gerar_json_completo([produtos[-1]])[0]['codigo'] == 1  # sem código numérico: seq
+    api = conversor.gerar_json_api_put(produtos[:1])[0]
+    assert 'seq' not in api and 'cpfCnpjRaiz' not in api and 'situacao' not in api, list(api)
+
+    # PUT: produto sem código sai como POST sem reiniciar a numeração
+    put = conversor.gerar_json_put([produtos[-2], {'denominacao': 'SEM CODIGO'}, produtos[-1]])
+    assert [item['seq'] for item in put] == [1, 2, 3], put
+    assert 'codigo' not in put[1] and put[0]['codigo'] == 12 and put[2]['codigo'] == 'ABC'
+    assert any('SEM CODIGO' in aviso for aviso in conversor.avisos)
+
+    print("✅ TESTE 16 PASSOU: projeções compiladas iguais ao esquema, na ordem do portal.")
+    return True
+
+
+def teste_17_modo_multi():
+    """Testa o modo multi: vários formatos de uma só leitura (motor e /converter)."""
+    print("\n" + "=" * 70)
+    print("TESTE 17: Modo multi")
+    print("=" * 70)
+
+    web = app_web()
+    with tempfile.TemporaryDirectory() as pasta:
+        conversor = ConversorCatalogoSiscomex()
+        leituras = []
+        ler_planilha = conversor.ler_planilha
+        conversor.ler_planilha = lambda *a, **k: leituras.append(a) or ler_planilha(*a, **k)
+        saida = conversor.converter(planilha_teste(), os.path.join(pasta, "multi.zip"),
+                                    modo="multi", modos=["post", "completo", "api_put"])
+        assert saida and len(leituras) == 1, leituras
+        with zipfile.ZipFile(saida) as zf:
+            assert sorted(zf.namelist()) == ["CATALOGO_API_PUT.json", "CATALOGO_COMPLETO.json",
+                                             "CATALOGO_POST.json"], zf.namelist()
+            for modo in ("post", "completo", "api_put"):
+                individual = ConversorCatalogoSiscomex().converter(
+                    planilha_teste(), os.path.join(pasta, f"{modo}.json"), modo=modo)
+                with open(individual, "rb") as f:
+                    assert zf.read(f"CATALOGO{SUFIXOS_MODO[modo]}.json") == f.read(), modo
+        assert ConversorCatalogoSiscomex().converter(
+            planilha_teste(), os.path.join(pasta, "x.zip"), modo="multi", modos=["post", "xyz"]) is None
+
+    cliente = web.app.test_client()
+    resposta = enviar_planilha(cliente, '/converter', planilha_teste(), modo='multi', modos='completo,post')
+    dados = resposta.get_json()
+    try:
+        assert resposta.status_code == 200, dados
+        assert dados['modos'] == ['COMPLETO', 'POST'] and set(dados['arquivos_download']) == {'completo', 'post'}
+        assert dados['arquivo_download'].endswith('_CATALOGO_MULTI.zip')
+        assert 'codigo' in json.loads(dados['json_completo'])[0]  # JSON do primeiro formato pedido
+        download = cliente.get(f"/download/{dados['arquivo_download']}")
+        with zipfile.ZipFile(io.BytesIO(download.get_data())) as zf:
+            assert sorted(zf.namelist()) == ["CATALOGO_COMPLETO.json", "CATALOGO_POST.json"]
+            for modo, nome in dados['arquivos_download'].items():
+                with web.ARMAZEM.abrir(nome) as f:
+                    assert zf.read(f"CATALOGO{SUFIXOS_MODO[modo]}.json") == f.read(), modo
+        download.close()
+    finally:
+        remover_saidas(web, dados)
+    resposta = enviar_planilha(cliente, '/converter', planilha_teste(), modo='multi', modos='post,xyz')
+    assert resposta.status_code == 400, resposta.get_json()
+
+    print("✅ TESTE 17 PASSOU: uma leitura, um arquivo por formato igual ao do modo individual.")
+    return True
+
+
+def teste_18_vigiar_pasta():
+    """Testa a vigilância de pasta: só reconverte planilhas com conteúdo ou opções novos."""
+    print("\n" + "=" * 70)
+    print("TESTE 18: Vigilância de pasta (incremental por hash)")
+    print("=" * 70)
+
+    import shutil
+    import conversor_catalogo_siscomex as motor
+
+    def varrer(pasta, estado, **opcoes):
+        opcoes.setdefault('estabilidade_s', 0)
+        return motor.varrer_pasta_vigiada(pasta, estado, trabalhadores=1, silencioso=True, **opcoes)
+
+    with tempfile.TemporaryDirectory() as pasta:
+        planilha = os.path.join(pasta, "a.xlsx")
+        shutil.copy(planilha_teste(), planilha)
+
+        # Planilha ainda sendo gravada (mtime recente) fica para a próxima varredura
+        estado = {}
+        assert varrer(pasta, estado, estabilidade_s=3600) == [] and estado == {}
+
+        resultados = varrer(pasta, estado)
+        assert [(r['arquivo'], r['status'], r['saida']) for r in resultados] == \
+            [("a.xlsx", "ok", "a_CATALOGO_POST.json")], resultados
+        assert os.path.exists(os.path.join(pasta, "a_DIAGNOSTICO.json"))
+        hash_original = estado["a.xlsx"]["hash"]
+        assert hash_original == motor.hash_arquivo(planilha)
+
+        # Nada mudou; só o mtime mudou (mesmo hash): nada a converter
+        assert varrer(pasta, estado) == []
+        os.utime(planilha, (time.time() - 60, time.time() - 60))
+        assert varrer(pasta, estado) == []
+        assert estado["a.xlsx"]["assinatura"][1] == os.stat(planilha).st_mtime_ns
+
+        # Conteúdo novo ou opções novas: reconverte (e remove a saída que ficou obsoleta)
+        planilha_alterada(planilha, {(2, "denominacao"): "PRODUTO ALTERADO"})
+        assert [r['arquivo'] for r in varrer(pasta, estado)] == ["a.xlsx"]
+        assert estado["a.xlsx"]["hash"] != hash_original
+        assert [r['saida'] for r in varrer(pasta, estado, modo="completo")] == ["a_CATALOGO_COMPLETO.json"]
+        assert not os.path.exists(os.path.join(pasta, "a_CATALOGO_POST.json"))
+
+        # Estado persistido na pasta: a execução seguinte não reconverte o que já foi feito
+        convertidos = []
+        for _ in range(2):
+            motor.vigiar_pasta(pasta, modo="completo", uma_vez=True, ao_converter=convertidos.append,
+                               estabilidade_s=0, trabalhadores=1, silencioso=True)
+        assert [[r['arquivo'] for r in varredura] for varredura in convertidos] == [["a.xlsx"]], convertidos
+        assert os.path.exists(os.path.join(pasta, motor.ARQUIVO_ESTADO_VIGILANCIA))
+
+        # Planilha removida sai do estado
+        os.remove(planilha)
+        assert varrer(pasta, estado) == [] and estado == {}
+
+    print("✅ TESTE 18 PASSOU: debounce, hash, opções e estado persistido entre execuções.")
+    return True
+
+
+def teste_19_modelo_cache():
+    """Testa a planilha modelo em cache de memória e o ETag/304 de /modelo."""
+    print("\n" + "=" * 70)
+    print("TESTE 19: /modelo em cache com ETag")
+    print("=" * 70)
+
+    import conversor_catalogo_siscomex as motor
+
+    web = app_web()
+    cliente = web.app.test_client()
+    geradas = []
+    gerar = ConversorCatalogoSiscomex.gerar_planilha_modelo
+    ConversorCatalogoSiscomex.gerar_planilha_modelo = lambda self, *a, **k: geradas.append(a) or gerar(self, *a, **k)
+    try:
+        primeira = cliente.get('/modelo')
+        etag = primeira.headers['ETag']
+        assert primeira.status_code == 200 and etag and primeira.cache_control.max_age == 3600
+        assert openpyxl.load_workbook(io.BytesIO(primeira.get_data())).active.cell(row=1, column=1).value
+        segunda = cliente.get('/modelo')
+        assert segunda.get_data() == primeira.get_data() and segunda.headers['ETag'] == etag
+        assert cliente.get('/modelo', headers={'If-None-Match': etag}).status_code == 304
+        assert cliente.get('/modelo', headers={'If-None-Match': '"outra"'}).status_code == 200
+        assert geradas == [], "Modelo padrão não veio do cache (gerado na importação do app)"
+
+        com_atributos = cliente.get('/modelo?atributos=att_14545,ATT_14546')
+        assert com_atributos.status_code == 200 and com_atributos.headers['ETag'] != etag
+        assert cliente.get('/modelo?atributos=ATT_14545,ATT_14546').headers['ETag'] == com_atributos.headers['ETag']
+        assert len(geradas) == 1, geradas  # uma geração por combinação
+        assert cliente.get('/modelo?atributos=XYZ').status_code == 400
+
+        # Nova versão do layout invalida as ETags distribuídas
+        versao = motor.VERSAO_PLANILHA_MODELO
+        motor.VERSAO_PLANILHA_MODELO = versao + "-teste"
+        try:
+            assert motor.chave_planilha_modelo() != etag.strip('"')
+        finally:
+            motor.VERSAO_PLANILHA_MODELO = versao
+
+        # Cache limitado a MODELO_CACHE_MAX variações
+        limite = motor.MODELO_CACHE_MAX
+        motor.MODELO_CACHE_MAX = 2
+        try:
+            for codigo in ("ATT_1", "ATT_2", "ATT_3"):
+                motor.planilha_modelo_bytes([codigo])
+            assert len(motor._CACHE_MODELOS) <= 2
+        finally:
+            motor.MODELO_CACHE_MAX = limite
+    finally:
+        ConversorCatalogoSiscomex.gerar_planilha_modelo = gerar
+
+    print("✅ TESTE 19 PASSOU: uma geração por variação, ETag estável e 304 com If-None-Match.")
+    return True
+
+
+def teste_20_modelo_por_ncm():
+    """Testa a planilha modelo com os atributos do catálogo para os NCMs pedidos."""
+    print("\n" + "=" * 70)
+    print("TESTE 20: Planilha modelo por NCM")
+    print("=" * 70)
+
+    from conversor_catalogo_siscomex import atributos_modelo_ncm
+
+    web = app_web()
+    att = {'obrigatorio': False, 'multivalorado': False, 'modalidade': 'Importação', 'dominio': None}
+    catalogo = {
+        '90211010': {'ATT_14545': dict(att, obrigatorio=True), 'ATT_900': att, 'ATT_14556': att},
+        '90183929': {'ATT_14546': att, 'ATT_14556': dict(att, multivalorado=True), 'ATT_900': dict(att, obrigatorio=True)},
+    }
+    colunas = atributos_modelo_ncm(['90211010', '90183929', '11111111'], catalogo)
+    assert colunas == {
+        'simples': ['ATT_900', 'ATT_14545', 'ATT_14546'],  # ordem numérica
+        'multi': ['ATT_14556'],                            # multivalorado em algum NCM
+        'obrigatorios': ['ATT_900', 'ATT_14545'],          # obrigatório em algum NCM
+        'desconhecidos': ['11111111'],
+    }, colunas
+
+    cliente = web.app.test_client()
+    with catalogo_ncm(web, {}):
+        assert cliente.get('/modelo?ncm=90211010').status_code == 503  # sem catálogo carregado
+    with catalogo_ncm(web, catalogo):
+        resposta = cliente.get('/modelo?ncm=9018.39.29,90211010')
+        assert resposta.status_code == 200, resposta.get_json()
+        assert 'NCM_90183929_90211010' in resposta.headers['Content-Disposition']
+        ws = openpyxl.load_workbook(io.BytesIO(resposta.get_data()))['PRODUTOS']
+        cabecalhos = [celula.value for celula in ws[1]]
+        assert cabecalhos[-4:] == ['ATT_900', 'ATT_14545', 'ATT_14546', 'ATT_14556_MULTI'], cabecalhos
+        assert 'OBRIGATÓRIO' in ws.cell(row=2, column=cabecalhos.index('ATT_14545') + 1).value
+        assert 'OBRIGATÓRIO' not in ws.cell(row=2, column=cabecalhos.index('ATT_14546') + 1).value
+        # Mesmo conjunto de NCMs (em outra ordem) = mesma planilha em cache
+        assert cliente.get('/modelo?ncm=90211010,90183929').headers['ETag'] == resposta.headers['ETag']
+        assert cliente.get('/modelo?ncm=90211010').headers['ETag'] != resposta.headers['ETag']
+        assert cliente.get('/modelo?ncm=90211010,11111111').status_code == 404
+        assert cliente.get('/modelo?ncm=9021').status_code == 400
+
+    print("✅ TESTE 20 PASSOU: união dos atributos dos NCMs, _MULTI e obrigatórios destacados.")
+    return True
+
+
+def teste_21_dominios_atributos():
+    """Testa a validação de valores de atributos contra os domínios oficiais do catálogo."""
+    print("\n" + "=" * 70)
+    print("TESTE 21: Domínios oficiais dos atributos")
+    print("=" * 70)
+
+    from conversor_catalogo_siscomex import compilar_dominios, carregar_catalogo_ncm
+
+    dominios = compilar_dominios([
+        {'codigo': 'ATT_14540', 'dominio': [{'codigo': '01'}, {'codigo': ' 02 '}, {'codigo': None}]},
+        {'codigo': 'ATT_14556', 'dominio': [{'codigo': 11}, {'codigo': 12}]},
+        {'codigo': 'ATT_14545', 'dominio': []},
+    ])
+    assert dominios == {'ATT_14540': frozenset({'01', '02'}), 'ATT_14556': frozenset({'11', '12'})}, dominios
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, "catalogo.json")
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump({
+                'listaNcm': [
+                    {'codigoNcm': '9021.10.10', 'listaAtributos': [
+                        {'codigo': 'ATT_14540', 'obrigatorio': True},
+                        {'codigo': 'ATT_14556', 'multivalorado': True},
+                    ]},
+                    {'codigoNcm': '3006.40.12', 'listaAtributos': [{'codigo': 'ATT_14540'}]},
+                ],
+                'detalhesAtributos': [
+                    {'codigo': 'ATT_14540', 'dominio': [{'codigo': '01'}, {'codigo': '02'}]},
+                    {'codigo': 'ATT_14556', 'dominio': [{'codigo': '11'}, {'codigo': '12'}]},
+                ],
+            }, f)
+        catalogo = carregar_catalogo_ncm(caminho)
+        assert set(catalogo) == {'90211010', '30064012'}
+        # Um frozenset por atributo, compartilhado entre os NCMs
+        assert catalogo['90211010']['ATT_14540']['dominio'] is catalogo['30064012']['ATT_14540']['dominio']
+
+        # Planilha de teste dentro do domínio ('1' é normalizado para '01')
+        valida = planilha_alterada(os.path.join(pasta, "valida.xlsx"), {(3, "ATT_14540"): 1})
+        conversor = ConversorCatalogoSiscomex()
+        produtos = conversor.ler_planilha(valida, atributos_por_ncm=catalogo)
+        assert len(produtos) == 7 and conversor.erros == [], conversor.erros
+
+        # Valores fora do domínio (simples e multivalorado) são erros, com linha e valor
+        invalida = planilha_alterada(os.path.join(pasta, "invalida.xlsx"), {
+            (3, "ATT_14540"): "09", (4, "ATT_14556_MULTI"): "11;99", (7, "ATT_14540"): "X",
+        })
+        conversor = ConversorCatalogoSiscomex()
+        conversor.ler_planilha(invalida, atributos_por_ncm=catalogo)
+        assert len(conversor.erros) == 3, conversor.erros
+        assert conversor.erros[0].startswith("Linha 3") and "ATT_14540" in conversor.erros[0] \
+            and "'09'" in conversor.erros[0], conversor.erros
+        assert conversor.erros[1].startswith("Linha 4") and "'99'" in conversor.erros[1] \
+            and "'11'" not in conversor.erros[1], conversor.erros
+        assert conversor.erros[2].startswith("Linha 7") and "NCM 30064012" in conversor.erros[2]
+        validador = ConversorCatalogoSiscomex()
+        validador.validar_planilha(invalida, atributos_por_ncm=catalogo)
+        assert validador.erros == conversor.erros
+
+        # Na web, erro de domínio bloqueia a conversão (400, sem arquivo para download)
+        web = app_web()
+        cliente = web.app.test_client()
+        with catalogo_ncm(web, catalogo, versao="dominios-teste"):
+            resposta = enviar_planilha(cliente, '/converter', invalida)
+            dados = resposta.get_json()
+            assert resposta.status_code == 400 and dados['sucesso'] is False, dados
+            assert dados['erros'] == conversor.erros and 'arquivo_download' not in dados, dados
+            dados = enviar_planilha(cliente, '/validar', invalida).get_json()
+            assert dados['valido'] is False and dados['erros'] == conversor.erros, dados
+
+            resposta = enviar_planilha(cliente, '/converter', valida)
+            dados = resposta.get_json()
+            try:
+                assert resposta.status_code == 200 and dados['total_produtos'] == 7, dados
+                produto = json.loads(dados['json_completo'])[1]
+                assert {'atributo': 'ATT_14540', 'valor': '01'} in produto['atributos'], produto
+            finally:
+                remover_saidas(web, dados)
+
+    print("✅ TESTE 21 PASSOU: domínios compilados, erros por linha e conversão bloqueada com 400.")
+    return True
+
+
+def teste_22_atributos_ncm_http():
+    """Testa /atributos/<ncm>: conteúdo, ETag por versão do catálogo, 304 e cache."""
+    print("\n" + "=" * 70)
+    print("TESTE 22: /atributos/<ncm> com cache HTTP")
+    print("=" * 70)
+
+    web = app_web()
+    cliente = web.app.test_client()
+    att = {'obrigatorio': False, 'multivalorado': False, 'modalidade': 'Importação', 'dominio': None}
+    catalogo = {'90211010': {
+        'ATT_14556': dict(att, multivalorado=True, dominio=frozenset({'12', '11'})),
+        'ATT_900': dict(att, obrigatorio=True),
+    }}
+    with catalogo_ncm(web, {}):
+        assert cliente.get('/atributos/90211010').status_code == 503
+    with catalogo_ncm(web, catalogo, versao="v1"):
+        resposta = cliente.get('/atributos/9021.10.10')
+        dados = resposta.get_json()
+        assert resposta.status_code == 200 and dados['ncm'] == '90211010' and dados['versao_catalogo'] == 'v1'
+        assert [a['codigo'] for a in dados['atributos']] == ['ATT_900', 'ATT_14556'], dados
+        assert dados['atributos'][0]['obrigatorio'] and dados['atributos'][0]['dominio'] is None
+        assert dados['atributos'][1]['multivalorado'] and dados['atributos'][1]['dominio'] == ['11', '12']
+        etag = resposta.headers['ETag']
+        assert resposta.cache_control.no_cache and not resposta.cache_control.immutable
+
+        revalidada = cliente.get('/atributos/90211010', headers={'If-None-Match': etag})
+        assert revalidada.status_code == 304 and revalidada.get_data() == b'' and revalidada.headers['ETag'] == etag
+
+        # URL versionada (a de /ncm): immutable; versão antiga cai no no-cache
+        versionada = cliente.get('/atributos/90211010?v=v1')
+        assert versionada.cache_control.immutable and versionada.cache_control.max_age == 31536000
+        assert cliente.get('/atributos/90211010?v=v0').cache_control.no_cache
+        assert cliente.get('/atributos/90211020').status_code == 404
+        assert cliente.get('/atributos/9021').status_code == 400
+
+    # Catálogo novo: ETag muda e a cópia antiga não é mais aceita
+    with catalogo_ncm(web, catalogo, versao="v2"):
+        nova = cliente.get('/atributos/90211010', headers={'If-None-Match': etag})
+        assert nova.status_code == 200 and nova.headers['ETag'] != etag
+
+    print("✅ TESTE 22 PASSOU: ETag por versão do catálogo, 304, no-cache e URL versionada immutable.")
+    return True
+
+
+def teste_23_admissao():
+    """Testa a admissão de conversões: limite global (503), tamanho (413) e fila (202)."""
+    print("\n" + "=" * 70)
+    print("TESTE 23: Admissão de conversões")
+    print("=" * 70)
+
+    web = app_web()
+    cliente = web.app.test_client()
+    estimativa = web.estimar_custo_planilha(planilha_teste())
+    assert estimativa['linhas'] == 7 and estimativa['colunas'] == 19, estimativa
+    assert estimativa['celulas'] == 7 * 19 and estimativa['segundos'] >= 0
+
+    with tempfile.TemporaryDirectory() as pasta:
+        # Todas as vagas ocupadas: a espera se esgota e a resposta é 503
+        with contextlib.ExitStack() as vagas:
+            for _ in range(web.ADMISSAO_MAX_SIMULTANEAS):
+                assert vagas.enter_context(web.vaga_conversao(0))
+            with web.vaga_conversao(0.2) as obtida:
+                assert obtida is False
+            with valores_temporarios(web, ADMISSAO_ESPERA_S=0.2):
+                resposta = enviar_planilha(cliente, '/converter', planilha_unica(pasta))
+            assert resposta.status_code == 503 and 'ocupado' in resposta.get_json()['erro'], resposta.get_json()
+        with web.vaga_conversao(0) as obtida:
+            assert obtida, "Vaga não liberada"
+
+        # Acima do limite de linhas: recusada antes de ler a planilha
+        with valores_temporarios(web, ADMISSAO_MAX_LINHAS=5):
+            resposta = enviar_planilha(cliente, '/converter', planilha_unica(pasta))
+        assert resposta.status_code == 413 and '7 linhas' in resposta.get_json()['erro'], resposta.get_json()
+
+        # Acima do orçamento inline: 202 + job, com o mesmo resultado de /converter
+        with valores_temporarios(web, ADMISSAO_LINHAS_INLINE=5):
+            resposta = enviar_planilha(cliente, '/converter', planilha_unica(pasta))
+        dados = resposta.get_json()
+        assert resposta.status_code == 202 and dados['estimativa']['linhas'] == 7, dados
+        job = aguardar_job(cliente, dados['job'])
+        try:
+            assert job['status'] == 'concluido' and job['status_http'] == 200, job
+            assert job['resultado']['total_produtos'] == 7
+            assert cliente.get(f"/download/{job['resultado']['arquivo_download']}").status_code == 200
+        finally:
+            remover_saidas(web, job.get('resultado') or {})
+        assert cliente.get('/jobs/' + 'f' * 32).status_code == 404
+
+    print("✅ TESTE 23 PASSOU: 503 sem vaga, 413 acima do limite e fila para conversões grandes.")
+    return True
+
+
+def teste_24_cancelamento():
+    """Testa o cancelamento cooperativo: token no motor, 499 na web e cancelamento de job."""
+    print("\n" + "=" * 70)
+    print("TESTE 24: Cancelamento cooperativo")
+    print("=" * 70)
+
+    import conversor_catalogo_siscomex as motor
+
+    # Motor: o sinal é consultado a cada CANCELAMENTO_INTERVALO_LINHAS linhas
+    consultas = []
+
+    def sinal(linhas):
+        consultas.append(linhas)
+        return 'desconectado' if linhas >= 4 else None
+
+    with valores_temporarios(motor, CANCELAMENTO_INTERVALO_LINHAS=2):
+        conversor = ConversorCatalogoSiscomex(cancelamento=motor.TokenCancelamento(sinal))
+        try:
+            conversor.ler_planilha(planilha_teste())
+            assert False, "Leitura não foi interrompida"
+        except motor.ConversaoCancelada as e:
+            assert e.motivo == 'desconectado'
+    assert consultas == [2, 4], consultas
+    token = motor.TokenCancelamento(prazo_s=0.01)
+    time.sleep(0.02)
+    try:
+        token.verificar()
+        assert False, "Prazo não expirou"
+    except motor.ConversaoCancelada as e:
+        assert e.motivo == 'prazo'
+
+    web = app_web()
+    cliente = web.app.test_client()
+    with tempfile.TemporaryDirectory() as pasta:
+        planilha = planilha_unica(pasta)
+
+        # Cliente desconectado: 499, nada gravado e nada guardado para reaproveitar
+        sinal_desconexao = web.sinal_desconexao
+        web.sinal_desconexao = lambda environ: (lambda linhas: 'desconectado')
+        try:
+            resposta = enviar_planilha(cliente, '/converter', planilha)
+        finally:
+            web.sinal_desconexao = sinal_desconexao
+        assert resposta.status_code == 499 and resposta.get_json()['cancelado'] == 'desconectado', resposta.get_json()
+        resposta = enviar_planilha(cliente, '/converter', planilha)
+        assert resposta.status_code == 200, resposta.get_json()
+        remover_saidas(web, resposta.get_json())
+
+        # Prazo inline esgotado: 503 sugerindo a conversão assíncrona
+        with valores_temporarios(web, ADMISSAO_PRAZO_INLINE_S=1e-6):
+            resposta = enviar_planilha(cliente, '/converter', planilha_unica(pasta))
+        assert resposta.status_code == 503 and 'assincrono=true' in resposta.get_json()['erro'], resposta.get_json()
+
+        # Job cancelado antes de obter vaga: termina 'cancelado' sem saídas
+        with contextlib.ExitStack() as vagas:
+            for _ in range(web.ADMISSAO_MAX_SIMULTANEAS):
+                vagas.enter_context(web.vaga_conversao(0))
+            resposta = enviar_planilha(cliente, '/converter', planilha_unica(pasta), assincrono='true')
+            job_id = resposta.get_json()['job']
+            assert resposta.status_code == 202
+            cancelado = cliente.post(f"/jobs/{job_id}/cancel")
+            assert cancelado.status_code == 202 and cancelado.get_json()['status'] == 'cancelando'
+        job = aguardar_job(cliente, job_id)
+        # (cancelado na fila não chega a ter resultado; em execução, sai com 499)
+        assert job['status'] == 'cancelado' and job.get('status_http', 499) == 499, job
+        assert 'arquivo_download' not in (job.get('resultado') or {}), job
+        assert cliente.post(f"/jobs/{job_id}/cancel").status_code == 409
+
+    print("✅ TESTE 24 PASSOU: token por linhas e prazo, 499 ao desconectar e job cancelado.")
+    return True
+
+
+def teste_25_upload_em_disco():
+    """Testa o upload em streaming para o disco (hash incremental, limite e parciais)."""
+    print("\n" + "=" * 70)
+    print("TESTE 25: Upload em streaming para o disco")
+    print("=" * 70)
+
+    import glob
+    import hashlib
+    from werkzeug.exceptions import RequestEntityTooLarge
+
+    web = app_web()
+    parciais = lambda: set(glob.glob(os.path.join(web.UPLOAD_FOLDER, "_upload_*.part")))
+    antes = parciais()
+
+    # Destino do multipart: grava e calcula o SHA-256 bloco a bloco
+    destino = web.UploadEmDisco(limite=10)
+    destino.write(b"abc")
+    destino.write(b"def")
+    with tempfile.TemporaryDirectory() as pasta:
+        final = os.path.join(pasta, "recebido.bin")
+        assert destino.mover(final) == hashlib.sha256(b"abcdef").hexdigest()
+        with open(final, "rb") as f:
+            assert f.read() == b"abcdef"
+    destino = web.UploadEmDisco(limite=10)
+    destino.write(b"123456")
+    try:
+        destino.write(b"789012")
+        assert False, "Limite não aplicado"
+    except RequestEntityTooLarge:
+        pass
+    assert not os.path.exists(destino.caminho), "Parcial não apagado"
+
+    cliente = web.app.test_client()
+    # Corpo acima de MAX_CONTENT_LENGTH: 413 em JSON, sem ler o corpo
+    limite = web.app.config['MAX_CONTENT_LENGTH']
+    web.app.config['MAX_CONTENT_LENGTH'] = 1024
+    try:
+        resposta = enviar_planilha(cliente, '/converter', planilha_teste())
+    finally:
+        web.app.config['MAX_CONTENT_LENGTH'] = limite
+    assert resposta.status_code == 413 and resposta.get_json()['sucesso'] is False, resposta.get_data()
+    assert f"{web.MAX_UPLOAD_MB} MB" in resposta.get_json()['erro']
+
+    # Upload recusado pela rota (extensão) ou aceito: nenhum parcial sobra na pasta
+    assert enviar_planilha(cliente, '/converter', planilha_teste(), nome="catalogo.csv").status_code == 400
+    with tempfile.TemporaryDirectory() as pasta:
+        resposta = enviar_planilha(cliente, '/validar', planilha_unica(pasta))
+        assert resposta.status_code == 200 and resposta.get_json()['valido'], resposta.get_json()
+    assert parciais() == antes, parciais() - antes
+
+    print("✅ TESTE 25 PASSOU: hash incremental, 413 acima do limite e nenhum parcial esquecido.")
+    return True
+
+
+def teste_26_upload_em_blocos():
+    """Testa o upload retomável em blocos (/uploads) até a conversão."""
+    print("\n" + "=" * 70)
+    print("TESTE 26: Upload em blocos retomável")
+    print("=" * 70)
+
+    import hashlib
+
+    web = app_web()
+    cliente = web.app.test_client()
+    with tempfile.TemporaryDirectory() as pasta, valores_temporarios(web, UPLOAD_BLOCO_BYTES=4096):
+        with open(planilha_unica(pasta), "rb") as f:
+            conteudo = f.read()
+        blocos = [conteudo[i:i + 4096] for i in range(0, len(conteudo), 4096)]
+        assert len(blocos) >= 2, len(conteudo)
+
+        def abrir(sha256=hashlib.sha256(conteudo).hexdigest()):
+            resposta = cliente.post('/uploads', data={
+                'nome': 'catalogo.xlsx', 'tamanho': str(len(conteudo)), 'sha256': sha256, 'modo': 'post',
+            })
+            assert resposta.status_code == 201, resposta.get_json()
+            return resposta.get_json()['sessao']
+
+        def enviar(sessao, indice, dados=None):
+            dados = blocos[indice] if dados is None else dados
+            return cliente.put(f'/uploads/{sessao}/{indice}', data=dados,
+                               headers={'X-Checksum-SHA256': hashlib.sha256(blocos[indice]).hexdigest()})
+
+        # Validação na abertura da sessão
+        assert cliente.post('/uploads', data={'nome': 'catalogo.csv', 'tamanho': '10'}).status_code == 400
+        assert cliente.post('/uploads', data={'nome': 'catalogo.xlsx', 'tamanho': '0'}).status_code == 400
+        excesso = str(web.MAX_UPLOAD_BYTES + 1)
+        assert cliente.post('/uploads', data={'nome': 'catalogo.xlsx', 'tamanho': excesso}).status_code == 413
+
+        # Blocos fora de ordem, um corrompido e um repetido; a consulta mostra o que falta
+        sessao = abrir()
+        assert enviar(sessao, len(blocos) - 1).status_code == 200
+        corrompido = bytes(len(blocos[0]))
+        assert enviar(sessao, 0, corrompido).status_code == 422
+        assert enviar(sessao, len(blocos) - 1).status_code == 200
+        assert enviar(sessao, 0, blocos[0][:-1]).status_code == 400
+        estado = cliente.get(f'/uploads/{sessao}').get_json()
+        assert estado['blocos_recebidos'] == [len(blocos) - 1], estado
+        assert estado['total_blocos'] == len(blocos)
+
+        # Retomada: só os blocos que faltam; o último dispara a conversão
+        for indice in range(len(blocos) - 1):
+            resposta = enviar(sessao, indice)
+        dados = resposta.get_json()
+        assert resposta.status_code == 200 and dados['sucesso'], dados
+        assert dados['total_produtos'] == 7, dados
+        remover_saidas(web, dados)
+        assert cliente.get(f'/uploads/{sessao}').status_code == 404
+        assert not any(n.startswith(f"_sessao_{sessao}") for n in os.listdir(web.UPLOAD_FOLDER))
+        assert enviar(sessao, 0).status_code == 404
+
+        # Arquivo montado diferente do checksum informado: 422 e nada convertido
+        sessao = abrir(sha256="0" * 64)
+        for indice in range(len(blocos)):
+            resposta = enviar(sessao, indice)
+        assert resposta.status_code == 422 and 'checksum' in resposta.get_json()['erro'], resposta.get_json()
+
+        # Cancelamento descarta a sessão
+        sessao = abrir()
+        assert enviar(sessao, 0).status_code == 200
+        assert cliente.delete(f'/uploads/{sessao}').status_code == 200
+        assert cliente.get(f'/uploads/{sessao}').status_code == 404
+        assert not any(n.startswith(f"_sessao_{sessao}") for n in os.listdir(web.UPLOAD_FOLDER))
+
+    print("✅ TESTE 26 PASSOU: blocos fora de ordem, reenvio, retomada, checksum e cancelamento.")
+    return True
+
+
+def teste_27_faxineiro():
+    """Testa o índice de artefatos temporários: expiração, quota LRU e adoção."""
+    print("\n" + "=" * 70)
+    print("TESTE 27: Faxineiro de artefatos")
+    print("=" * 70)
+
+    web = app_web()
+    with tempfile.TemporaryDirectory() as pasta:
+        indice = web.IndiceArtefatos(pasta, ttl_s=60, quota_bytes=250)
+        indice._pid_faxineiro = os.getpid()  # Sem thread: as passagens são chamadas pelo teste
+
+        def arquivo(nome, tamanho=100):
+            caminho = os.path.join(pasta, nome)
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            with open(caminho, "wb") as f:
+                f.write(b"x" * tamanho)
+            return caminho
+
+        def nomes_indexados():
+            with indice._conexao() as db:
+                return {nome for (nome,) in db.execute('SELECT nome FROM artefatos')}
+
+        # Expiração: o vencido sai, o renovado fica
+        indice.registrar(arquivo("vencido.json"), ttl_s=0.01)
+        indice.registrar(arquivo("renovado.json"), ttl_s=0.01)
+        indice.registrar(os.path.join(pasta, "renovado.json"))
+        time.sleep(0.05)
+        assert indice.faxinar() == 1
+        assert not os.path.exists(os.path.join(pasta, "vencido.json"))
+        assert os.path.exists(os.path.join(pasta, "renovado.json"))
+        assert nomes_indexados() == {"renovado.json"}
+
+        # Quota: acima de 250 bytes sai o de acesso mais antigo; tocar() protege o baixado
+        time.sleep(0.01)
+        indice.registrar(arquivo("antigo.json"))
+        time.sleep(0.01)
+        indice.registrar(arquivo("recente.json"))
+        time.sleep(0.01)
+        indice.tocar("renovado.json")
+        assert indice.faxinar() == 1
+        assert not os.path.exists(os.path.join(pasta, "antigo.json"))
+        assert nomes_indexados() == {"renovado.json", "recente.json"}
+
+        # Entrada de arquivo já removido sai antes de qualquer arquivo existente
+        indice.registrar(arquivo("sumido.json"))
+        os.remove(os.path.join(pasta, "sumido.json"))
+        time.sleep(0.01)
+        indice.registrar(arquivo("novo.json", 40))
+        assert indice.faxinar() == 1
+        assert nomes_indexados() == {"renovado.json", "recente.json", "novo.json"}
+
+        # Adoção: órfãos (inclusive em shards) entram com validade da modificação;
+        # arquivos de controle ficam de fora
+        antigo = time.time() - 120
+        os.utime(arquivo("orfao_antigo.xlsx", 10), (antigo, antigo))
+        arquivo(os.path.join("ab", "cd", "orfao.json"), 10)
+        arquivo("_vaga_0", 0)
+        arquivo("_conversao_abc.lock", 0)
+        arquivo("_faxina.lock", 0)
+        assert indice.adotar() == 2
+        indexados = nomes_indexados()
+        assert {"orfao_antigo.xlsx", os.path.join("ab", "cd", "orfao.json")} <= indexados, indexados
+        assert not any(nome.startswith(web.ARTEFATOS_FIXOS) for nome in indexados), indexados
+        assert indice.adotar() == 0
+        assert indice.faxinar() == 1
+        assert not os.path.exists(os.path.join(pasta, "orfao_antigo.xlsx"))
+        assert os.path.exists(os.path.join(pasta, "_vaga_0"))
+
+    print("✅ TESTE 27 PASSOU: expirados removidos, renovados mantidos, quota LRU e adoção de órfãos.")
+    return True
+
+
 def main():
     print("\n" + "█" * 70)
     print("█  SUITE DE TESTES - CONVERSOR CATÁLOGO SISCOMEX                    █")
@@ -222,6 +1606,28 @@ def main():
     resultados["Compatibilidade"] = teste_3_validar_compatibilidade()
     resultados["Planilha Modelo"] = teste_4_gerar_modelo()
     resultados["Excel → JSON Completo"] = teste_5_excel_para_json_completo()
+    resultados["Serializador JSON"] = teste_6_serializador_identico()
+    resultados["Divisão em lotes"] = teste_7_lotes()
+    resultados["Atributos padrão"] = teste_8_injecao_padroes()
+    resultados["Amostragem"] = teste_9_amostragem()
+    resultados["Armazém e download"] = teste_10_armazem_download()
+    resultados["CLI em lote"] = teste_11_cli_lote()
+    resultados["Índice de NCMs"] = teste_12_indice_ncm()
+    resultados["Coalescência"] = teste_13_coalescencia()
+    resultados["Validação em streaming"] = teste_14_validacao_streaming()
+    resultados["Normalização memoizada"] = teste_15_normalizacao_memoizada()
+    resultados["Projeções compiladas"] = teste_16_projecoes_compiladas()
+    resultados["Modo multi"] = teste_17_modo_multi()
+    resultados["Vigilância de pasta"] = teste_18_vigiar_pasta()
+    resultados["Modelo em cache"] = teste_19_modelo_cache()
+    resultados["Modelo por NCM"] = teste_20_modelo_por_ncm()
+    resultados["Domínios de atributos"] = teste_21_dominios_atributos()
+    resultados["Atributos por NCM (HTTP)"] = teste_22_atributos_ncm_http()
+    resultados["Admissão"] = teste_23_admissao()
+    resultados["Cancelamento"] = teste_24_cancelamento()
+    resultados["Upload em disco"] = teste_25_upload_em_disco()
+    resultados["Upload em blocos"] = teste_26_upload_em_blocos()
+    resultados["Faxineiro"] = teste_27_faxineiro()
     
     # Resumo
     print("\n" + "=" * 70)
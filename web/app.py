@@ -4,48 +4,457 @@ Aplicação Web - Conversor Catálogo de Produtos Siscomex (CATP API)
 Flask + Interface moderna
 """
 
+import contextlib
+import gzip
+import hashlib
 import json
 import os
 import sys
 import io
+import re
+import socket
+import sqlite3
+import threading
+import time
 import uuid
 import tempfile
 import shutil
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+try:
+    import fcntl  # Trava entre workers (Linux/macOS); sem ela, não há coalescência
+except ImportError:
+    fcntl = None
+
 from flask import (
     Flask, render_template, request, send_file,
-    jsonify, redirect, url_for, flash, session
+    jsonify, redirect, url_for, flash, session, Request
 )
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 
 # Importar conversor: tenta local primeiro (deploy), depois diretório pai (dev)
 try:
-    from conversor_catalogo_siscomex import ConversorCatalogoSiscomex, ATRIBUTOS_LABELS
+    from conversor_catalogo_siscomex import (
+        ConversorCatalogoSiscomex, ATRIBUTOS_LABELS,
+        AMOSTRA_TAMANHO_PADRAO, AMOSTRA_ORCAMENTO_S, MODOS_SAIDA, SUFIXOS_MODO,
+        serializar_json, gravar_lotes_zip,
+        FORMATOS_SAIDA, EXTENSOES_FORMATO, carregar_catalogo_ncm,
+        converter_lote, extrair_planilhas_zip, LimiteZipExcedido, gravar_relatorio_lote_zip,
+        TRABALHADORES_LOTE_PADRAO, caminho_livre,
+        ler_vinculos_operador, ler_operadores_estrangeiros, planilha_modelo_bytes,
+        atributos_modelo_ncm, IndiceNcm, hash_arquivo, PlanoInjecao, OPCOES_PADRAO,
+        estimar_custo_planilha, TokenCancelamento, ConversaoCancelada, escrever_saida,
+        MENSAGEM_AMOSTRA_VAZIA,
+    )
 except ImportError:
     sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from conversor_catalogo_siscomex import ConversorCatalogoSiscomex, ATRIBUTOS_LABELS
+    from conversor_catalogo_siscomex import (
+        ConversorCatalogoSiscomex, ATRIBUTOS_LABELS,
+        AMOSTRA_TAMANHO_PADRAO, AMOSTRA_ORCAMENTO_S, MODOS_SAIDA, SUFIXOS_MODO,
+        serializar_json, gravar_lotes_zip,
+        FORMATOS_SAIDA, EXTENSOES_FORMATO, carregar_catalogo_ncm,
+        converter_lote, extrair_planilhas_zip, LimiteZipExcedido, gravar_relatorio_lote_zip,
+        TRABALHADORES_LOTE_PADRAO, caminho_livre,
+        ler_vinculos_operador, ler_operadores_estrangeiros, planilha_modelo_bytes,
+        atributos_modelo_ncm, IndiceNcm, hash_arquivo, PlanoInjecao, OPCOES_PADRAO,
+        estimar_custo_planilha, TokenCancelamento, ConversaoCancelada, escrever_saida,
+        MENSAGEM_AMOSTRA_VAZIA,
+    )
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'conversor-siscomex-catp-2026-secret')
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
 
 # Diretório temporário para uploads/downloads
 UPLOAD_FOLDER = os.path.join(tempfile.gettempdir(), 'siscomex_catp_uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# ============================================================================
+# ARTEFATOS TEMPORÁRIOS (índice de expiração + faxineiro em segundo plano)
+# ============================================================================
+
+ARTEFATOS_TTL_S = int(os.environ.get('ARTEFATOS_TTL_MIN', 60)) * 60  # Vida de uploads e saídas
+ARTEFATOS_QUOTA_BYTES = int(os.environ.get('ARTEFATOS_QUOTA_MB', 2048)) * 1024 * 1024
+FAXINA_INTERVALO_S = 60  # Entre passagens pelo índice
+FAXINA_ADOCAO_S = 3600   # Entre varreduras da pasta atrás de arquivos fora do índice
+ARTEFATOS_FIXOS = ('_vaga_', '_conversao_', '_artefatos.', '_faxina.')  # Fora da adoção
+
+
+class IndiceArtefatos:
+    """
+    Índice SQLite (pasta/_artefatos.sqlite3) dos arquivos temporários: nome,
+    validade, tamanho e último acesso, compartilhado pelos workers. As
+    requisições só registram e tocam entradas; quem apaga é o faxineiro, uma
+    thread por processo que remove os expirados e, acima da quota, os de
+    acesso mais antigo (LRU). Arquivos que escaparam do registro (processo
+    morto no meio de uma conversão, versões anteriores) são adotados por uma
+    varredura da pasta a cada FAXINA_ADOCAO_S, também fora das requisições.
+    """
+
+    def __init__(self, pasta: str, ttl_s: float = ARTEFATOS_TTL_S, quota_bytes: int = ARTEFATOS_QUOTA_BYTES):
+        self.pasta = pasta
+        self.ttl_s = ttl_s
+        self.quota_bytes = quota_bytes
+        self.caminho_db = os.path.join(pasta, '_artefatos.sqlite3')
+        self._pid_faxineiro = None
+        with self._conexao() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS artefatos ('
+                       'nome TEXT PRIMARY KEY, expira REAL NOT NULL, '
+                       'tamanho INTEGER NOT NULL, acesso REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS artefatos_expira ON artefatos (expira)')
+
+    @contextlib.contextmanager
+    def _conexao(self):
+        db = sqlite3.connect(self.caminho_db, timeout=10, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def registrar(self, *caminhos: str, ttl_s: float = None):
+        """Registra (ou renova) artefatos de `pasta`: removidos após `ttl_s` (padrão: o do índice)."""
+        agora = time.time()
+        linhas = []
+        for caminho in caminhos:
+            try:
+                tamanho = os.path.getsize(caminho)
+            except OSError:
+                tamanho = 0
+            linhas.append((os.path.relpath(caminho, self.pasta), agora + (ttl_s or self.ttl_s), tamanho, agora))
+        with self._conexao() as db:
+            db.executemany('INSERT OR REPLACE INTO artefatos VALUES (?, ?, ?, ?)', linhas)
+        self.iniciar_faxineiro()
+
+    def tocar(self, nome: str):
+        """Marca o acesso (download): o artefato sai por último quando a quota aperta."""
+        with self._conexao() as db:
+            db.execute('UPDATE artefatos SET acesso = ? WHERE nome = ?', (time.time(), nome))
+
+    def _apagar(self, nome: str):
+        caminho = os.path.join(self.pasta, nome)
+        if os.path.isdir(caminho):
+            shutil.rmtree(caminho, ignore_errors=True)
+        else:
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+    def faxinar(self) -> int:
+        """Remove os expirados e, acima da quota, os menos acessados. Returns: nº de entradas removidas."""
+        agora = time.time()
+        removidos = 0
+        with self._conexao() as db:
+            for (nome,) in db.execute('SELECT nome FROM artefatos WHERE expira <= ?', (agora,)).fetchall():
+                # Condicional: a entrada pode ter sido renovada desde o SELECT
+                if db.execute('DELETE FROM artefatos WHERE nome = ? AND expira <= ?', (nome, agora)).rowcount:
+                    self._apagar(nome)
+                    removidos += 1
+
+            excesso = db.execute('SELECT COALESCE(SUM(tamanho), 0) FROM artefatos').fetchone()[0] - self.quota_bytes
+            if excesso <= 0:
+                return removidos
+            # Entradas de arquivos já removidos pelas rotas saem primeiro (não ocupam disco)
+            existentes = []
+            for nome, tamanho in db.execute('SELECT nome, tamanho FROM artefatos ORDER BY acesso').fetchall():
+                if os.path.lexists(os.path.join(self.pasta, nome)):
+                    existentes.append((nome, tamanho))
+                else:
+                    db.execute('DELETE FROM artefatos WHERE nome = ?', (nome,))
+                    excesso -= tamanho
+                    removidos += 1
+            for nome, tamanho in existentes:
+                if excesso <= 0:
+                    break
+                db.execute('DELETE FROM artefatos WHERE nome = ?', (nome,))
+                self._apagar(nome)
+                excesso -= tamanho
+                removidos += 1
+        return removidos
+
+    def _entradas(self, pasta: str = None, nivel: int = 0):
+        """Entradas da pasta (nome relativo, DirEntry), descendo pelos shards <ab>/<cd>/."""
+        for entrada in os.scandir(pasta or self.pasta):
+            if nivel < 2 and len(entrada.name) == 2 and entrada.is_dir() \
+                    and all(c in '0123456789abcdef' for c in entrada.name):
+                yield from self._entradas(entrada.path, nivel + 1)
+            elif nivel or not entrada.name.startswith(ARTEFATOS_FIXOS):
+                yield os.path.relpath(entrada.path, self.pasta), entrada
+
+    def adotar(self) -> int:
+        """Registra os arquivos da pasta fora do índice, com validade contada da modificação."""
+        with self._conexao() as db:
+            conhecidos = {nome for (nome,) in db.execute('SELECT nome FROM artefatos')}
+            linhas = []
+            for nome, entrada in self._entradas():
+                if nome in conhecidos:
+                    continue
+                try:
+                    info = entrada.stat()
+                except OSError:
+                    continue
+                tamanho = info.st_size if entrada.is_file() else 0
+                linhas.append((nome, info.st_mtime + self.ttl_s, tamanho, info.st_mtime))
+            db.executemany('INSERT OR IGNORE INTO artefatos VALUES (?, ?, ?, ?)', linhas)
+        return len(linhas)
+
+    @contextlib.contextmanager
+    def _vez_do_faxineiro(self):
+        """Só um processo faxina por vez (trava fcntl em pasta/_faxina.lock)."""
+        if fcntl is None:
+            yield True
+            return
+        with open(os.path.join(self.pasta, '_faxina.lock'), 'a') as trava:
+            try:
+                fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(trava, fcntl.LOCK_UN)
+
+    def _laco_faxineiro(self):
+        proxima_adocao = 0.0
+        while True:
+            try:
+                with self._vez_do_faxineiro() as vez:
+                    if vez:
+                        if time.monotonic() >= proxima_adocao:
+                            self.adotar()
+                            proxima_adocao = time.monotonic() + FAXINA_ADOCAO_S
+                        self.faxinar()
+            except Exception as e:
+                print(f"[CATP] Erro na limpeza de {self.pasta}: {e}")
+            time.sleep(FAXINA_INTERVALO_S)
+
+    def iniciar_faxineiro(self):
+        """Inicia a thread do faxineiro neste processo (idempotente; refeita após fork)."""
+        if self._pid_faxineiro == os.getpid():
+            return
+        self._pid_faxineiro = os.getpid()
+        threading.Thread(target=self._laco_faxineiro, name='faxineiro', daemon=True).start()
+
+
+ARTEFATOS = IndiceArtefatos(UPLOAD_FOLDER)
+ARTEFATOS.iniciar_faxineiro()
+
+
+# ============================================================================
+# ARMAZÉM DE ARTEFATOS (ids completos, pastas em shards, JSON em gzip)
+# ============================================================================
+
+EXTENSOES_GZIP = ('.json', '.ndjson')  # Saídas gravadas comprimidas (<nome>.gz no disco)
+GZIP_NIVEL = 6  # JSON comprime ~10x já no nível 6; o 9 custa bem mais CPU e ganha pouco
+
+
+def novo_id_artefato() -> str:
+    """Id de uploads e saídas: uuid4 completo (32 hex)."""
+    return uuid.uuid4().hex
+
+
+class ArmazemArtefatos:
+    """
+    Uploads e saídas em disco. Um artefato tem nome lógico "<id>_<nome>" (o
+    que /download recebe) e fica em pasta/<id[:2]>/<id[2:4]>/, para nenhum
+    diretório acumular milhares de arquivos. Saídas JSON/NDJSON gravadas por
+    `gravar` vão comprimidas em gzip; `localizar` diz se estão assim, para a
+    rota entregar com Content-Encoding ou descomprimir.
+
+    Todo upload e toda saída passa por aqui: o nome vira caminho em
+    `caminho`/`gravar` e entra no índice de expiração por `registrar`. Os
+    arquivos de controle (travas, jobs, sessões de upload em blocos) não são
+    artefatos: ficam direto em UPLOAD_FOLDER, no disco local, pois dependem
+    de fcntl e de renomeação atômica entre os workers.
+    """
+
+    def __init__(self, pasta: str, indice: IndiceArtefatos = None):
+        self.pasta = pasta
+        self.indice = indice
+
+    def caminho(self, nome: str, criar: bool = True) -> str:
+        """Caminho em disco do artefato sem compressão (uploads, .xlsx, .zip); cria o shard."""
+        if not re.fullmatch(r'[0-9a-f]{32}_[^/\\]+', nome):
+            raise ValueError(f'Nome de artefato inválido: {nome}')
+        pasta = os.path.join(self.pasta, nome[:2], nome[2:4])
+        if criar:
+            os.makedirs(pasta, exist_ok=True)
+        return os.path.join(pasta, nome)
+
+    def _caminho_gravado(self, nome: str, criar: bool = True) -> str:
+        caminho = self.caminho(nome, criar)
+        return caminho + '.gz' if nome.endswith(EXTENSOES_GZIP) else caminho
+
+    @contextlib.contextmanager
+    def gravar(self, nome: str):
+        """Arquivo binário para escrever a saída `nome` (comprimida se JSON/NDJSON)."""
+        caminho = self._caminho_gravado(nome)
+        if caminho.endswith('.gz'):
+            with gzip.open(caminho, 'wb', compresslevel=GZIP_NIVEL) as f:
+                yield f
+        else:
+            with open(caminho, 'wb') as f:
+                yield f
+
+    def localizar(self, nome: str):
+        """(caminho em disco, comprimido?) do artefato, ou None se não existe (ou expirou)."""
+        try:
+            caminho = self._caminho_gravado(nome, criar=False)
+        except ValueError:
+            return None
+        if not os.path.exists(caminho):
+            return None
+        return caminho, caminho.endswith('.gz')
+
+    def existe(self, nome: str) -> bool:
+        return self.localizar(nome) is not None
+
+    def abrir(self, nome: str):
+        """Conteúdo original do artefato (descomprimido), para leitura binária."""
+        caminho, comprimido = self.localizar(nome) or (None, False)
+        if caminho is None:
+            raise FileNotFoundError(nome)
+        return gzip.open(caminho, 'rb') if comprimido else open(caminho, 'rb')
+
+    def registrar(self, *nomes: str):
+        """Inclui os artefatos no índice de expiração."""
+        if self.indice:
+            self.indice.registrar(*(self._caminho_gravado(nome, criar=False) for nome in nomes))
+
+    def tocar(self, nome: str):
+        """Marca o acesso no índice (LRU da quota)."""
+        if self.indice:
+            self.indice.tocar(os.path.relpath(self._caminho_gravado(nome, criar=False), self.pasta))
+
+
+ARMAZEM = ArmazemArtefatos(UPLOAD_FOLDER, ARTEFATOS)
+
+# ============================================================================
+# UPLOAD EM STREAMING (grava e calcula o hash enquanto o corpo chega)
+# ============================================================================
+
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', 200))  # Limite por arquivo enviado
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+# Corpo inteiro: arquivo + campos do formulário (Content-Length maior é recusado antes da leitura)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 1024 * 1024
+# .zip de /converter-lote: total descompactado (xlsx já é comprimido, a razão real é ~1)
+# e número de planilhas, contra zip bomb
+LOTE_RAZAO_DESCOMPACTADO = 4
+LOTE_MAX_DESCOMPACTADO_BYTES = MAX_UPLOAD_BYTES * LOTE_RAZAO_DESCOMPACTADO
+LOTE_MAX_PLANILHAS = int(os.environ.get('MAX_PLANILHAS_LOTE', 200))
+
+
+class UploadEmDisco:
+    """
+    Destino de um arquivo do multipart: cada bloco recebido é gravado em
+    UPLOAD_FOLDER/_upload_*.part e somado ao SHA-256, sem passar pela memória
+    nem por um temporário intermediário. O bloco que ultrapassa o limite
+    interrompe o upload (413) e apaga o parcial.
+    """
+
+    def __init__(self, limite: int = MAX_UPLOAD_BYTES):
+        fd, self.caminho = tempfile.mkstemp(prefix='_upload_', suffix='.part', dir=UPLOAD_FOLDER)
+        self.arquivo = os.fdopen(fd, 'w+b')
+        self.hash = hashlib.sha256()
+        self.tamanho = 0
+        self.limite = limite
+        self.movido = False
+
+    def write(self, dados: bytes) -> int:
+        self.tamanho += len(dados)
+        if self.limite and self.tamanho > self.limite:
+            self.descartar()
+            raise RequestEntityTooLarge(f'Arquivo excede o limite de {MAX_UPLOAD_MB} MB.')
+        self.hash.update(dados)
+        return self.arquivo.write(dados)
+
+    def __getattr__(self, nome):
+        return getattr(self.arquivo, nome)  # read, seek, tell, ... do arquivo em disco
+
+    def mover(self, destino: str) -> str:
+        """Renomeia o arquivo recebido para `destino` (mesmo disco: sem cópia). Retorna o SHA-256."""
+        self.arquivo.close()
+        os.replace(self.caminho, destino)
+        self.caminho = destino
+        self.movido = True
+        return self.hash.hexdigest()
+
+    def descartar(self):
+        """Apaga o parcial se não foi movido (upload abortado ou recusado pela rota)."""
+        self.arquivo.close()
+        if not self.movido:
+            try:
+                os.remove(self.caminho)
+            except OSError:
+                pass
+
+    def close(self):
+        self.descartar()
+
+
+class RequestUploadEmDisco(Request):
+    """Request cujos arquivos do multipart vão direto para UploadEmDisco."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if content_length and content_length > MAX_UPLOAD_BYTES:
+            raise RequestEntityTooLarge(f'Arquivo excede o limite de {MAX_UPLOAD_MB} MB.')
+        destino = UploadEmDisco()
+        self.__dict__.setdefault('_uploads_em_disco', []).append(destino)
+        return destino
+
+    def close(self):
+        super().close()
+        for destino in self.__dict__.get('_uploads_em_disco', ()):
+            destino.descartar()
+
+
+app.request_class = RequestUploadEmDisco
+
+
+def gravar_upload(arquivo, destino: str) -> str:
+    """Grava o arquivo enviado no caminho `destino` e retorna o SHA-256 do conteúdo."""
+    if isinstance(arquivo.stream, UploadEmDisco):
+        return arquivo.stream.mover(destino)
+    arquivo.save(destino)
+    return hash_arquivo(destino)
+
+
+def salvar_upload(arquivo, nome: str) -> str:
+    """Grava o arquivo enviado como o artefato `nome` do ARMAZEM (registrado) e retorna o SHA-256."""
+    hash_conteudo = gravar_upload(arquivo, ARMAZEM.caminho(nome))
+    ARMAZEM.registrar(nome)
+    return hash_conteudo
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_grande_demais(e):
+    return jsonify({
+        'sucesso': False,
+        'erro': f'Arquivo excede o limite de {MAX_UPLOAD_MB} MB.',
+    }), 413
+
 EXTENSOES_PERMITIDAS_EXCEL = {'.xlsx', '.xls'}
 EXTENSOES_PERMITIDAS_JSON = {'.json'}
 
+MENSAGEM_XLSX_INVALIDO = (
+    'O arquivo não é um .xlsx válido. Provavelmente está no formato antigo .xls renomeado para .xlsx. '
+    'Abra o arquivo no Excel, clique em Salvar Como e escolha "Pasta de Trabalho do Excel (.xlsx)".'
+)
+
 # ============================================================================
 # CARREGAR ATRIBUTOS VÁLIDOS POR NCM (arquivo oficial do Siscomex)
 # ============================================================================
 ATRIBUTOS_POR_NCM = {}  # { "90211010": { "ATT_14545": {...}, ... } }
+VERSAO_CATALOGO_NCM = ''  # hash do arquivo carregado (ETag de /atributos/<ncm>)
 
 def carregar_atributos_ncm():
     """Carrega o JSON oficial de atributos por NCM do Siscomex."""
-    global ATRIBUTOS_POR_NCM
+    global ATRIBUTOS_POR_NCM, VERSAO_CATALOGO_NCM
     # Tenta encontrar o arquivo em vários caminhos possíveis
     caminhos = [
         os.path.join(os.path.dirname(__file__), 'ATRIBUTOS_POR_NCM.json'),
@@ -54,18 +463,8 @@ def carregar_atributos_ncm():
     for caminho in caminhos:
         if os.path.exists(caminho):
             try:
-                with open(caminho, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                for ncm_entry in data.get('listaNcm', []):
-                    ncm_code = ncm_entry['codigoNcm'].replace('.', '')
-                    attrs = {}
-                    for att in ncm_entry.get('listaAtributos', []):
-                        attrs[att['codigo']] = {
-                            'obrigatorio': att.get('obrigatorio', False),
-                            'multivalorado': att.get('multivalorado', False),
-                            'modalidade': att.get('modalidade', ''),
-                        }
-                    ATRIBUTOS_POR_NCM[ncm_code] = attrs
+                ATRIBUTOS_POR_NCM.update(carregar_catalogo_ncm(caminho))
+                VERSAO_CATALOGO_NCM = hash_arquivo(caminho)[:32]
                 print(f"[CATP] Carregados atributos para {len(ATRIBUTOS_POR_NCM)} NCMs de {caminho}")
                 return
             except Exception as e:
@@ -75,88 +474,27 @@ def carregar_atributos_ncm():
 # Carregar ao iniciar
 carregar_atributos_ncm()
 
+# Índice dos NCMs do catálogo (autocompletar em /ncm e consulta em /atributos)
+INDICE_NCM = IndiceNcm(ATRIBUTOS_POR_NCM)
 
-def filtrar_atributos_por_ncm(produtos, avisos_extra=None):
-    """
-    Filtra atributos de cada produto para manter APENAS os válidos para o NCM.
-    Remove atributos que não existem na lista oficial e avisa.
-    Também injeta obrigatórios faltantes quando possível.
-    """
-    if not ATRIBUTOS_POR_NCM:
-        return  # Sem dados, não filtra
-    
-    if avisos_extra is None:
-        avisos_extra = []
-    
-    for i, produto in enumerate(produtos):
-        ncm = produto.get('ncm', '').strip()
-        if not ncm or ncm not in ATRIBUTOS_POR_NCM:
-            continue
-        
-        validos = ATRIBUTOS_POR_NCM[ncm]
-        nome = produto.get('denominacao', f'Produto {i+1}')[:50]
-        
-        # Filtrar atributos simples
-        atributos_orig = produto.get('atributos', [])
-        atributos_filtrados = []
-        removidos = []
-        for att in atributos_orig:
-            cod = att.get('atributo', '')
-            if cod in validos:
-                atributos_filtrados.append(att)
-            else:
-                removidos.append(cod)
-        
-        if removidos:
-            avisos_extra.append(
-                f"Produto '{nome}': Removidos atributos não válidos para NCM {ncm}: {', '.join(removidos)}"
-            )
-        produto['atributos'] = atributos_filtrados
-        
-        # Filtrar atributos multivalorados
-        multi_orig = produto.get('atributosMultivalorados', [])
-        multi_filtrados = []
-        removidos_multi = []
-        for att in multi_orig:
-            cod = att.get('atributo', '')
-            if cod in validos and validos[cod].get('multivalorado'):
-                multi_filtrados.append(att)
-            elif cod in validos and not validos[cod].get('multivalorado'):
-                # Atributo existe mas não é multivalorado - converter para simples
-                valores = att.get('valores', [])
-                if valores:
-                    atributos_filtrados.append({
-                        'atributo': cod,
-                        'valor': valores[0]
-                    })
-                    avisos_extra.append(
-                        f"Produto '{nome}': {cod} convertido de multivalorado para simples"
-                    )
-            else:
-                removidos_multi.append(cod)
-        
-        if removidos_multi:
-            avisos_extra.append(
-                f"Produto '{nome}': Removidos atributos multi não válidos para NCM {ncm}: {', '.join(removidos_multi)}"
-            )
-        produto['atributosMultivalorados'] = multi_filtrados
-        produto['atributos'] = atributos_filtrados
-        
-        # Verificar obrigatórios faltantes
-        existentes = {a.get('atributo') for a in produto['atributos']}
-        existentes_multi = {a.get('atributo') for a in produto['atributosMultivalorados']}
-        
-        for cod, info in validos.items():
-            if info['obrigatorio'] and cod not in existentes and cod not in existentes_multi:
-                avisos_extra.append(
-                    f"Produto '{nome}': FALTA atributo obrigatório {cod} para NCM {ncm}!"
-                )
+# Gerar a planilha modelo padrão ao iniciar (o primeiro GET /modelo já sai do cache)
+planilha_modelo_bytes()
 
 
 def extensao_permitida(filename, permitidas):
     return os.path.splitext(filename)[1].lower() in permitidas
 
 
+def plano_injecao_formulario(form=None):
+    """Atributos padrão do formulário (pais_origem_padrao, ..., operador_estrangeiro)."""
+    form = request.form if form is None else form
+    padroes = {
+        opcao: form.get(opcao if opcao == 'operador_estrangeiro' else f'{opcao}_padrao', '')
+        for opcao in OPCOES_PADRAO
+    }
+    return PlanoInjecao(padroes) or None
+
+
 def converter_xls_para_xlsx(caminho_xls: str) -> str:
     """Converte arquivo .xls (formato antigo) para .xlsx usando xlrd + openpyxl."""
     import xlrd
@@ -187,18 +525,333 @@ def converter_xls_para_xlsx(caminho_xls: str) -> str:
     return caminho_xlsx
 
 
-def limpar_arquivos_antigos():
-    """Remove arquivos temporários com mais de 1 hora."""
-    agora = datetime.now().timestamp()
+def converter_xls_artefato(nome_xls: str) -> str:
+    """
+    Converte o upload .xls `nome_xls` do ARMAZEM para .xlsx (registrado) e
+    remove o .xls, com ou sem sucesso. Returns: nome do artefato .xlsx.
+    """
+    caminho_xls = ARMAZEM.caminho(nome_xls, criar=False)
+    try:
+        converter_xls_para_xlsx(caminho_xls)
+    finally:
+        os.remove(caminho_xls)
+    nome_xlsx = nome_xls.rsplit('.', 1)[0] + '.xlsx'
+    ARMAZEM.registrar(nome_xlsx)
+    return nome_xlsx
+
+
+# ============================================================================
+# COALESCÊNCIA DE CONVERSÕES IDÊNTICAS (single-flight entre workers)
+# ============================================================================
+
+COALESCER_ESPERA_S = 120     # Espera máxima pela conversão idêntica em andamento (fila)
+COALESCER_ESPERA_INLINE_S = 10  # Inline: depois disso segue na fila (bem antes do prazo inline)
+COALESCER_RESULTADO_S = 600  # Por quanto tempo o resultado é reaproveitado
+
+
+def chave_conversao(caminho_excel: str, opcoes: dict, hash_conteudo: str = None) -> str:
+    """SHA-256 do conteúdo da planilha (`hash_conteudo`, se já calculado no upload) + opções da conversão."""
+    h = hashlib.sha256((hash_conteudo or hash_arquivo(caminho_excel)).encode())
+    h.update(json.dumps(opcoes, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _ler_resultado_conversao(caminho: str):
+    """Resultado gravado por outra execução, se ainda válido (recente e com os downloads no disco)."""
     try:
-        for f in os.listdir(UPLOAD_FOLDER):
-            caminho = os.path.join(UPLOAD_FOLDER, f)
-            if os.path.isfile(caminho):
-                idade = agora - os.path.getmtime(caminho)
-                if idade > 3600:  # 1 hora
-                    os.remove(caminho)
-    except Exception:
-        pass
+        if time.time() - os.path.getmtime(caminho) > COALESCER_RESULTADO_S:
+            return None
+        with open(caminho, 'r', encoding='utf-8') as f:
+            resultado = json.load(f)
+    except (OSError, ValueError):
+        return None
+    resposta = resultado.get('resposta') or {}
+    downloads = [resposta.get('arquivo_download'), *(resposta.get('arquivos_download') or {}).values()]
+    if any(nome and not ARMAZEM.existe(nome) for nome in downloads):
+        return None
+    return resultado
+
+
+@contextlib.contextmanager
+def conversao_unica(chave: str, espera_s: float = COALESCER_ESPERA_S,
+                    cancelamento: TokenCancelamento = None):
+    """
+    Single-flight por `chave` entre processos (gunicorn): uma trava fcntl em
+    UPLOAD_FOLDER/_conversao_<chave>.lock serializa as requisições idênticas.
+    A primeira converte e grava o resultado em _conversao_<chave>.json; as que
+    esperavam na trava recebem esse resultado sem reler a planilha. Só o .json
+    entra no índice de artefatos (expira em COALESCER_RESULTADO_S): a trava
+    fica fora da faxina e é apagada por quem a solta, e quem a obtém confere
+    se ainda é o arquivo do caminho.
+
+    A espera pela trava dura no máximo `espera_s` e verifica `cancelamento`
+    (ConversaoCancelada se o cliente desconectar ou o prazo acabar).
+
+    Yields: {'reaproveitado', 'ocupado', 'resposta', 'status'} — 'ocupado'
+    indica que a espera se esgotou sem a trava; quem converte preenche
+    'resposta' e 'status' (só 200 e 400 são reaproveitados: falhas, prazos e
+    cancelamentos não dizem nada sobre a planilha).
+    """
+    registro = {'reaproveitado': False, 'ocupado': False, 'resposta': None, 'status': None}
+    if fcntl is None:
+        yield registro
+        return
+
+    base = os.path.join(UPLOAD_FOLDER, f"_conversao_{chave}")
+    limite = time.monotonic() + espera_s
+    trava = None
+    while trava is None:
+        arquivo = open(base + '.lock', 'a')
+        try:
+            fcntl.flock(arquivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            arquivo.close()
+            if cancelamento is not None:
+                cancelamento.verificar()
+            if time.monotonic() > limite:
+                registro['ocupado'] = True
+                break
+            time.sleep(0.1)
+            continue
+        # Quem solta a trava apaga o arquivo: só vale se ainda for o do caminho
+        try:
+            if os.fstat(arquivo.fileno()).st_ino == os.stat(base + '.lock').st_ino:
+                trava = arquivo
+        except FileNotFoundError:
+            pass
+        if trava is None:
+            arquivo.close()
+    try:
+        anterior = _ler_resultado_conversao(base + '.json')
+        if anterior:
+            registro.update(anterior, reaproveitado=True)
+            yield registro
+            return
+        yield registro
+        if registro['resposta'] is not None and registro['status'] in (200, 400):
+            temporario = f"{base}.{os.getpid()}.tmp"
+            with open(temporario, 'w', encoding='utf-8') as f:
+                json.dump({'resposta': registro['resposta'], 'status': registro['status']},
+                          f, ensure_ascii=False)
+            os.replace(temporario, base + '.json')
+            ARTEFATOS.registrar(base + '.json', ttl_s=COALESCER_RESULTADO_S)
+    finally:
+        if trava is not None:
+            try:
+                os.remove(base + '.lock')
+            except OSError:
+                pass
+            fcntl.flock(trava, fcntl.LOCK_UN)
+            trava.close()
+
+
+# ============================================================================
+# ADMISSÃO DE CONVERSÕES (limite global, orçamento por requisição, fila)
+# ============================================================================
+
+# Conversões executando ao mesmo tempo, somando todos os workers (inline + fila)
+ADMISSAO_MAX_SIMULTANEAS = int(os.environ.get('MAX_CONVERSOES_SIMULTANEAS', 2))
+# Acima destes orçamentos (estimados pela dimensão das abas), a conversão vai para a fila
+ADMISSAO_LINHAS_INLINE = int(os.environ.get('MAX_LINHAS_INLINE', 20000))
+ADMISSAO_TEMPO_INLINE_S = float(os.environ.get('MAX_SEGUNDOS_INLINE', 20))
+# Planilhas acima deste limite são recusadas
+ADMISSAO_MAX_LINHAS = int(os.environ.get('MAX_LINHAS_PLANILHA', 200000))
+# Espera máxima por uma vaga antes de responder 503 (conversões inline)
+ADMISSAO_ESPERA_S = 15
+# Prazo de execução inline (abaixo do timeout de 30 s do gunicorn)
+ADMISSAO_PRAZO_INLINE_S = float(os.environ.get('MAX_SEGUNDOS_EXECUCAO_INLINE', 25))
+# Intervalo mínimo entre gravações de progresso de um job
+JOB_PULSO_S = 2.0
+
+
+@contextlib.contextmanager
+def vaga_conversao(espera_s: float = None):
+    """
+    Semáforo global entre workers: ADMISSAO_MAX_SIMULTANEAS travas fcntl
+    (UPLOAD_FOLDER/_vaga_<n>.lock). Yields True com a vaga obtida, ou False se
+    `espera_s` se esgotou (None = espera o quanto for preciso).
+    """
+    if fcntl is None:
+        yield True
+        return
+    limite = None if espera_s is None else time.monotonic() + espera_s
+    while True:
+        for n in range(ADMISSAO_MAX_SIMULTANEAS):
+            trava = open(os.path.join(UPLOAD_FOLDER, f"_vaga_{n}.lock"), 'a')
+            try:
+                fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                trava.close()
+                continue
+            try:
+                yield True
+            finally:
+                fcntl.flock(trava, fcntl.LOCK_UN)
+                trava.close()
+            return
+        if limite is not None and time.monotonic() > limite:
+            yield False
+            return
+        time.sleep(0.2)
+
+
+def sinal_desconexao(environ):
+    """
+    Sinal para TokenCancelamento: 'desconectado' quando o cliente fecha a
+    conexão (espia o socket do gunicorn sync / servidor de desenvolvimento sem
+    consumir dados). None se o servidor não expõe o socket.
+    """
+    conexao = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if conexao is None or not hasattr(socket, 'MSG_DONTWAIT'):
+        return None
+
+    def sinal(linhas):
+        try:
+            return 'desconectado' if conexao.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b'' else None
+        except (BlockingIOError, InterruptedError, ValueError):
+            return None  # Sem dados pendentes (conexão viva) ou socket TLS
+        except OSError:
+            return 'desconectado'
+    return sinal
+
+
+def resposta_cancelamento(motivo: str) -> tuple:
+    """(resposta, status) de uma conversão interrompida por ConversaoCancelada."""
+    if motivo == 'prazo':
+        return {
+            'sucesso': False,
+            'erro': f'A conversão excedeu o limite de {ADMISSAO_PRAZO_INLINE_S:g} s. '
+                    f'Envie novamente com assincrono=true para convertê-la em segundo plano.'
+        }, 503
+    return {'sucesso': False, 'erro': 'Conversão cancelada.', 'cancelado': motivo}, 499
+
+
+def conversao_coalescida(chave: str, caminho_excel: str, argumentos: tuple, espera_vaga_s: float = None,
+                         cancelamento: TokenCancelamento = None, espera_unica_s: float = None):
+    """
+    converter_planilha(caminho_excel, *argumentos) com single-flight por
+    `chave` e uma vaga do limite global. Returns: (resposta, status HTTP).
+
+    Com `espera_unica_s`, desiste se a conversão idêntica em andamento não
+    terminar nesse tempo e retorna (None, None) sem converter nem remover a
+    planilha (quem chamou decide, ex.: enfileirar). Sem ele, espera até
+    COALESCER_ESPERA_S e então converte por conta própria.
+    """
+    try:
+        with conversao_unica(chave, espera_unica_s or COALESCER_ESPERA_S, cancelamento) as registro:
+            if registro['reaproveitado']:
+                os.remove(caminho_excel)
+                return registro['resposta'], registro['status']
+            if registro['ocupado'] and espera_unica_s is not None:
+                return None, None
+            with vaga_conversao(espera_vaga_s) as obtida:
+                if not obtida:
+                    os.remove(caminho_excel)
+                    return {
+                        'sucesso': False,
+                        'erro': 'Servidor ocupado com outras conversões. Tente novamente em alguns segundos.'
+                    }, 503
+                try:
+                    resposta, status = converter_planilha(caminho_excel, *argumentos, cancelamento=cancelamento)
+                except ConversaoCancelada as e:
+                    if os.path.exists(caminho_excel):
+                        os.remove(caminho_excel)
+                    resposta, status = resposta_cancelamento(e.motivo)
+            registro.update(resposta=resposta, status=status)
+    except ConversaoCancelada as e:
+        # Cancelada ainda na espera pela conversão idêntica
+        if os.path.exists(caminho_excel):
+            os.remove(caminho_excel)
+        return resposta_cancelamento(e.motivo)
+    return resposta, status
+
+
+_EXECUTOR_JOBS = None  # Uma thread por worker, criada no primeiro job
+
+
+def _caminho_job(job_id: str) -> str:
+    return os.path.join(UPLOAD_FOLDER, f"_job_{job_id}.json")
+
+
+def ler_job(job_id: str):
+    """Estado do job gravado em UPLOAD_FOLDER (visível de qualquer worker)."""
+    try:
+        with open(_caminho_job(job_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _caminho_cancelamento_job(job_id: str) -> str:
+    return os.path.join(UPLOAD_FOLDER, f"_job_{job_id}.cancelar")
+
+
+def _gravar_job(job: dict):
+    temporario = f"{_caminho_job(job['id'])}.{os.getpid()}.tmp"
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(job, f, ensure_ascii=False)
+    os.replace(temporario, _caminho_job(job['id']))
+    ARTEFATOS.registrar(_caminho_job(job['id']))
+
+
+def _sinal_job(job: dict):
+    """
+    Sinal do token de um job: 'cancelado' quando /jobs/<id>/cancel (de qualquer
+    worker) cria o marcador; de quebra grava o progresso a cada JOB_PULSO_S.
+    """
+    marcador = _caminho_cancelamento_job(job['id'])
+    ultimo_pulso = [time.monotonic()]
+
+    def sinal(linhas):
+        if os.path.exists(marcador):
+            return 'cancelado'
+        if time.monotonic() - ultimo_pulso[0] >= JOB_PULSO_S:
+            ultimo_pulso[0] = time.monotonic()
+            job.update(linhas_lidas=linhas, atualizado_em=datetime.now().isoformat(timespec='seconds'))
+            _gravar_job(job)
+        return None
+    return sinal
+
+
+def _executar_job(job: dict, chave: str, caminho_excel: str, argumentos: tuple):
+    if os.path.exists(_caminho_cancelamento_job(job['id'])):
+        # Cancelado ainda na fila
+        os.remove(caminho_excel)
+        job.update(status='cancelado', concluido_em=datetime.now().isoformat(timespec='seconds'))
+        _gravar_job(job)
+        return
+    job.update(status='executando', iniciado_em=datetime.now().isoformat(timespec='seconds'))
+    _gravar_job(job)
+    try:
+        resposta, status = conversao_coalescida(chave, caminho_excel, argumentos,
+                                                cancelamento=TokenCancelamento(_sinal_job(job)))
+    except zipfile.BadZipFile:
+        resposta, status = {'sucesso': False, 'erro': MENSAGEM_XLSX_INVALIDO}, 400
+    except Exception as e:
+        resposta, status = {'sucesso': False, 'erro': f'Erro inesperado: {str(e)}'}, 500
+    job.update(
+        status='concluido' if status == 200 else 'cancelado' if status == 499 else 'erro',
+        concluido_em=datetime.now().isoformat(timespec='seconds'),
+        status_http=status,
+        resultado=resposta,
+    )
+    _gravar_job(job)
+
+
+def enfileirar_conversao(chave: str, caminho_excel: str, argumentos: tuple, estimativa: dict) -> dict:
+    """Agenda a conversão na fila do worker e retorna o job (estado 'na_fila')."""
+    global _EXECUTOR_JOBS
+    if _EXECUTOR_JOBS is None:
+        _EXECUTOR_JOBS = ThreadPoolExecutor(max_workers=1, thread_name_prefix='conversao')
+    job = {
+        'id': uuid.uuid4().hex,
+        'status': 'na_fila',
+        'criado_em': datetime.now().isoformat(timespec='seconds'),
+        'estimativa': estimativa,
+    }
+    _gravar_job(job)
+    _EXECUTOR_JOBS.submit(_executar_job, job, chave, caminho_excel, argumentos)
+    return job
 
 
 # ============================================================================
@@ -208,7 +861,6 @@ def limpar_arquivos_antigos():
 @app.route('/')
 def index():
     """Página principal."""
-    limpar_arquivos_antigos()
     return render_template('index.html')
 
 
@@ -228,158 +880,619 @@ def converter():
             return jsonify({'sucesso': False, 'erro': 'O formato antigo .xls não é suportado. Abra o arquivo no Excel e salve como .xlsx (Pasta de Trabalho do Excel).'}), 400
         return jsonify({'sucesso': False, 'erro': 'Formato inválido. Envie um arquivo .xlsx'}), 400
 
-    modo = request.form.get('modo', 'post')
-    if modo not in ['post', 'put', 'api_post', 'api_put', 'completo']:
-        return jsonify({'sucesso': False, 'erro': 'Modo inválido.'}), 400
-
-    # Valores padrão para colunas que podem não existir na planilha
-    cnpj_padrao = request.form.get('cnpj_padrao', '').strip()
-    modalidade_padrao = request.form.get('modalidade_padrao', '').strip()
-    pais_origem_padrao = request.form.get('pais_origem_padrao', '').strip()
-    validade_padrao = request.form.get('validade_padrao', '').strip()
-    controlado_padrao = request.form.get('controlado_padrao', '').strip()
-    perigoso_padrao = request.form.get('perigoso_padrao', '').strip()
-    fabricante_padrao = request.form.get('fabricante_padrao', '').strip()
-    embalagem_padrao = request.form.get('embalagem_padrao', '').strip()
-    operador_estrangeiro = request.form.get('operador_estrangeiro', '').strip()
+    opcoes, erro = opcoes_conversao(request.form)
+    if erro:
+        return jsonify({'sucesso': False, 'erro': erro}), 400
 
     try:
         # Salvar arquivo temporário
-        uid = str(uuid.uuid4())[:8]
-        nome_seguro = secure_filename(arquivo.filename)
-        caminho_excel = os.path.join(UPLOAD_FOLDER, f"{uid}_{nome_seguro}")
-        arquivo.save(caminho_excel)
+        uid = novo_id_artefato()
+        nome_excel = f"{uid}_{secure_filename(arquivo.filename)}"
+        hash_upload = salvar_upload(arquivo, nome_excel)
+    except Exception as e:
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro inesperado: {str(e)}'
+        }), 500
+
+    return iniciar_conversao(nome_excel, uid, hash_upload, opcoes, request.environ)
 
+
+def opcoes_conversao(form):
+    """
+    Opções de /converter lidas do formulário (também as guardadas numa sessão
+    de upload em blocos). Returns: (opcoes, None) ou (None, mensagem de erro).
+    """
+    modo = form.get('modo', 'post')
+    if modo not in MODOS_SAIDA + ['multi']:
+        return None, 'Modo inválido.'
+
+    # Formato do arquivo: pretty (indentado), compact ou ndjson (um produto por linha)
+    formato = form.get('formato', 'pretty').strip().lower() or 'pretty'
+    if formato not in FORMATOS_SAIDA:
+        return None, 'Formato inválido. Use pretty, compact ou ndjson.'
+
+    # Divisão opcional da saída em lotes (limite do upload em lote do portal)
+    try:
+        lote_max_produtos = int(form.get('lote_max_produtos') or 0)
+        lote_max_mb = float(form.get('lote_max_mb') or 0)
+    except ValueError:
+        return None, 'Tamanho de lote inválido.'
+    if lote_max_produtos < 0 or lote_max_mb < 0:
+        return None, 'Tamanho de lote inválido.'
+
+    # Abas: vazio = aba ativa; "todas" ou nomes separados por vírgula (lidas em paralelo)
+    abas = form.get('abas', '').strip()
+    if abas.lower() == 'todas':
+        abas = 'todas'
+    else:
+        abas = [a.strip() for a in abas.split(',') if a.strip()] or None
+
+    # Modo multi: vários formatos a partir de uma única leitura da planilha
+    if modo == 'multi':
+        modos = [m.strip() for v in form.getlist('modos') for m in v.split(',') if m.strip()]
+        modos = modos or list(MODOS_SAIDA)
+        if any(m not in MODOS_SAIDA for m in modos):
+            return None, 'Modo inválido em "modos".'
+        modos = list(dict.fromkeys(modos))
+    else:
+        modos = [modo]
+
+    # Valores padrão para colunas que podem não existir na planilha
+    defaults = {}
+    cnpj_padrao = form.get('cnpj_padrao', '').strip()
+    modalidade_padrao = form.get('modalidade_padrao', '').strip()
+    if cnpj_padrao:
+        defaults['cpfCnpjRaiz'] = cnpj_padrao
+    if modalidade_padrao:
+        defaults['modalidade'] = modalidade_padrao
+
+    return {
+        'modo': modo, 'modos': modos, 'formato': formato, 'abas': abas,
+        'lote_max_produtos': lote_max_produtos, 'lote_max_mb': lote_max_mb,
+        'defaults': defaults, 'injecao': plano_injecao_formulario(form),
+        # Auto-truncar campos longos?
+        'auto_truncar': form.get('auto_truncar', 'false').lower() == 'true',
+        'assincrono': form.get('assincrono', 'false').lower() == 'true',
+    }, None
+
+
+def iniciar_conversao(nome_excel: str, uid: str, hash_upload: str, opcoes: dict, environ):
+    """
+    Admite e executa (ou enfileira) a conversão da planilha já salva no
+    ARMAZEM como `nome_excel`. Returns: resposta Flask de /converter.
+    """
+    try:
         # Auto-converter .xls → .xlsx
-        ext = os.path.splitext(caminho_excel)[1].lower()
+        ext = os.path.splitext(nome_excel)[1].lower()
         if ext == '.xls':
             try:
-                caminho_xlsx = converter_xls_para_xlsx(caminho_excel)
-                os.remove(caminho_excel)
-                caminho_excel = caminho_xlsx
+                nome_excel = converter_xls_artefato(nome_excel)
             except Exception as e:
-                os.remove(caminho_excel)
                 return jsonify({
                     'sucesso': False,
                     'erro': f'Erro ao converter .xls para .xlsx: {str(e)}. Tente abrir no Excel e salvar como .xlsx manualmente.'
                 }), 400
+        caminho_excel = ARMAZEM.caminho(nome_excel, criar=False)
+
+        abas = opcoes['abas']
+        injecao = opcoes['injecao']
+
+        # Admissão: custo estimado pela dimensão das abas, sem carregar a planilha
+        try:
+            estimativa = estimar_custo_planilha(caminho_excel, abas)
+        except zipfile.BadZipFile:
+            raise
+        except Exception:
+            estimativa = None  # Estrutura inesperada: a leitura normal reporta o problema
+        if estimativa and estimativa['linhas'] > ADMISSAO_MAX_LINHAS:
+            os.remove(caminho_excel)
+            return jsonify({
+                'sucesso': False,
+                'erro': f"Planilha com {estimativa['linhas']} linhas excede o limite de "
+                        f"{ADMISSAO_MAX_LINHAS}. Divida o arquivo em partes menores.",
+            }), 413
+
+        # Conversões idênticas simultâneas (mesmo arquivo e opções) esperam uma única execução
+        chave = chave_conversao(caminho_excel, {
+            'modo': opcoes['modo'], 'modos': opcoes['modos'], 'formato': opcoes['formato'], 'abas': abas,
+            'lote_max_produtos': opcoes['lote_max_produtos'], 'lote_max_mb': opcoes['lote_max_mb'],
+            'defaults': opcoes['defaults'], 'atributos_padrao': injecao.padroes if injecao else {},
+            'auto_truncar': opcoes['auto_truncar'], 'catalogo': VERSAO_CATALOGO_NCM,
+        }, hash_upload)
+        argumentos = (uid, opcoes['modo'], opcoes['modos'], opcoes['formato'], abas, opcoes['defaults'],
+                      injecao, opcoes['auto_truncar'], opcoes['lote_max_produtos'], opcoes['lote_max_mb'])
+
+        def resposta_fila(mensagem):
+            job = enfileirar_conversao(chave, caminho_excel, argumentos, estimativa)
+            return jsonify({
+                'sucesso': True,
+                'mensagem': mensagem,
+                'job': job['id'],
+                'status': job['status'],
+                'estimativa': estimativa,
+            }), 202
+
+        # Conversões grandes (ou pedidas assim) vão para a fila: 202 + /jobs/<id>
+        if opcoes['assincrono'] or (estimativa and (estimativa['linhas'] > ADMISSAO_LINHAS_INLINE
+                                                    or estimativa['segundos'] > ADMISSAO_TEMPO_INLINE_S)):
+            return resposta_fila('Planilha grande: conversão agendada em segundo plano.')
+
+        # Interrompida se o cliente desconectar ou se passar do prazo inline
+        cancelamento = TokenCancelamento(sinal_desconexao(environ), ADMISSAO_PRAZO_INLINE_S)
+        resposta, status = conversao_coalescida(chave, caminho_excel, argumentos, ADMISSAO_ESPERA_S,
+                                                cancelamento, COALESCER_ESPERA_INLINE_S)
+        if status is None:
+            # Conversão idêntica (ex.: um job) ainda em andamento: o job reaproveita o resultado dela
+            return resposta_fila('Conversão idêntica em andamento: resultado agendado em segundo plano.')
+        return jsonify(resposta), status
+
+    except zipfile.BadZipFile:
+        return jsonify({'sucesso': False, 'erro': MENSAGEM_XLSX_INVALIDO}), 400
+    except Exception as e:
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Erro inesperado: {str(e)}'
+        }), 500
 
-        # Montar defaults
-        defaults = {}
-        if cnpj_padrao:
-            defaults['cpfCnpjRaiz'] = cnpj_padrao
-        if modalidade_padrao:
-            defaults['modalidade'] = modalidade_padrao
 
-        # Auto-truncar campos longos?
-        auto_truncar = request.form.get('auto_truncar', 'false').lower() == 'true'
+def converter_planilha(caminho_excel, uid, modo, modos, formato, abas, defaults, injecao,
+                       auto_truncar, lote_max_produtos, lote_max_mb, cancelamento=None):
+    """
+    Converte a planilha salva em UPLOAD_FOLDER e grava as saídas para download.
+    Remove a planilha ao terminar. Returns: (resposta, status HTTP).
 
-        # Converter
-        conversor = ConversorCatalogoSiscomex(auto_truncar=auto_truncar)
-        produtos = conversor.ler_planilha(caminho_excel, defaults=defaults)
+    Raises:
+        ConversaoCancelada: `cancelamento` acionado (nada é gravado)
+    """
+    # Converter
+    conversor = ConversorCatalogoSiscomex(auto_truncar=auto_truncar, injecao=injecao,
+                                          cancelamento=cancelamento)
+    produtos = conversor.ler_planilha(caminho_excel, defaults=defaults, abas=abas,
+                                      atributos_por_ncm=ATRIBUTOS_POR_NCM or None)
+    if cancelamento:
+        cancelamento.verificar()  # Última chance antes de gravar as saídas
+
+    if conversor.erros:
+        # Limpar
+        os.remove(caminho_excel)
+        return {
+            'sucesso': False,
+            'erro': 'Erros encontrados na planilha.',
+            'erros': conversor.erros,
+            'avisos': conversor.avisos
+        }, 400
 
-        # Injetar atributos obrigatórios nos produtos que não os possuem
-        for produto in produtos:
-            atributos = produto.get('atributos', [])
-            multi = produto.get('atributosMultivalorados', [])
-            codigos_simples = {a.get('atributo') for a in atributos}
-            codigos_multi = {a.get('atributo') for a in multi}
+    if not produtos:
+        os.remove(caminho_excel)
+        return {
+            'sucesso': False,
+            'erro': 'Nenhum produto encontrado na planilha. Verifique se os dados começam na linha correta.'
+        }, 400
+
+    # Gerar JSON (um por formato pedido)
+    saidas = {m: conversor.gerar_json(m, produtos) for m in modos}
+
+    # Salvar JSON temporário para download
+    arquivos_download = {}
+    for m, json_data in saidas.items():
+        nome_json = f"{uid}_CATALOGO_{m.upper()}{EXTENSOES_FORMATO[formato]}"
+        with ARMAZEM.gravar(nome_json) as destino:
+            escrever_saida(json_data, destino, formato)
+        arquivos_download[m] = nome_json
+
+    if modo == 'multi':
+        # Também um .zip com todos os formatos, para um único download
+        nome_download = f"{uid}_CATALOGO_MULTI.zip"
+        with zipfile.ZipFile(ARMAZEM.caminho(nome_download), 'w', zipfile.ZIP_DEFLATED) as zf:
+            for m, nome_json in arquivos_download.items():
+                with ARMAZEM.abrir(nome_json) as origem, \
+                        zf.open(f"CATALOGO{SUFIXOS_MODO[m]}{EXTENSOES_FORMATO[formato]}", 'w') as destino:
+                    shutil.copyfileobj(origem, destino)
+    else:
+        nome_download = arquivos_download[modo]
+    ARMAZEM.registrar(*{*arquivos_download.values(), nome_download})
+
+    # Lotes: um arquivo por lote (seq recomeça em 1) num .zip gravado em streaming
+    lotes = None
+    if lote_max_produtos or lote_max_mb:
+        nome_download = f"{uid}_CATALOGO_{modo.upper()}_LOTES.zip"
+        lotes = gravar_lotes_zip(
+            saidas, ARMAZEM.caminho(nome_download), formato,
+            max_produtos=lote_max_produtos or None,
+            max_bytes=int(lote_max_mb * 1024 * 1024) or None,
+        )
+        ARMAZEM.registrar(nome_download)
+
+    # Limpar Excel
+    os.remove(caminho_excel)
+
+    # Resposta (preview e JSON completo do primeiro formato)
+    json_data = saidas[modos[0]]
+    json_preview = serializar_json(json_data[:3], produtos=True)
+    if len(json_data) > 3:
+        json_preview += f"\n\n... e mais {len(json_data) - 3} produto(s)"
+
+    resposta = {
+        'sucesso': True,
+        'mensagem': f'{len(json_data)} produto(s) convertido(s) com sucesso!',
+        'total_produtos': len(json_data),
+        'modo': modo.upper(),
+        'formato': formato,
+        'arquivo_download': nome_download,
+        'preview': json_preview,
+        'json_completo': serializar_json(json_data, produtos=True),
+        'avisos': conversor.avisos
+    }
+    if modo == 'multi':
+        resposta['modos'] = [m.upper() for m in modos]
+        resposta['arquivos_download'] = arquivos_download
+    if lotes is not None:
+        resposta['lotes'] = lotes
+    return resposta, 200
+
+
+@app.route('/jobs/<job_id>')
+def consultar_job(job_id):
+    """
+    Estado de uma conversão em segundo plano (na_fila, executando, concluido,
+    erro, cancelado), com o progresso em 'linhas_lidas'. Ao terminar,
+    'resultado' traz a mesma resposta de /converter.
+    """
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return jsonify({'sucesso': False, 'erro': 'Job inválido.'}), 400
+    job = ler_job(job_id)
+    if job is None:
+        return jsonify({'sucesso': False, 'erro': 'Job não encontrado ou expirado.'}), 404
+    return jsonify(dict(job, sucesso=True))
 
-            # ATT_14545 — País de Origem (simples)
-            if pais_origem_padrao and 'ATT_14545' not in codigos_simples:
-                atributos.insert(0, {'atributo': 'ATT_14545', 'valor': pais_origem_padrao})
 
-            # ATT_14546 — Validade (simples)
-            if validade_padrao and 'ATT_14546' not in codigos_simples:
-                atributos.append({'atributo': 'ATT_14546', 'valor': validade_padrao})
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancelar_job(job_id):
+    """
+    Pede o cancelamento de um job (vale para qualquer worker: marcador em
+    UPLOAD_FOLDER). Na fila, ele nem começa; em execução, para em até
+    CANCELAMENTO_INTERVALO_LINHAS linhas, sem gravar saídas.
+    """
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return jsonify({'sucesso': False, 'erro': 'Job inválido.'}), 400
+    job = ler_job(job_id)
+    if job is None:
+        return jsonify({'sucesso': False, 'erro': 'Job não encontrado ou expirado.'}), 404
+    if job['status'] in ('concluido', 'erro', 'cancelado'):
+        return jsonify({'sucesso': False, 'erro': 'O job já terminou.', 'status': job['status']}), 409
+    open(_caminho_cancelamento_job(job_id), 'w').close()
+    ARTEFATOS.registrar(_caminho_cancelamento_job(job_id))
+    return jsonify({'sucesso': True, 'job': job_id, 'status': 'cancelando'}), 202
 
-            # ATT_14547 — Controlado (simples)
-            if controlado_padrao and 'ATT_14547' not in codigos_simples:
-                atributos.append({'atributo': 'ATT_14547', 'valor': controlado_padrao})
 
-            # ATT_14554 — Perigoso (simples)
-            if perigoso_padrao and 'ATT_14554' not in codigos_simples:
-                atributos.append({'atributo': 'ATT_14554', 'valor': perigoso_padrao})
+# ============================================================================
+# UPLOAD EM BLOCOS (retomável; a conversão começa no último bloco)
+# ============================================================================
 
-            # ATT_14555 — Fabricante/Exportador (simples)
-            if fabricante_padrao and 'ATT_14555' not in codigos_simples:
-                atributos.append({'atributo': 'ATT_14555', 'valor': fabricante_padrao})
+UPLOAD_BLOCO_BYTES = 8 * 1024 * 1024  # Tamanho de cada bloco (o último pode ser menor)
 
-            # ATT_14556 — Embalagem (MULTIVALORADO)
-            if embalagem_padrao and 'ATT_14556' not in codigos_multi:
-                multi.append({'atributo': 'ATT_14556', 'valores': [embalagem_padrao]})
 
-            produto['atributos'] = atributos
-            produto['atributosMultivalorados'] = multi
+def _caminho_sessao(sessao_id: str, extensao: str) -> str:
+    """UPLOAD_FOLDER/_sessao_<id>.json (metadados), .part (dados) ou .blocos (recebidos)."""
+    return os.path.join(UPLOAD_FOLDER, f"_sessao_{sessao_id}.{extensao}")
 
-            # codigoOperadorEstrangeiro
-            if operador_estrangeiro and not produto.get('codigoOperadorEstrangeiro'):
-                produto['codigoOperadorEstrangeiro'] = operador_estrangeiro
 
-        if conversor.erros:
-            # Limpar
-            os.remove(caminho_excel)
+def ler_sessao_upload(sessao_id: str):
+    """Metadados da sessão + blocos já recebidos (de qualquer worker), ou None."""
+    if not re.fullmatch(r'[0-9a-f]{32}', sessao_id):
+        return None
+    try:
+        with open(_caminho_sessao(sessao_id, 'json'), 'r', encoding='utf-8') as f:
+            sessao = json.load(f)
+        with open(_caminho_sessao(sessao_id, 'blocos'), 'r') as f:
+            sessao['blocos_recebidos'] = sorted({int(linha) for linha in f if linha.strip()})
+    except (OSError, ValueError):
+        return None
+    return sessao
+
+
+def _remover_sessao_upload(sessao_id: str):
+    for extensao in ('json', 'part', 'blocos'):
+        try:
+            os.remove(_caminho_sessao(sessao_id, extensao))
+        except OSError:
+            pass
+
+
+def _resumo_sessao(sessao: dict) -> dict:
+    return {
+        'sucesso': True,
+        'sessao': sessao['id'],
+        'tamanho_bloco': sessao['tamanho_bloco'],
+        'total_blocos': sessao['total_blocos'],
+        'blocos_recebidos': sessao['blocos_recebidos'],
+    }
+
+
+@app.route('/uploads', methods=['POST'])
+def iniciar_upload():
+    """
+    Abre uma sessão de upload em blocos para /converter. Form: nome, tamanho
+    (bytes), sha256 (opcional, do arquivo inteiro) e as mesmas opções de
+    /converter, validadas já aqui e guardadas para a conversão.
+    """
+    nome = request.form.get('nome', '')
+    if not nome or not extensao_permitida(nome, EXTENSOES_PERMITIDAS_EXCEL):
+        return jsonify({'sucesso': False, 'erro': 'Formato inválido. Envie um arquivo .xlsx'}), 400
+    try:
+        tamanho = int(request.form.get('tamanho', ''))
+    except ValueError:
+        return jsonify({'sucesso': False, 'erro': 'Tamanho do arquivo inválido.'}), 400
+    if tamanho <= 0:
+        return jsonify({'sucesso': False, 'erro': 'Tamanho do arquivo inválido.'}), 400
+    if tamanho > MAX_UPLOAD_BYTES:
+        return jsonify({'sucesso': False, 'erro': f'Arquivo excede o limite de {MAX_UPLOAD_MB} MB.'}), 413
+    sha256 = request.form.get('sha256', '').strip().lower()
+    if sha256 and not re.fullmatch(r'[0-9a-f]{64}', sha256):
+        return jsonify({'sucesso': False, 'erro': 'Checksum SHA-256 inválido.'}), 400
+
+    _, erro = opcoes_conversao(request.form)
+    if erro:
+        return jsonify({'sucesso': False, 'erro': erro}), 400
+
+    sessao = {
+        'id': uuid.uuid4().hex,
+        'nome': secure_filename(nome) or 'planilha.xlsx',
+        'tamanho': tamanho,
+        'sha256': sha256,
+        'tamanho_bloco': UPLOAD_BLOCO_BYTES,
+        'total_blocos': -(-tamanho // UPLOAD_BLOCO_BYTES),
+        'formulario': {
+            campo: valores for campo, valores in request.form.lists()
+            if campo not in ('nome', 'tamanho', 'sha256')
+        },
+        'criado_em': datetime.now().isoformat(timespec='seconds'),
+    }
+    with open(_caminho_sessao(sessao['id'], 'part'), 'wb') as f:
+        f.truncate(tamanho)  # Cada bloco é gravado na sua posição, em qualquer ordem
+    open(_caminho_sessao(sessao['id'], 'blocos'), 'w').close()
+    with open(_caminho_sessao(sessao['id'], 'json'), 'w', encoding='utf-8') as f:
+        json.dump(sessao, f, ensure_ascii=False)
+    ARTEFATOS.registrar(*(_caminho_sessao(sessao['id'], extensao) for extensao in ('json', 'part', 'blocos')))
+    sessao['blocos_recebidos'] = []
+    return jsonify(_resumo_sessao(sessao)), 201
+
+
+@app.route('/uploads/<sessao_id>')
+def consultar_upload(sessao_id):
+    """Blocos já recebidos: o cliente retoma o upload enviando só os que faltam."""
+    sessao = ler_sessao_upload(sessao_id)
+    if sessao is None:
+        return jsonify({'sucesso': False, 'erro': 'Sessão de upload não encontrada ou expirada.'}), 404
+    return jsonify(_resumo_sessao(sessao))
+
+
+@app.route('/uploads/<sessao_id>', methods=['DELETE'])
+def cancelar_upload(sessao_id):
+    """Descarta a sessão e os blocos recebidos."""
+    if ler_sessao_upload(sessao_id) is None:
+        return jsonify({'sucesso': False, 'erro': 'Sessão de upload não encontrada ou expirada.'}), 404
+    _remover_sessao_upload(sessao_id)
+    return jsonify({'sucesso': True, 'sessao': sessao_id})
+
+
+@app.route('/uploads/<sessao_id>/<int:indice>', methods=['PUT'])
+def enviar_bloco(sessao_id, indice):
+    """
+    Recebe o bloco `indice` (corpo bruto; cabeçalho X-Checksum-SHA256 com o
+    hash do bloco). Reenviar um bloco é inofensivo. O bloco que completa o
+    arquivo dispara a conversão e a resposta é a mesma de /converter.
+    """
+    sessao = ler_sessao_upload(sessao_id)
+    if sessao is None:
+        return jsonify({'sucesso': False, 'erro': 'Sessão de upload não encontrada ou expirada.'}), 404
+    if not 0 <= indice < sessao['total_blocos']:
+        return jsonify({'sucesso': False, 'erro': 'Índice de bloco inválido.'}), 400
+
+    inicio = indice * sessao['tamanho_bloco']
+    esperado = min(sessao['tamanho_bloco'], sessao['tamanho'] - inicio)
+    if request.content_length != esperado:
+        return jsonify({
+            'sucesso': False,
+            'erro': f'O bloco {indice} deve ter {esperado} bytes.',
+        }), 400
+    dados = request.stream.read(esperado)
+    checksum = request.headers.get('X-Checksum-SHA256', '').strip().lower()
+    if len(dados) != esperado or (checksum and hashlib.sha256(dados).hexdigest() != checksum):
+        return jsonify({
+            'sucesso': False,
+            'erro': f'Bloco {indice} corrompido (tamanho ou checksum não confere). Envie-o novamente.',
+        }), 422
+
+    if indice not in sessao['blocos_recebidos']:
+        try:
+            with open(_caminho_sessao(sessao_id, 'part'), 'r+b') as f:
+                f.seek(inicio)
+                f.write(dados)
+            with open(_caminho_sessao(sessao_id, 'blocos'), 'a') as f:
+                f.write(f"{indice}\n")
+            # Sessão ativa não expira
+            ARTEFATOS.registrar(*(_caminho_sessao(sessao_id, extensao) for extensao in ('json', 'part', 'blocos')))
+        except FileNotFoundError:
+            return jsonify({'sucesso': False, 'erro': 'Sessão de upload já finalizada.'}), 409
+        sessao = ler_sessao_upload(sessao_id)
+        if sessao is None:
+            return jsonify({'sucesso': False, 'erro': 'Sessão de upload já finalizada.'}), 409
+
+    if len(sessao['blocos_recebidos']) < sessao['total_blocos']:
+        return jsonify({
+            'sucesso': True,
+            'sessao': sessao_id,
+            'bloco': indice,
+            'blocos_recebidos': len(sessao['blocos_recebidos']),
+            'total_blocos': sessao['total_blocos'],
+        })
+
+    # Último bloco: o arquivo montado vira a planilha da conversão (a renomeação
+    # é atômica, então só um worker finaliza mesmo com blocos repetidos)
+    uid = novo_id_artefato()
+    nome_excel = f"{uid}_{sessao['nome']}"
+    caminho_excel = ARMAZEM.caminho(nome_excel)
+    try:
+        os.rename(_caminho_sessao(sessao_id, 'part'), caminho_excel)
+    except FileNotFoundError:
+        return jsonify({'sucesso': False, 'erro': 'Sessão de upload já finalizada.'}), 409
+    _remover_sessao_upload(sessao_id)
+    ARMAZEM.registrar(nome_excel)
+
+    hash_upload = hash_arquivo(caminho_excel)
+    if sessao['sha256'] and hash_upload != sessao['sha256']:
+        os.remove(caminho_excel)
+        return jsonify({
+            'sucesso': False,
+            'erro': 'O arquivo montado não confere com o checksum informado. Envie-o novamente.',
+        }), 422
+
+    opcoes, erro = opcoes_conversao(MultiDict(list(
+        (campo, valor) for campo, valores in sessao['formulario'].items() for valor in valores
+    )))
+    if erro:
+        os.remove(caminho_excel)
+        return jsonify({'sucesso': False, 'erro': erro}), 400
+    return iniciar_conversao(nome_excel, uid, hash_upload, opcoes, request.environ)
+
+
+@app.route('/converter-lote', methods=['POST'])
+def converter_lote_rota():
+    """
+    Converte várias planilhas (ou um .zip com elas) de uma vez, em paralelo.
+    Retorna o status de cada arquivo e um .zip com as saídas + relatório.
+    """
+    arquivos = [a for a in request.files.getlist('arquivos') if a.filename]
+    if not arquivos:
+        return jsonify({'sucesso': False, 'erro': 'Nenhum arquivo enviado.'}), 400
+
+    modo = request.form.get('modo', 'post')
+    if modo not in MODOS_SAIDA:
+        return jsonify({'sucesso': False, 'erro': 'Modo inválido.'}), 400
+
+    formato = request.form.get('formato', 'pretty').strip().lower() or 'pretty'
+    if formato not in FORMATOS_SAIDA:
+        return jsonify({'sucesso': False, 'erro': 'Formato inválido. Use pretty, compact ou ndjson.'}), 400
+
+    try:
+        trabalhadores = int(request.form.get('trabalhadores') or TRABALHADORES_LOTE_PADRAO)
+    except ValueError:
+        return jsonify({'sucesso': False, 'erro': 'Número de trabalhadores inválido.'}), 400
+    trabalhadores = max(1, min(trabalhadores, TRABALHADORES_LOTE_PADRAO))
+
+    defaults = {}
+    if request.form.get('cnpj_padrao', '').strip():
+        defaults['cpfCnpjRaiz'] = request.form['cnpj_padrao'].strip()
+    if request.form.get('modalidade_padrao', '').strip():
+        defaults['modalidade'] = request.form['modalidade_padrao'].strip()
+    auto_truncar = request.form.get('auto_truncar', 'false').lower() == 'true'
+
+    uid = novo_id_artefato()
+    pasta_entrada = ARMAZEM.caminho(f"{uid}_lote_entrada")
+    pasta_saida = ARMAZEM.caminho(f"{uid}_lote_saida")
+    os.makedirs(pasta_entrada)
+    try:
+        # Salvar planilhas (zips são extraídos; .xls convertidos para .xlsx)
+        planilhas = []
+        ignorados = []
+        for arquivo in arquivos:
+            nome_seguro = secure_filename(arquivo.filename) or 'planilha.xlsx'
+            ext = os.path.splitext(nome_seguro)[1].lower()
+            caminho = caminho_livre(os.path.join(pasta_entrada, nome_seguro), planilhas)
+            if ext == '.zip':
+                gravar_upload(arquivo, caminho)
+                # Limites valem para o envio inteiro (vários .zip somam)
+                extraido = sum(os.path.getsize(p) for p in planilhas)
+                try:
+                    planilhas.extend(extrair_planilhas_zip(
+                        caminho, pasta_entrada,
+                        max_bytes=max(LOTE_MAX_DESCOMPACTADO_BYTES - extraido, 0),
+                        max_arquivos=max(LOTE_MAX_PLANILHAS - len(planilhas), 0)))
+                except zipfile.BadZipFile:
+                    ignorados.append({'arquivo': arquivo.filename, 'status': 'erro',
+                                      'erros': ['Arquivo .zip inválido.']})
+                except LimiteZipExcedido as e:
+                    return jsonify({'sucesso': False, 'erro': str(e)}), 413
+                os.remove(caminho)
+            elif ext == '.xlsx':
+                gravar_upload(arquivo, caminho)
+                planilhas.append(caminho)
+            elif ext == '.xls':
+                gravar_upload(arquivo, caminho)
+                try:
+                    planilhas.append(converter_xls_para_xlsx(caminho))
+                except Exception as e:
+                    ignorados.append({'arquivo': arquivo.filename, 'status': 'erro',
+                                      'erros': [f'Erro ao converter .xls para .xlsx: {str(e)}']})
+                os.remove(caminho)
+            else:
+                ignorados.append({'arquivo': arquivo.filename, 'status': 'erro',
+                                  'erros': ['Formato inválido. Envie .xlsx, .xls ou .zip']})
+
+        if not planilhas:
             return jsonify({
                 'sucesso': False,
-                'erro': 'Erros encontrados na planilha.',
-                'erros': conversor.erros,
-                'avisos': conversor.avisos
+                'erro': 'Nenhuma planilha .xlsx encontrada no envio.',
+                'arquivos': ignorados,
             }), 400
-
-        if not produtos:
-            os.remove(caminho_excel)
+        if len(planilhas) > LOTE_MAX_PLANILHAS:
             return jsonify({
                 'sucesso': False,
-                'erro': 'Nenhum produto encontrado na planilha. Verifique se os dados começam na linha correta.'
-            }), 400
+                'erro': f'O lote tem mais de {LOTE_MAX_PLANILHAS} planilhas. Divida o envio em partes menores.',
+            }), 413
 
-        # Gerar JSON
-        if modo == 'post':
-            json_data = conversor.gerar_json_post(produtos)
-        elif modo == 'put':
-            json_data = conversor.gerar_json_put(produtos)
-        elif modo == 'api_post':
-            json_data = conversor.gerar_json_api_post(produtos)
-        elif modo == 'api_put':
-            json_data = conversor.gerar_json_api_put(produtos)
-        else:
-            json_data = conversor.gerar_json_completo(produtos)
-
-        # Salvar JSON temporário para download
-        nome_json = f"{uid}_CATALOGO_{modo.upper()}.json"
-        caminho_json = os.path.join(UPLOAD_FOLDER, nome_json)
-        with open(caminho_json, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, ensure_ascii=False, indent=2)
-
-        # Limpar Excel
-        os.remove(caminho_excel)
+        # Admissão: o lote roda inline, então a soma das planilhas cabe no orçamento inline
+        linhas = segundos = 0
+        for planilha in planilhas:
+            try:
+                estimativa = estimar_custo_planilha(planilha)
+            except Exception:
+                continue  # A leitura normal reporta o arquivo inválido
+            linhas += estimativa['linhas']
+            segundos += estimativa['segundos']
+        segundos /= min(trabalhadores, len(planilhas))
+        if linhas > ADMISSAO_MAX_LINHAS or segundos > ADMISSAO_TEMPO_INLINE_S:
+            return jsonify({
+                'sucesso': False,
+                'erro': f'Lote com {linhas} linhas (~{segundos:.0f} s) excede o limite de conversão '
+                        f'em lote. Divida o envio ou use /converter com assincrono=true.',
+            }), 413
 
-        # Resposta
-        json_preview = json.dumps(json_data[:3], ensure_ascii=False, indent=2)
-        if len(json_data) > 3:
-            json_preview += f"\n\n... e mais {len(json_data) - 3} produto(s)"
+        with vaga_conversao(ADMISSAO_ESPERA_S) as obtida:
+            if not obtida:
+                return jsonify({
+                    'sucesso': False,
+                    'erro': 'Servidor ocupado com outras conversões. Tente novamente em alguns segundos.'
+                }), 503
+            resultados = converter_lote(
+                planilhas, pasta_saida, modo, formato,
+                defaults=defaults, auto_truncar=auto_truncar,
+                atributos_por_ncm=ATRIBUTOS_POR_NCM or None,
+                trabalhadores=trabalhadores, injecao=plano_injecao_formulario(),
+            )
+        nome_download = f"{uid}_CATALOGO_LOTE.zip"
+        gravar_relatorio_lote_zip(resultados + ignorados, pasta_saida,
+                                  ARMAZEM.caminho(nome_download))
+        ARMAZEM.registrar(nome_download)
 
+        convertidos = sum(1 for r in resultados if r['status'] == 'ok')
         return jsonify({
-            'sucesso': True,
-            'mensagem': f'{len(json_data)} produto(s) convertido(s) com sucesso!',
-            'total_produtos': len(json_data),
+            'sucesso': convertidos > 0,
+            'mensagem': f'{convertidos} de {len(resultados) + len(ignorados)} planilha(s) convertida(s).',
+            'total_produtos': sum(r['produtos'] for r in resultados),
             'modo': modo.upper(),
-            'arquivo_download': nome_json,
-            'preview': json_preview,
-            'json_completo': json.dumps(json_data, ensure_ascii=False, indent=2),
-            'avisos': conversor.avisos
+            'formato': formato,
+            'arquivos': resultados + ignorados,
+            'arquivo_download': nome_download,
         })
 
-    except zipfile.BadZipFile:
-        return jsonify({
-            'sucesso': False,
-            'erro': 'O arquivo não é um .xlsx válido. Provavelmente está no formato antigo .xls renomeado para .xlsx. Abra o arquivo no Excel, clique em Salvar Como e escolha "Pasta de Trabalho do Excel (.xlsx)".'
-        }), 400
     except Exception as e:
-        return jsonify({
-            'sucesso': False,
-            'erro': f'Erro inesperado: {str(e)}'
-        }), 500
+        return jsonify({'sucesso': False, 'erro': f'Erro inesperado: {str(e)}'}), 500
+    finally:
+        shutil.rmtree(pasta_entrada, ignore_errors=True)
+        shutil.rmtree(pasta_saida, ignore_errors=True)
 
 
 @app.route('/json-para-excel', methods=['POST'])
@@ -396,16 +1509,17 @@ def json_para_excel():
         return jsonify({'sucesso': False, 'erro': 'Formato inválido. Envie um arquivo .json'}), 400
 
     try:
-        uid = str(uuid.uuid4())[:8]
-        nome_seguro = secure_filename(arquivo.filename)
-        caminho_json = os.path.join(UPLOAD_FOLDER, f"{uid}_{nome_seguro}")
-        arquivo.save(caminho_json)
+        uid = novo_id_artefato()
+        nome_json = f"{uid}_{secure_filename(arquivo.filename)}"
+        salvar_upload(arquivo, nome_json)
+        caminho_json = ARMAZEM.caminho(nome_json)
 
         nome_excel = f"{uid}_CATALOGO_EDITAVEL.xlsx"
-        caminho_excel = os.path.join(UPLOAD_FOLDER, nome_excel)
+        caminho_excel = ARMAZEM.caminho(nome_excel)
 
         conversor = ConversorCatalogoSiscomex()
         conversor.json_para_planilha(caminho_json, caminho_excel)
+        ARMAZEM.registrar(nome_excel)
 
         # Contar produtos
         with open(caminho_json, 'r', encoding='utf-8') as f:
@@ -429,20 +1543,46 @@ def json_para_excel():
 
 @app.route('/modelo')
 def baixar_modelo():
-    """Gera e baixa a planilha modelo."""
+    """
+    Baixa a planilha modelo. Gerada uma vez por combinação de atributos e
+    servida da memória, com ETag/304:
+    - ?ncm=90211010,90183929: só os atributos válidos para esses NCMs no
+      catálogo oficial (simples e _MULTI), obrigatórios destacados
+    - ?atributos=ATT_14545,ATT_14546: atributos simples escolhidos
+    """
     try:
-        uid = str(uuid.uuid4())[:8]
-        nome = f"MODELO_catalogo_siscomex.xlsx"
-        caminho = os.path.join(UPLOAD_FOLDER, f"{uid}_{nome}")
-
-        conversor = ConversorCatalogoSiscomex()
-        conversor.gerar_planilha_modelo(caminho)
+        nome = "MODELO_catalogo_siscomex.xlsx"
+        ncms = request.args.get('ncm', '').strip()
+        atributos = request.args.get('atributos', '').strip()
+
+        if ncms:
+            ncms = sorted({n.strip().replace('.', '') for n in ncms.split(',') if n.strip()})
+            if any(not re.fullmatch(r'\d{8}', n) for n in ncms):
+                return jsonify({'sucesso': False, 'erro': 'NCM inválido. Use 8 dígitos, separados por vírgula.'}), 400
+            if not ATRIBUTOS_POR_NCM:
+                return jsonify({'sucesso': False, 'erro': 'Catálogo de atributos por NCM não carregado.'}), 503
+            colunas = atributos_modelo_ncm(ncms, ATRIBUTOS_POR_NCM)
+            if colunas['desconhecidos']:
+                return jsonify({
+                    'sucesso': False,
+                    'erro': f"NCM não encontrado no catálogo: {', '.join(colunas['desconhecidos'])}"
+                }), 404
+            conteudo, chave = planilha_modelo_bytes(colunas['simples'], colunas['multi'], colunas['obrigatorios'])
+            nome = f"MODELO_catalogo_siscomex_NCM_{'_'.join(ncms[:5])}.xlsx"
+        else:
+            atributos_extras = [a.strip().upper() for a in atributos.split(',') if a.strip()] or None
+            if atributos_extras and any(not re.fullmatch(r'ATT_\d+', a) for a in atributos_extras):
+                return jsonify({'sucesso': False, 'erro': 'Atributos inválidos. Use códigos ATT_xxxxx.'}), 400
+            conteudo, chave = planilha_modelo_bytes(atributos_extras)
 
         return send_file(
-            caminho,
+            io.BytesIO(conteudo),
             as_attachment=True,
             download_name=nome,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            etag=chave,
+            conditional=True,
+            max_age=3600,
         )
     except Exception as e:
         return jsonify({'sucesso': False, 'erro': str(e)}), 500
@@ -452,10 +1592,12 @@ def baixar_modelo():
 def download(nome_arquivo):
     """Download de arquivos gerados."""
     nome_seguro = secure_filename(nome_arquivo)
-    caminho = os.path.join(UPLOAD_FOLDER, nome_seguro)
+    localizado = ARMAZEM.localizar(nome_seguro)
 
-    if not os.path.exists(caminho):
+    if localizado is None:
         return jsonify({'sucesso': False, 'erro': 'Arquivo não encontrado ou expirado.'}), 404
+    caminho, comprimido = localizado
+    ARMAZEM.tocar(nome_seguro)
 
     # Determinar nome de download amigável
     partes = nome_seguro.split('_', 1)
@@ -464,13 +1606,29 @@ def download(nome_arquivo):
     mimetype = 'application/json'
     if nome_seguro.endswith('.xlsx'):
         mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    elif nome_seguro.endswith('.zip'):
+        mimetype = 'application/zip'
+    elif nome_seguro.endswith('.ndjson'):
+        mimetype = 'application/x-ndjson'
 
-    return send_file(
-        caminho,
-        as_attachment=True,
-        download_name=nome_download,
-        mimetype=mimetype
-    )
+    if not comprimido:
+        return send_file(
+            caminho,
+            as_attachment=True,
+            download_name=nome_download,
+            mimetype=mimetype
+        )
+
+    # JSON guardado em gzip: vai como está para quem aceita (Content-Encoding),
+    # descomprimido em streaming para os demais
+    if request.accept_encodings['gzip'] > 0:  # 'gzip;q=0' recusa explicitamente
+        resposta = send_file(caminho, as_attachment=True, download_name=nome_download, mimetype=mimetype)
+        resposta.headers['Content-Encoding'] = 'gzip'
+    else:
+        resposta = send_file(ARMAZEM.abrir(nome_seguro), as_attachment=True,
+                             download_name=nome_download, mimetype=mimetype)
+    resposta.vary.add('Accept-Encoding')
+    return resposta
 
 
 @app.route('/validar', methods=['POST'])
@@ -486,13 +1644,71 @@ def validar():
             return jsonify({'sucesso': False, 'erro': 'O formato antigo .xls não é suportado. Abra o arquivo no Excel e salve como .xlsx.'}), 400
         return jsonify({'sucesso': False, 'erro': 'Formato inválido. Envie .xlsx'}), 400
 
+    # Valores padrão (mesmos do /converter) e limite opcional de erros
+    defaults = {}
+    cnpj_padrao = request.form.get('cnpj_padrao', '').strip()
+    modalidade_padrao = request.form.get('modalidade_padrao', '').strip()
+    if cnpj_padrao:
+        defaults['cpfCnpjRaiz'] = cnpj_padrao
+    if modalidade_padrao:
+        defaults['modalidade'] = modalidade_padrao
+
+    max_erros = request.form.get('max_erros', '').strip()
     try:
-        uid = str(uuid.uuid4())[:8]
-        caminho = os.path.join(UPLOAD_FOLDER, f"{uid}_{secure_filename(arquivo.filename)}")
-        arquivo.save(caminho)
+        max_erros = int(max_erros) if max_erros else None
+    except ValueError:
+        return jsonify({'sucesso': False, 'erro': 'max_erros deve ser um número inteiro.'}), 400
 
-        conversor = ConversorCatalogoSiscomex()
-        produtos = conversor.ler_planilha(caminho)
+    auto_truncar = request.form.get('auto_truncar', 'false').lower() == 'true'
+    rapida = request.form.get('rapida', 'false').lower() == 'true'
+
+    try:
+        uid = novo_id_artefato()
+        nome = f"{uid}_{secure_filename(arquivo.filename)}"
+        salvar_upload(arquivo, nome)
+        caminho = ARMAZEM.caminho(nome)
+
+        conversor = ConversorCatalogoSiscomex(auto_truncar=auto_truncar, injecao=plano_injecao_formulario())
+
+        if rapida:
+            # Verificação rápida por amostragem (estimativa de taxa de erro)
+            try:
+                tamanho_amostra = int(request.form.get('tamanho_amostra') or AMOSTRA_TAMANHO_PADRAO)
+                orcamento_s = float(request.form.get('orcamento_s') or AMOSTRA_ORCAMENTO_S)
+            except ValueError:
+                os.remove(caminho)
+                return jsonify({'sucesso': False, 'erro': 'tamanho_amostra/orcamento_s inválidos.'}), 400
+
+            amostragem = conversor.verificar_amostra(
+                caminho, defaults=defaults, tamanho_amostra=tamanho_amostra,
+                orcamento_s=orcamento_s, atributos_por_ncm=ATRIBUTOS_POR_NCM
+            )
+            os.remove(caminho)
+            if amostragem['inconclusivo'] and not conversor.erros:
+                return jsonify({
+                    'sucesso': False,
+                    'valido': None,
+                    'estimado': True,
+                    'erro': MENSAGEM_AMOSTRA_VAZIA,
+                    'amostragem': amostragem,
+                    'tempo_ms': amostragem['tempo_ms'],
+                    'erros': [],
+                    'avisos': conversor.avisos
+                })
+            return jsonify({
+                'sucesso': not conversor.erros,
+                'valido': not conversor.erros,
+                'estimado': True,
+                'amostragem': amostragem,
+                'tempo_ms': amostragem['tempo_ms'],
+                'erros': conversor.erros,
+                'avisos': conversor.avisos
+            })
+
+        resumo = conversor.validar_planilha(
+            caminho, defaults=defaults, max_erros=max_erros,
+            atributos_por_ncm=ATRIBUTOS_POR_NCM
+        )
 
         os.remove(caminho)
 
@@ -501,6 +1717,9 @@ def validar():
                 'sucesso': False,
                 'valido': False,
                 'total_produtos': 0,
+                'total_linhas': resumo['total_linhas'],
+                'interrompido': resumo['interrompido'],
+                'tempo_ms': resumo['tempo_ms'],
                 'erros': conversor.erros,
                 'avisos': conversor.avisos
             })
@@ -508,7 +1727,10 @@ def validar():
         return jsonify({
             'sucesso': True,
             'valido': True,
-            'total_produtos': len(produtos),
+            'total_produtos': resumo['linhas_validas'],
+            'total_linhas': resumo['total_linhas'],
+            'interrompido': resumo['interrompido'],
+            'tempo_ms': resumo['tempo_ms'],
             'erros': [],
             'avisos': conversor.avisos
         })
@@ -523,6 +1745,88 @@ def listar_atributos():
     return jsonify(ATRIBUTOS_LABELS)
 
 
+@app.route('/atributos/<ncm>')
+def atributos_do_ncm(ncm):
+    """
+    Atributos válidos para o NCM no catálogo oficial (obrigatório,
+    multivalorado, modalidade e domínio). A resposta só muda quando o catálogo
+    muda: ETag forte atrelada à versão do catálogo. A URL sem versão é
+    revalidada a cada uso (no-cache + ETag); a versionada (?v=<versao>, como
+    a de /ncm) é immutable, pois um catálogo novo muda a própria URL.
+    """
+    ncm = ncm.strip().replace('.', '')
+    if not re.fullmatch(r'\d{8}', ncm):
+        return jsonify({'sucesso': False, 'erro': 'NCM inválido. Use 8 dígitos.'}), 400
+    if not ATRIBUTOS_POR_NCM:
+        return jsonify({'sucesso': False, 'erro': 'Catálogo de atributos por NCM não carregado.'}), 503
+    if ncm not in INDICE_NCM:
+        return jsonify({'sucesso': False, 'erro': f'NCM não encontrado no catálogo: {ncm}'}), 404
+
+    etag = f"{VERSAO_CATALOGO_NCM}-{ncm}"
+    if request.if_none_match.contains(etag):
+        resposta = app.response_class(status=304)
+    else:
+        validos = ATRIBUTOS_POR_NCM[ncm]
+        resposta = jsonify({
+            'sucesso': True,
+            'ncm': ncm,
+            'versao_catalogo': VERSAO_CATALOGO_NCM,
+            'atributos': [
+                {
+                    'codigo': codigo,
+                    'nome': ATRIBUTOS_LABELS.get(codigo, codigo),
+                    'obrigatorio': bool(info.get('obrigatorio')),
+                    'multivalorado': bool(info.get('multivalorado')),
+                    'modalidade': info.get('modalidade', ''),
+                    'dominio': sorted(info['dominio']) if info.get('dominio') else None,
+                }
+                for codigo, info in sorted(
+                    validos.items(), key=lambda item: int(item[0][4:]) if item[0][4:].isdigit() else 0
+                )
+            ],
+        })
+    resposta.set_etag(etag)
+    resposta.cache_control.public = True
+    if request.args.get('v') == VERSAO_CATALOGO_NCM:
+        resposta.cache_control.max_age = 31536000
+        resposta.cache_control.immutable = True
+    else:
+        resposta.cache_control.no_cache = True
+    return resposta
+
+
+@app.route('/ncm')
+def buscar_ncm():
+    """
+    Autocompletar NCM: /ncm?prefix=9021 retorna os NCMs do catálogo que começam
+    com o prefixo (até `limite`, padrão 20), com a quantidade de atributos e a
+    URL versionada (cacheável) dos atributos em /atributos/<ncm>.
+    """
+    prefixo = request.args.get('prefix', '').strip().replace('.', '')
+    if not re.fullmatch(r'\d{1,8}', prefixo):
+        return jsonify({'sucesso': False, 'erro': 'Prefixo inválido. Use de 1 a 8 dígitos.'}), 400
+    try:
+        limite = max(1, min(int(request.args.get('limite', 20)), 200))
+    except ValueError:
+        return jsonify({'sucesso': False, 'erro': 'Limite inválido.'}), 400
+
+    ncms = INDICE_NCM.buscar_prefixo(prefixo, limite)
+    return jsonify({
+        'sucesso': True,
+        'prefixo': prefixo,
+        'total': INDICE_NCM.contar_prefixo(prefixo),
+        'ncms': [
+            {
+                'ncm': ncm,
+                'atributos': len(ATRIBUTOS_POR_NCM[ncm]),
+                'obrigatorios': sum(1 for info in ATRIBUTOS_POR_NCM[ncm].values() if info.get('obrigatorio')),
+                'url_atributos': url_for('atributos_do_ncm', ncm=ncm, v=VERSAO_CATALOGO_NCM),
+            }
+            for ncm in ncms
+        ],
+    })
+
+
 @app.route('/vincular-operador', methods=['POST'])
 def vincular_operador():
     """Gera JSON para vincular operador estrangeiro aos produtos."""
@@ -537,127 +1841,28 @@ def vincular_operador():
     if ext not in {'.xlsx', '.xls'}:
         return jsonify({'sucesso': False, 'erro': 'Formato inválido. Envie um arquivo .xlsx ou .xls'}), 400
 
-    cnpj_raiz = request.form.get('cnpj_raiz_vincular', '').strip().replace('.', '').replace('-', '').replace('/', '')
+    cnpj_raiz = request.form.get('cnpj_raiz_vincular', '')
     codigo_pais_form = request.form.get('codigo_pais_vincular', '').strip()
 
     try:
-        uid = str(uuid.uuid4())[:8]
-        nome_seguro = secure_filename(arquivo.filename)
-        caminho_excel = os.path.join(UPLOAD_FOLDER, f"{uid}_{nome_seguro}")
-        arquivo.save(caminho_excel)
+        uid = novo_id_artefato()
+        nome_excel = f"{uid}_{secure_filename(arquivo.filename)}"
+        salvar_upload(arquivo, nome_excel)
 
         # Auto-converter .xls → .xlsx
         if ext == '.xls':
             try:
-                caminho_xlsx = converter_xls_para_xlsx(caminho_excel)
-                os.remove(caminho_excel)
-                caminho_excel = caminho_xlsx
+                nome_excel = converter_xls_artefato(nome_excel)
             except Exception as e:
-                os.remove(caminho_excel)
                 return jsonify({'sucesso': False, 'erro': f'Erro ao converter .xls: {str(e)}'}), 400
+        caminho_excel = ARMAZEM.caminho(nome_excel, criar=False)
 
-        import openpyxl
-        wb = openpyxl.load_workbook(caminho_excel, read_only=True, data_only=True)
-        ws = wb.active
-
-        # Ler cabeçalhos
-        cabecalhos = []
-        for cell in ws[1]:
-            val = str(cell.value).strip().lower() if cell.value else ''
-            cabecalhos.append(val)
-
-        # Mapear colunas
-        ALIASES_CODIGO = ['codigo', 'código', 'code', 'produto', 'cod', 'codigo produto', 'código produto', 'codigo_produto',
-                         'codigoproduto', 'codigo do produto', 'código do produto']
-        ALIASES_OPERADOR = ['codigooperadorestrangeiro', 'operador', 'codigo operador', 'código operador',
-                           'operador estrangeiro', 'codigo_operador', 'cod operador', 'cod_operador']
-        ALIASES_PAIS = ['codigopais', 'codigo pais', 'código país', 'pais', 'país', 'country', 'codigo_pais']
-
-        idx_codigo = None
-        idx_operador = None
-        idx_pais = None
-        for i, cab in enumerate(cabecalhos):
-            cab_limpo = cab.replace('_', ' ')
-            if idx_codigo is None and (cab_limpo in ALIASES_CODIGO):
-                idx_codigo = i
-            if idx_operador is None and (cab_limpo in ALIASES_OPERADOR):
-                idx_operador = i
-            if idx_pais is None and (cab_limpo in ALIASES_PAIS):
-                idx_pais = i
-
-        if idx_codigo is None:
-            wb.close()
+        try:
+            vinculos, avisos = ler_vinculos_operador(caminho_excel, cnpj_raiz, codigo_pais_form)
+        except ValueError as e:
+            return jsonify({'sucesso': False, 'erro': str(e)}), 400
+        finally:
             os.remove(caminho_excel)
-            return jsonify({
-                'sucesso': False,
-                'erro': 'Coluna "codigo" (código do produto) não encontrada na planilha. Use nomes como: codigo, código, code, produto'
-            }), 400
-
-        if idx_operador is None:
-            wb.close()
-            os.remove(caminho_excel)
-            return jsonify({
-                'sucesso': False,
-                'erro': 'Coluna "codigoOperadorEstrangeiro" não encontrada. Use nomes como: operador, codigo operador, codigoOperadorEstrangeiro'
-            }), 400
-
-        # Ler dados
-        vinculos = []
-        avisos = []
-        for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-            if not row or all(v is None or str(v).strip() == '' for v in row):
-                continue
-
-            def limpar_val(idx):
-                if idx is not None and idx < len(row) and row[idx] is not None:
-                    val = str(row[idx]).strip()
-                    if val.endswith('.0'):
-                        try:
-                            float(val)
-                            val = val[:-2]
-                        except ValueError:
-                            pass
-                    return val
-                return ''
-
-            codigo = limpar_val(idx_codigo)
-            operador = limpar_val(idx_operador)
-            pais_excel = limpar_val(idx_pais) if idx_pais is not None else ''
-
-            if not codigo:
-                avisos.append(f'Linha {row_num}: código do produto vazio, ignorada.')
-                continue
-            if not operador:
-                avisos.append(f'Linha {row_num}: código do operador vazio, ignorada.')
-                continue
-
-            # País: prioridade Excel > formulário
-            codigo_pais = pais_excel if pais_excel else codigo_pais_form
-            if not codigo_pais:
-                avisos.append(f'Linha {row_num}: código do país vazio, ignorada.')
-                continue
-
-            try:
-                codigo_int = int(codigo)
-            except ValueError:
-                avisos.append(f'Linha {row_num}: código "{codigo}" não é numérico, ignorada.')
-                continue
-
-            vinculo = {
-                'seq': len(vinculos) + 1,
-                'codigoProduto': codigo_int,
-                'codigoPais': codigo_pais,
-                'codigoOperadorEstrangeiro': operador,
-                'conhecido': True,
-                'vincular': True
-            }
-            if cnpj_raiz:
-                vinculo['cpfCnpjRaiz'] = cnpj_raiz
-
-            vinculos.append(vinculo)
-
-        wb.close()
-        os.remove(caminho_excel)
 
         if not vinculos:
             return jsonify({
@@ -668,12 +1873,12 @@ def vincular_operador():
 
         # Salvar JSON
         nome_json = f"{uid}_VINCULAR_OPERADOR.json"
-        caminho_json = os.path.join(UPLOAD_FOLDER, nome_json)
-        with open(caminho_json, 'w', encoding='utf-8') as f:
-            json.dump(vinculos, f, ensure_ascii=False, indent=2)
+        with ARMAZEM.gravar(nome_json) as destino:
+            escrever_saida(vinculos, destino)
+        ARMAZEM.registrar(nome_json)
 
         # Preview
-        json_preview = json.dumps(vinculos[:5], ensure_ascii=False, indent=2)
+        json_preview = serializar_json(vinculos[:5])
         if len(vinculos) > 5:
             json_preview += f"\n\n... e mais {len(vinculos) - 5} vínculo(s)"
 
@@ -683,7 +1888,7 @@ def vincular_operador():
             'total': len(vinculos),
             'arquivo_download': nome_json,
             'preview': json_preview,
-            'json_completo': json.dumps(vinculos, ensure_ascii=False, indent=2),
+            'json_completo': serializar_json(vinculos),
             'avisos': avisos
         })
 
@@ -708,141 +1913,25 @@ def converter_operador():
     cnpj_raiz = request.form.get('cnpj_raiz_operador', '').strip()
 
     try:
-        uid = str(uuid.uuid4())[:8]
-        nome_seguro = secure_filename(arquivo.filename)
-        caminho_excel = os.path.join(UPLOAD_FOLDER, f"{uid}_{nome_seguro}")
-        arquivo.save(caminho_excel)
+        uid = novo_id_artefato()
+        nome_excel = f"{uid}_{secure_filename(arquivo.filename)}"
+        salvar_upload(arquivo, nome_excel)
 
         # Auto-converter .xls → .xlsx
         if ext == '.xls':
             try:
-                caminho_xlsx = converter_xls_para_xlsx(caminho_excel)
-                os.remove(caminho_excel)
-                caminho_excel = caminho_xlsx
+                nome_excel = converter_xls_artefato(nome_excel)
             except Exception as e:
-                os.remove(caminho_excel)
                 return jsonify({
                     'sucesso': False,
                     'erro': f'Erro ao converter .xls: {str(e)}'
                 }), 400
+        caminho_excel = ARMAZEM.caminho(nome_excel, criar=False)
 
-        import openpyxl
-        wb = openpyxl.load_workbook(caminho_excel, read_only=True, data_only=True)
-        ws = wb.active
-
-        # Ler cabeçalhos (primeira linha)
-        cabecalhos = []
-        for cell in ws[1]:
-            val = str(cell.value).strip() if cell.value else ''
-            cabecalhos.append(val.lower())
-
-        # Mapear colunas conhecidas
-        MAPA_COLUNAS = {
-            'nome': ['nome', 'name', 'razao social', 'razão social', 'empresa', 'company'],
-            'logradouro': ['logradouro', 'endereco', 'endereço', 'address', 'rua', 'street'],
-            'numero': ['numero', 'número', 'nro', 'num', 'number', 'no'],
-            'complemento': ['complemento', 'complement', 'comp', 'apto', 'sala'],
-            'codigoPais': ['codigopais', 'codigo pais', 'código país', 'pais', 'país', 'country', 'country code'],
-            'nomeCidade': ['cidade', 'city', 'nomecidade', 'nome cidade', 'municipio', 'município'],
-            'estado': ['estado', 'state', 'uf', 'provincia', 'província', 'province'],
-            'codigoPostal': ['cep', 'codigopostal', 'codigo postal', 'código postal', 'zip', 'zipcode', 'zip code', 'postal code', 'postal'],
-            'telefone': ['telefone', 'phone', 'tel', 'fone', 'telephone'],
-            'email': ['email', 'e-mail', 'mail'],
-            'cpfCnpjRaiz': ['cnpj', 'cpfcnpjraiz', 'cpf cnpj raiz', 'cnpj raiz', 'cpf/cnpj'],
-        }
-
-        mapa = {}  # campo_json -> indice_coluna
-        for campo, aliases in MAPA_COLUNAS.items():
-            for idx, cab in enumerate(cabecalhos):
-                if cab in aliases or cab.replace('_', ' ') in aliases:
-                    mapa[campo] = idx
-                    break
-
-        # Ler linhas de dados
-        operadores = []
-        avisos = []
-        for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-            if not row or all(v is None or str(v).strip() == '' for v in row):
-                continue
-
-            def get_val(campo):
-                idx = mapa.get(campo)
-                if idx is not None and idx < len(row) and row[idx] is not None:
-                    val = str(row[idx]).strip()
-                    if val.endswith('.0'):
-                        try:
-                            float(val)
-                            val = val[:-2]
-                        except ValueError:
-                            pass
-                    return val
-                return ''
-
-            nome = get_val('nome')
-            if not nome:
-                avisos.append(f'Linha {row_num}: sem nome, ignorada.')
-                continue
-
-            operador = {}
-
-            # cpfCnpjRaiz: da planilha ou do formulário
-            cpf_cnpj = get_val('cpfCnpjRaiz')
-            if not cpf_cnpj and cnpj_raiz:
-                cpf_cnpj = cnpj_raiz
-            if cpf_cnpj:
-                cpf_cnpj = cpf_cnpj.replace('.', '').replace('-', '').replace('/', '').replace(' ', '')
-                operador['cpfCnpjRaiz'] = cpf_cnpj
-
-            operador['nome'] = nome
-
-            # Endereço
-            endereco = {}
-            logradouro = get_val('logradouro')
-            if logradouro:
-                endereco['logradouro'] = logradouro
-            numero = get_val('numero')
-            if numero:
-                endereco['numero'] = numero
-            complemento = get_val('complemento')
-            if complemento:
-                endereco['complemento'] = complemento
-            if endereco:
-                operador['endereco'] = endereco
-
-            # País
-            cod_pais = get_val('codigoPais')
-            if cod_pais:
-                operador['codigoPais'] = cod_pais
-
-            # Cidade
-            cidade = get_val('nomeCidade')
-            if cidade:
-                operador['nomeCidade'] = cidade
-
-            # Estado
-            estado = get_val('estado')
-            if estado:
-                operador['estado'] = estado
-
-            # CEP
-            cep = get_val('codigoPostal')
-            if cep:
-                operador['codigoPostal'] = cep
-
-            # Telefone
-            telefone = get_val('telefone')
-            if telefone:
-                operador['telefone'] = telefone
-
-            # Email
-            email = get_val('email')
-            if email:
-                operador['email'] = email
-
-            operadores.append(operador)
-
-        wb.close()
-        os.remove(caminho_excel)
+        try:
+            operadores, avisos = ler_operadores_estrangeiros(caminho_excel, cnpj_raiz)
+        finally:
+            os.remove(caminho_excel)
 
         if not operadores:
             return jsonify({
@@ -853,12 +1942,12 @@ def converter_operador():
 
         # Salvar JSON para download
         nome_json = f"{uid}_OPERADORES_ESTRANGEIROS.json"
-        caminho_json = os.path.join(UPLOAD_FOLDER, nome_json)
-        with open(caminho_json, 'w', encoding='utf-8') as f:
-            json.dump(operadores, f, ensure_ascii=False, indent=2)
+        with ARMAZEM.gravar(nome_json) as destino:
+            escrever_saida(operadores, destino)
+        ARMAZEM.registrar(nome_json)
 
         # Preview
-        json_preview = json.dumps(operadores[:3], ensure_ascii=False, indent=2)
+        json_preview = serializar_json(operadores[:3])
         if len(operadores) > 3:
             json_preview += f"\n\n... e mais {len(operadores) - 3} operador(es)"
 
@@ -868,7 +1957,7 @@ def converter_operador():
             'total': len(operadores),
             'arquivo_download': nome_json,
             'preview': json_preview,
-            'json_completo': json.dumps(operadores, ensure_ascii=False, indent=2),
+            'json_completo': serializar_json(operadores),
             'avisos': avisos
         })
 